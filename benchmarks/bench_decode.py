@@ -0,0 +1,71 @@
+"""Compare the batched compiled decoder with one bond at a time.
+
+Usage: python benchmarks/bench_decode.py [n_bonds] [n_frames] [cores]
+"""
+import sys
+import time
+
+import numpy as np
+
+from mdstates.hmm import batch_viterbi
+from mdstates.hmm_cython import decode_cpp, viterbi_cpp
+
+
+def noisy_signals(n_bonds, n_frames, seed=0):
+    rng = np.random.RandomState(seed)
+    obs = np.cumsum(rng.rand(n_bonds, n_frames) < 0.001, axis=1) % 2
+    noise = rng.rand(n_bonds, n_frames) < 0.2
+    obs[noise] = 1 - obs[noise]
+    return obs.astype(np.int32)
+
+
+def best_of(func, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main(n_bonds=2000, n_frames=10000, cores=1):
+    start_p = np.array([0.5, 0.5])
+    trans_p = np.array([[0.999, 0.001], [0.001, 0.999]])
+    emission_p = np.array([[0.6, 0.4], [0.4, 0.6]])
+    obs = noisy_signals(n_bonds, n_frames)
+
+    def batched():
+        return decode_cpp(obs.copy(), start_p, trans_p, emission_p, 1)
+
+    def single():
+        return np.array([viterbi_cpp(row.copy(), start_p, trans_p,
+                                     emission_p) for row in obs])
+
+    t_single, true = best_of(single)
+    t_batched, test = best_of(batched)
+    assert np.array_equal(test, true)
+
+    def threaded():
+        return decode_cpp(obs.copy(), start_p, trans_p, emission_p, cores)
+
+    t_threaded, test = best_of(threaded)
+    assert np.array_equal(test, true)
+
+    # The compiled kernels use float parameters, so the NumPy decoder
+    # can differ from them on near ties.
+    t_numpy, test = best_of(lambda: batch_viterbi(obs, start_p, trans_p,
+                                                  emission_p), repeat=1)
+    agree = np.mean(test == true)
+
+    print("{} bonds x {} frames".format(n_bonds, n_frames))
+    print("one bond at a time: {:8.3f} s".format(t_single))
+    print("batched:            {:8.3f} s".format(t_batched))
+    print("speedup:            {:8.1f}x".format(t_single / t_batched))
+    print("batched, {:2d} cores: {:8.3f} s".format(cores, t_threaded))
+    print("speedup:            {:8.1f}x".format(t_single / t_threaded))
+    print("numpy batch_viterbi:{:8.3f} s ({:.4%} of frames agree)"
+          .format(t_numpy, agree))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:4]])
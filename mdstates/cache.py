@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from .contacts import SparseContacts, PackedContacts
+
+__all__ = ['ContactCache', 'cache_key']
+
+
+def cache_key(*parts):
+    """Hashes the inputs a cached result depends on.
+
+    Parameters
+    ----------
+    *parts
+        Any nesting of dicts, lists, tuples, sets, strings, numbers
+        and NumPy arrays. Dict keys may be frozensets, as the keys of
+        the cutoff and HMM parameter tables are.
+
+    Returns
+    -------
+    str
+        Hexadecimal SHA-256 digest of the canonical JSON form of
+        `parts`.
+    """
+    text = json.dumps(_canonical(parts), sort_keys=True,
+                      separators=(',', ':'))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _canonical(obj):
+    """Converts `obj` to something `json.dumps` always writes the same
+    way."""
+    if isinstance(obj, dict):
+        items = [(_canonical(key), _canonical(value))
+                 for key, value in obj.items()]
+        return [list(item) for item in
+                sorted(items, key=lambda item: json.dumps(item[0]))]
+    if isinstance(obj, (set, frozenset)):
+        return sorted((_canonical(value) for value in obj),
+                      key=json.dumps)
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(value) for value in obj]
+    if isinstance(obj, np.ndarray):
+        return [str(obj.dtype), list(obj.shape), obj.ravel().tolist()]
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+class ContactCache:
+    """
+    On-disk cache of contact matrices.
+
+    Every entry is a directory named after its key, holding one `.npy`
+    file per array and a small `meta.json` file. Arrays are opened as
+    copy-on-write memory maps, so loading an entry is immediate and
+    decoding a loaded contact matrix in place never writes back to
+    the cache.
+
+    Attributes
+    ----------
+    directory : str
+        Directory holding the entries.
+    hits : int
+        Number of lookups that found an entry.
+    misses : int
+        Number of lookups that did not.
+    """
+
+    def __init__(self, directory):
+        """Inits a `ContactCache` in `directory`, creating it if
+        needed."""
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        return
+
+    def __contains__(self, key):
+        return os.path.isfile(os.path.join(self.directory, key, 'meta.json'))
+
+    def save(self, key, cmat, posteriors=None):
+        """Stores a contact matrix under `key`.
+
+        The entry is written to a temporary directory first and then
+        renamed, so an interrupted run never leaves a partial entry.
+
+        Parameters
+        ----------
+        key : str
+            Key from `cache_key`.
+        cmat : numpy.ndarray or SparseContacts or PackedContacts
+            Contact matrix.
+        posteriors : dict, optional
+            Posteriors of the decoded pairs, as stored in the
+            'posteriors' entry of a replica.
+        """
+        if isinstance(cmat, SparseContacts):
+            meta = {'kind': 'sparse', 'n_atoms': cmat.n_atoms,
+                    'n_frames': cmat.n_frames}
+            arrays = {name: getattr(cmat, name) for name in
+                      ['atom_i', 'atom_j', 'start', 'stop']}
+        elif isinstance(cmat, PackedContacts):
+            meta = {'kind': 'packed', 'n_atoms': cmat.n_atoms,
+                    'n_frames': cmat.n_frames}
+            arrays = {'bits': cmat.bits}
+        else:
+            meta = {'kind': 'dense'}
+            arrays = {'cmat': cmat}
+
+        meta['posteriors'] = posteriors is not None
+        if posteriors is not None:
+            for name, value in posteriors.items():
+                arrays['posteriors_' + name] = value
+
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix='.tmp')
+        try:
+            for name, value in arrays.items():
+                np.save(os.path.join(tmp, name + '.npy'),
+                        np.ascontiguousarray(value))
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+            target = os.path.join(self.directory, key)
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+            os.rename(tmp, target)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        return
+
+    def load(self, key):
+        """Loads the contact matrix stored under `key`.
+
+        Parameters
+        ----------
+        key : str
+            Key from `cache_key`.
+
+        Returns
+        -------
+        cmat : numpy.ndarray or SparseContacts or PackedContacts or None
+            Contact matrix, or None if there is no such entry.
+        posteriors : dict or None
+            Posteriors stored with the contact matrix, if any.
+        """
+        if key not in self:
+            self.misses += 1
+            return None, None
+        self.hits += 1
+
+        path = os.path.join(self.directory, key)
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        def array(name):
+            return np.load(os.path.join(path, name + '.npy'), mmap_mode='c',
+                           allow_pickle=False)
+
+        if meta['kind'] == 'sparse':
+            cmat = SparseContacts(meta['n_atoms'], meta['n_frames'])
+            for name in ['atom_i', 'atom_j', 'start', 'stop']:
+                setattr(cmat, name, array(name))
+        elif meta['kind'] == 'packed':
+            cmat = PackedContacts.from_bits(meta['n_atoms'],
+                                            meta['n_frames'], array('bits'))
+        else:
+            cmat = array('cmat')
+
+        posteriors = None
+        if meta['posteriors']:
+            posteriors = {name: array('posteriors_' + name)
+                          for name in ['atom_i', 'atom_j', 'probs']}
+        return cmat, posteriors
+
+    def clear(self):
+        """Removes every entry."""
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+        self.hits = 0
+        self.misses = 0
+        return
@@ -0,0 +1,174 @@
+import numpy as np
+import pandas as pd
+from rdkit import Chem
+
+__all__ = ['CHECKPOINT_VERSION', 'save_checkpoint', 'load_checkpoint',
+           'LazyReplica']
+
+# Version written to new checkpoints. Bump when the layout changes.
+CHECKPOINT_VERSION = 1
+
+
+def save_checkpoint(filename, first_smiles, replicas, frames, hmm_params):
+    """Writes a binary checkpoint of a reaction network.
+
+    Everything is stored column-wise in a single `.npz` file. Molecules
+    are stored in RDKit's binary format, concatenated into one byte
+    array per replica with the offset of every molecule.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the checkpoint file.
+    first_smiles : str
+        SMILES string of the first frame.
+    replicas : list of dict
+        Replicas with their 'structures' table and, optionally, their
+        'transitions'.
+    frames : list of list of int
+        Transition frames of each replica.
+    hmm_params : dict
+        HMM parameters keyed by the frozenset of two elements.
+    """
+    arrays = {'version': np.array(CHECKPOINT_VERSION),
+              'first_smiles': np.array(first_smiles),
+              'n_replicas': np.array(len(replicas))}
+
+    for rep_id, rep in enumerate(replicas):
+        prefix = 'replica{}/'.format(rep_id)
+        structures = rep['structures']
+        arrays[prefix + 'smiles'] = np.array(list(structures['smiles']),
+                                             dtype=str)
+        arrays[prefix + 'frame'] = np.asarray(structures['frame'],
+                                              dtype=np.int64)
+        arrays[prefix + 'transition_frame'] = \
+            np.asarray(structures['transition_frame'], dtype=np.int64)
+
+        binary = [mol.ToBinary() for mol in structures['molecule']]
+        offsets = np.zeros(len(binary) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(b) for b in binary])
+        arrays[prefix + 'molecule_bytes'] = \
+            np.frombuffer(b''.join(binary), dtype=np.uint8)
+        arrays[prefix + 'molecule_offsets'] = offsets
+
+        arrays[prefix + 'frames'] = np.asarray(frames[rep_id],
+                                               dtype=np.int64)
+        if rep.get('transitions') is not None:
+            for key, value in rep['transitions'].items():
+                arrays[prefix + 'transitions/' + key] = value
+
+    if hmm_params:
+        keys = list(hmm_params)
+        # A pair of the same element is a frozenset of one element.
+        arrays['hmm/elements'] = np.array([(sorted(key) * 2)[:2]
+                                           for key in keys], dtype=str)
+        for name in ['start_p', 'trans_p', 'emission_p', 'loglik']:
+            arrays['hmm/' + name] = np.stack([hmm_params[key][name]
+                                              for key in keys])
+
+    with open(filename, 'wb') as f:
+        np.savez(f, **arrays)
+    return
+
+
+def load_checkpoint(filename):
+    """Reads a checkpoint written by `save_checkpoint`.
+
+    Molecules are only rebuilt when the 'structures' of a replica are
+    first accessed, see `LazyReplica`.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the checkpoint file.
+
+    Returns
+    -------
+    first_smiles : str
+    replicas : list of LazyReplica
+    frames : list of list of int
+    hmm_params : dict
+
+    Raises
+    ------
+    ValueError
+        If the checkpoint was written by a newer version.
+    """
+    with np.load(filename, allow_pickle=False) as data:
+        data = {key: data[key] for key in data.files}
+
+    version = int(data['version'])
+    if version > CHECKPOINT_VERSION:
+        raise ValueError("Checkpoint version {} is newer than the supported "
+                         "version {}.".format(version, CHECKPOINT_VERSION))
+
+    replicas, frames = [], []
+    for rep_id in range(int(data['n_replicas'])):
+        prefix = 'replica{}/'.format(rep_id)
+        smiles = data[prefix + 'smiles'].tolist()
+        structures = pd.DataFrame({
+            'smiles': smiles,
+            'molecule': [None] * len(smiles),
+            'frame': data[prefix + 'frame'],
+            'transition_frame': data[prefix + 'transition_frame']},
+            columns=['smiles', 'molecule', 'frame', 'transition_frame'])
+
+        transitions = None
+        if prefix + 'transitions/frame' in data:
+            transitions = {key: data[prefix + 'transitions/' + key]
+                           for key in ['frame', 'atom_i', 'atom_j']}
+
+        replicas.append(LazyReplica(
+            {'traj': None, 'cmat': None, 'path': None, 'processed': False,
+             'network': None, 'structures': structures, 'chunk': None,
+             'posteriors': None, 'transitions': transitions,
+             'cache_key': None},
+            molecules=(data[prefix + 'molecule_bytes'],
+                       data[prefix + 'molecule_offsets'])))
+        frames.append(data[prefix + 'frames'].tolist())
+
+    hmm_params = {}
+    if 'hmm/elements' in data:
+        for k, elements in enumerate(data['hmm/elements'].tolist()):
+            hmm_params[frozenset(elements)] = {
+                name: data['hmm/' + name][k]
+                for name in ['start_p', 'trans_p', 'emission_p', 'loglik']}
+
+    return str(data['first_smiles']), replicas, frames, hmm_params
+
+
+class LazyReplica(dict):
+    """
+    Replica whose molecules are rebuilt on first access.
+
+    The 'molecule' column of the 'structures' table is filled from the
+    RDKit binary molecules the first time 'structures' is looked up
+    with `[]` or `get`.
+    """
+
+    def __init__(self, *args, molecules=None, **kwargs):
+        """Inits a `LazyReplica` from the items of a replica dict and
+        the concatenated binary molecules and their offsets."""
+        super().__init__(*args, **kwargs)
+        self._molecules = molecules
+        return
+
+    def __getitem__(self, key):
+        if key == 'structures' and self._molecules is not None:
+            self._load_molecules()
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def _load_molecules(self):
+        binary, offsets = self._molecules
+        self._molecules = None
+        structures = super().__getitem__('structures')
+        structures['molecule'] = [
+            Chem.Mol(binary[start:stop].tobytes())
+            for start, stop in zip(offsets[:-1].tolist(),
+                                   offsets[1:].tolist())]
+        return
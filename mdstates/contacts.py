@@ -0,0 +1,860 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+__all__ = ['neighbor_contacts', 'find_transitions', 'SparseContacts',
+           'PackedContacts']
+
+# Number of set bits in every possible byte.
+_POPCOUNT = np.array([bin(b).count('1') for b in range(256)], dtype=np.uint8)
+
+
+def neighbor_contacts(xyz, elements, table, box=None):
+    """Finds all atom pairs within their cutoff distance in each frame.
+
+    Rather than computing the distance between every pair of atoms, the
+    atoms of each frame are binned into a KD-tree and only the pairs
+    within the largest cutoff in `table` are evaluated. With periodic
+    boundary conditions the tree wraps around the box, so the cost is
+    linear in the number of atoms.
+
+    Parameters
+    ----------
+    xyz : numpy.ndarray
+        Atomic coordinates. Shape is (n_frames, n_atoms, 3).
+    elements : numpy.ndarray
+        Index of each atom's element in `table`. Shape is (n_atoms,).
+    table : numpy.ndarray
+        Cutoff distance for each pair of elements. Shape is
+        (n_elements, n_elements).
+    box : numpy.ndarray, optional
+        Orthorhombic box lengths for each frame. Shape is
+        (n_frames, 3). If `None`, distances are not periodic.
+
+    Returns
+    -------
+    frames, atom_i, atom_j : numpy.ndarray
+        Frame index and atom indices of every contact, with
+        `atom_i` < `atom_j`.
+    """
+    max_cutoff = table[np.ix_(np.unique(elements),
+                              np.unique(elements))].max()
+
+    frames = []
+    atom_i = []
+    atom_j = []
+    for f in range(xyz.shape[0]):
+        pos = xyz[f].astype(np.float64)
+        if box is None:
+            tree = cKDTree(pos)
+        else:
+            # The periodic tree requires every coordinate inside the box.
+            pos = pos - np.floor(pos / box[f]) * box[f]
+            pos[pos >= box[f]] = 0.0
+            tree = cKDTree(pos, boxsize=box[f])
+        pairs = tree.query_pairs(max_cutoff, output_type='ndarray')
+
+        delta = pos[pairs[:, 1]] - pos[pairs[:, 0]]
+        if box is not None:
+            delta -= box[f] * np.round(delta / box[f])
+        dist = np.sqrt((delta ** 2).sum(axis=1))
+        cutoff = table[elements[pairs[:, 0]], elements[pairs[:, 1]]]
+        pairs = pairs[dist < cutoff]
+
+        frames.append(np.full(len(pairs), f, dtype=np.int64))
+        atom_i.append(pairs[:, 0])
+        atom_j.append(pairs[:, 1])
+
+    if not frames:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    return (np.concatenate(frames), np.concatenate(atom_i).astype(np.int64),
+            np.concatenate(atom_j).astype(np.int64))
+
+
+def find_transitions(cmat):
+    """Finds every change of state in a contact matrix.
+
+    Only pairs that are in contact in at least one frame can change,
+    so a dense contact matrix is compared frame to frame on those
+    pairs alone instead of over the whole cube.
+
+    Parameters
+    ----------
+    cmat : numpy.ndarray or SparseContacts or PackedContacts
+        Contact matrix. Shape is (n_atoms, n_atoms, n_frames).
+
+    Returns
+    -------
+    frames, atom_i, atom_j : numpy.ndarray
+        For each change, the last frame before the change and the atom
+        indices of the pair. Sorted by frame, then by pair.
+    """
+    if isinstance(cmat, _ContactStore):
+        return cmat.transitions()
+
+    atom_i, atom_j = np.nonzero(cmat.any(axis=2))
+    pairs, frames = np.nonzero(np.diff(cmat[atom_i, atom_j, :], axis=1))
+    order = np.argsort(frames, kind='stable')
+    return (frames[order].astype(np.int64), atom_i[pairs[order]],
+            atom_j[pairs[order]])
+
+
+class _ContactStore:
+    """
+    Common indexing of compressed contact matrices.
+
+    Subclasses implement `frame` and `signals`. Supports the indexing
+    used on dense contact matrices, i.e. `cmat[..., f]` for the
+    contact matrix of a frame and `cmat[i, j]` for the signal of a
+    pair.
+    """
+
+    @property
+    def shape(self):
+        return (self.n_atoms, self.n_atoms, self.n_frames)
+
+    def __getitem__(self, key):
+        """Dense indexing of single frames or single pairs.
+
+        `cmat[..., f]` and `cmat[:, :, f]` return the contact matrix
+        of frame `f`, while `cmat[i, j]` and `cmat[i, j, :]` return the
+        signal of the pair `i`, `j`.
+        """
+        if not isinstance(key, tuple):
+            raise TypeError("Index with a tuple.")
+
+        if len(key) == 2 and key[0] is Ellipsis:
+            return self.frame(key[1])
+        elif len(key) == 3 and key[0] == slice(None) and\
+                key[1] == slice(None):
+            return self.frame(key[2])
+        elif len(key) == 2 or (len(key) == 3 and key[2] == slice(None)):
+            return self.signal(key[0], key[1])
+        else:
+            raise TypeError("Unsupported index: {}".format(key))
+
+    def _check_frame(self, f):
+        """Converts a negative frame index and checks its range."""
+        if f < 0:
+            f += self.n_frames
+        if f < 0 or f >= self.n_frames:
+            raise IndexError("Frame {} is out of range.".format(f))
+        return f
+
+    def signal(self, i, j):
+        """Contact signal of a single pair of atoms at all frames."""
+        if i > j:
+            i, j = j, i
+        return self.signals([i], [j])[0]
+
+
+class SparseContacts(_ContactStore):
+    """
+    Run-length encoded contact matrix.
+
+    Bonds change rarely over a trajectory, so instead of a dense
+    (n_atoms, n_atoms, n_frames) array only the intervals of frames in
+    which a pair of atoms is in contact are stored. Every pair is
+    unbonded outside of its stored intervals. Supports the indexing
+    used on dense contact matrices, i.e. `cmat[..., f]` for the
+    contact matrix of a frame and `cmat[i, j]` for the signal of a
+    pair.
+
+    Attributes
+    ----------
+    n_atoms : int
+        Number of atoms in topology.
+    n_frames : int
+        Number of frames in the trajectory.
+    atom_i, atom_j : numpy.ndarray
+        Atom indices of each interval, with `atom_i` < `atom_j`.
+    start, stop : numpy.ndarray
+        First frame and one past the last frame of each interval.
+        Intervals are sorted by pair, then by frame.
+    """
+
+    def __init__(self, n_atoms, n_frames=0):
+        """Inits an empty `SparseContacts` object."""
+        self.n_atoms = n_atoms
+        self.n_frames = n_frames
+        self.atom_i = np.zeros(0, dtype=np.int64)
+        self.atom_j = np.zeros(0, dtype=np.int64)
+        self.start = np.zeros(0, dtype=np.int64)
+        self.stop = np.zeros(0, dtype=np.int64)
+        return
+
+    @classmethod
+    def from_contacts(cls, n_atoms, n_frames, frames, atom_i, atom_j):
+        """Builds the intervals from a list of contacts.
+
+        Parameters
+        ----------
+        n_atoms : int
+        n_frames : int
+        frames, atom_i, atom_j : numpy.ndarray
+            Frame index and atom indices of every contact, with
+            `atom_i` < `atom_j`.
+
+        Returns
+        -------
+        SparseContacts
+        """
+        contacts = cls(n_atoms, n_frames)
+        frames = np.asarray(frames, dtype=np.int64)
+        key = np.asarray(atom_i, dtype=np.int64) * n_atoms + \
+            np.asarray(atom_j, dtype=np.int64)
+
+        order = np.lexsort((frames, key))
+        key = key[order]
+        frames = frames[order]
+
+        # A new interval begins wherever the pair changes or a frame
+        # is skipped.
+        first = np.ones(len(key), dtype=bool)
+        first[1:] = (key[1:] != key[:-1]) | (frames[1:] != frames[:-1] + 1)
+        last = np.roll(first, -1)
+
+        contacts.atom_i, contacts.atom_j = np.divmod(key[first], n_atoms)
+        contacts.start = frames[first]
+        contacts.stop = frames[last] + 1
+        return contacts
+
+    @classmethod
+    def from_dense(cls, cmat):
+        """Builds the intervals from a dense contact matrix.
+
+        Parameters
+        ----------
+        cmat : numpy.ndarray
+            Contact matrix at all frames. Only the upper off-diagonal
+            elements are read.
+
+        Returns
+        -------
+        SparseContacts
+        """
+        n_atoms, _, n_frames = cmat.shape
+        atom_i, atom_j, frames = np.nonzero(cmat)
+        upper = atom_i < atom_j
+        return cls.from_contacts(n_atoms, n_frames, frames[upper],
+                                 atom_i[upper], atom_j[upper])
+
+    @property
+    def nbytes(self):
+        return (self.atom_i.nbytes + self.atom_j.nbytes +
+                self.start.nbytes + self.stop.nbytes)
+
+    def frame(self, f):
+        """Contact matrix of a single frame.
+
+        Parameters
+        ----------
+        f : int
+            Frame index, negative values count from the end.
+
+        Returns
+        -------
+        cmat : numpy.ndarray
+            Contact matrix with only the upper off-diagonal elements
+            populated. Shape is (n_atoms, n_atoms).
+        """
+        f = self._check_frame(f)
+        cmat = np.zeros((self.n_atoms, self.n_atoms), dtype=np.int32)
+        bonded = (self.start <= f) & (self.stop > f)
+        cmat[self.atom_i[bonded], self.atom_j[bonded]] = 1
+        return cmat
+
+    def intervals(self, i, j):
+        """Lists the intervals of a single pair of atoms.
+
+        Parameters
+        ----------
+        i, j : int
+
+        Returns
+        -------
+        list of tuple of int
+            `(start_frame, end_frame, state)` of every interval, where
+            `end_frame` is one past the last frame of the interval.
+        """
+        if i > j:
+            i, j = j, i
+        runs = (self.atom_i == i) & (self.atom_j == j)
+        intervals = []
+        frame = 0
+        for start, stop in zip(self.start[runs], self.stop[runs]):
+            if start > frame:
+                intervals.append((frame, int(start), 0))
+            intervals.append((int(start), int(stop), 1))
+            frame = int(stop)
+        if frame < self.n_frames:
+            intervals.append((frame, self.n_frames, 0))
+        return intervals
+
+    def active(self):
+        """Finds every pair that is in contact in at least one frame.
+
+        Returns
+        -------
+        atom_i, atom_j : numpy.ndarray
+            Atom indices of each active pair.
+        counts : numpy.ndarray
+            Number of frames in which each pair is in contact.
+        """
+        key = self.atom_i * self.n_atoms + self.atom_j
+        unique, inverse = np.unique(key, return_inverse=True)
+        counts = np.bincount(inverse, weights=self.stop - self.start,
+                             minlength=len(unique)).astype(np.int64)
+        atom_i, atom_j = np.divmod(unique, self.n_atoms)
+        return atom_i, atom_j, counts
+
+    def signals(self, atom_i, atom_j, start=0, stop=None):
+        """Expands the signals of several pairs into a dense block.
+
+        Parameters
+        ----------
+        atom_i, atom_j : array-like of int
+            Atom indices of each pair, with `atom_i` < `atom_j`.
+        start, stop : int, optional
+            Range of frames to expand. Default is all frames.
+
+        Returns
+        -------
+        block : numpy.ndarray
+            Contact signal of each pair. Shape is
+            (n_pairs, stop - start) and type is int32.
+        """
+        if stop is None:
+            stop = self.n_frames
+        stop = min(stop, self.n_frames)
+        atom_i = np.asarray(atom_i, dtype=np.int64)
+        atom_j = np.asarray(atom_j, dtype=np.int64)
+        block = np.zeros((len(atom_i), stop - start), dtype=np.int32)
+
+        row, runs = self._lookup(atom_i, atom_j)
+        first = np.clip(self.start[runs], start, stop) - start
+        last = np.clip(self.stop[runs], start, stop) - start
+
+        # Mark the edges of each interval and integrate along frames.
+        edges = np.zeros((len(atom_i), stop - start + 1), dtype=np.int32)
+        np.add.at(edges, (row, first), 1)
+        np.add.at(edges, (row, last), -1)
+        block[:] = np.cumsum(edges, axis=1)[:, :-1]
+        return block
+
+    def set_signals(self, atom_i, atom_j, block, start=0):
+        """Replaces the signals of several pairs.
+
+        Parameters
+        ----------
+        atom_i, atom_j : array-like of int
+            Atom indices of each pair, with `atom_i` < `atom_j`.
+        block : numpy.ndarray
+            New contact signal of each pair. Shape is
+            (n_pairs, n_frames).
+        start : int, optional
+            First frame replaced by `block`. Frames outside of the
+            replaced range keep their signal. Default is 0.
+        """
+        atom_i = np.asarray(atom_i, dtype=np.int64)
+        atom_j = np.asarray(atom_j, dtype=np.int64)
+        stop = start + block.shape[1]
+
+        # Keep the parts of the old intervals outside of the range.
+        _, runs = self._lookup(atom_i, atom_j)
+        before = runs[self.start[runs] < start]
+        after = runs[self.stop[runs] > stop]
+        kept = SparseContacts(self.n_atoms, self.n_frames)
+        kept.atom_i = np.concatenate([self.atom_i[before],
+                                      self.atom_i[after]])
+        kept.atom_j = np.concatenate([self.atom_j[before],
+                                      self.atom_j[after]])
+        kept.start = np.concatenate([self.start[before],
+                                     np.maximum(self.start[after], stop)])
+        kept.stop = np.concatenate([np.minimum(self.stop[before], start),
+                                    self.stop[after]])
+        self._drop(atom_i, atom_j)
+        self._extend(kept)
+
+        row, frames = np.nonzero(block)
+        new = SparseContacts.from_contacts(self.n_atoms, self.n_frames,
+                                           frames + start, atom_i[row],
+                                           atom_j[row])
+        self._extend(new)
+        return
+
+    def fill(self, atom_i, atom_j, value):
+        """Sets several pairs to a single value at all frames.
+
+        Parameters
+        ----------
+        atom_i, atom_j : array-like of int
+            Atom indices of each pair, with `atom_i` < `atom_j`.
+        value : int
+            Either 0 or 1.
+        """
+        atom_i = np.asarray(atom_i, dtype=np.int64)
+        atom_j = np.asarray(atom_j, dtype=np.int64)
+        self._drop(atom_i, atom_j)
+        if value:
+            new = SparseContacts(self.n_atoms, self.n_frames)
+            new.atom_i = atom_i.copy()
+            new.atom_j = atom_j.copy()
+            new.start = np.zeros(len(atom_i), dtype=np.int64)
+            new.stop = np.full(len(atom_i), self.n_frames, dtype=np.int64)
+            self._extend(new)
+        return
+
+    def remove_atoms(self, atoms):
+        """Removes every contact of the given atoms.
+
+        Parameters
+        ----------
+        atoms : list of int
+        """
+        keep = ~(np.isin(self.atom_i, atoms) | np.isin(self.atom_j, atoms))
+        self._select(keep)
+        return
+
+    def append(self, n_frames, frames, atom_i, atom_j):
+        """Appends a chunk of frames to the end of the trajectory.
+
+        Intervals that are still open at the end of the stored frames
+        are continued into the new chunk.
+
+        Parameters
+        ----------
+        n_frames : int
+            Number of frames in the chunk.
+        frames, atom_i, atom_j : numpy.ndarray
+            Frame index within the chunk and atom indices of every
+            contact in the chunk.
+        """
+        new = SparseContacts.from_contacts(self.n_atoms, n_frames, frames,
+                                           atom_i, atom_j)
+        new.start += self.n_frames
+        new.stop += self.n_frames
+        self.n_frames += n_frames
+        self._extend(new)
+        return
+
+    def transition_frames(self):
+        """Finds the frames at which each pair changes state.
+
+        Returns
+        -------
+        numpy.ndarray
+            For each change, the last frame before the change. Ordered
+            by pair, then by frame, matching `numpy.diff` on a dense
+            contact matrix.
+        """
+        begins = np.where(self.start > 0, self.start - 1, -1)
+        ends = np.where(self.stop < self.n_frames, self.stop - 1, -1)
+        frames = np.column_stack([begins, ends]).ravel()
+        return frames[frames >= 0]
+
+    def transitions(self):
+        """Finds every change of state and the pair that changed.
+
+        Returns
+        -------
+        frames, atom_i, atom_j : numpy.ndarray
+            For each change, the last frame before the change and the
+            atom indices of the pair. Sorted by frame, then by pair.
+        """
+        begins = np.where(self.start > 0, self.start - 1, -1)
+        ends = np.where(self.stop < self.n_frames, self.stop - 1, -1)
+        frames = np.column_stack([begins, ends]).ravel()
+        atom_i = np.repeat(self.atom_i, 2)[frames >= 0]
+        atom_j = np.repeat(self.atom_j, 2)[frames >= 0]
+        frames = frames[frames >= 0]
+        order = np.argsort(frames, kind='stable')
+        return frames[order], atom_i[order], atom_j[order]
+
+    def to_dense(self):
+        """Expands the intervals into a dense contact matrix."""
+        cmat = np.zeros(self.shape, dtype=np.uint8)
+        for i, j, start, stop in zip(self.atom_i, self.atom_j,
+                                     self.start, self.stop):
+            cmat[i, j, start:stop] = 1
+        return cmat
+
+    def _lookup(self, atom_i, atom_j):
+        """Finds the intervals that belong to several pairs.
+
+        Returns
+        -------
+        row : numpy.ndarray
+            Position of the pair in `atom_i` and `atom_j` for each
+            interval found.
+        runs : numpy.ndarray
+            Index of each interval found.
+        """
+        key = self.atom_i * self.n_atoms + self.atom_j
+        query = atom_i * self.n_atoms + atom_j
+        order = np.argsort(query)
+        left = np.searchsorted(key, query[order], side='left')
+        right = np.searchsorted(key, query[order], side='right')
+        lengths = right - left
+        row = np.repeat(order, lengths)
+        runs = np.repeat(left - np.cumsum(lengths) + lengths,
+                         lengths) + np.arange(lengths.sum())
+        return row, runs
+
+    def _drop(self, atom_i, atom_j):
+        """Removes every interval of several pairs."""
+        _, runs = self._lookup(atom_i, atom_j)
+        keep = np.ones(len(self.start), dtype=bool)
+        keep[runs] = False
+        self._select(keep)
+        return
+
+    def _select(self, keep):
+        self.atom_i = self.atom_i[keep]
+        self.atom_j = self.atom_j[keep]
+        self.start = self.start[keep]
+        self.stop = self.stop[keep]
+        return
+
+    def _extend(self, other):
+        """Merges the intervals of another `SparseContacts` object."""
+        atom_i = np.concatenate([self.atom_i, other.atom_i])
+        atom_j = np.concatenate([self.atom_j, other.atom_j])
+        start = np.concatenate([self.start, other.start])
+        stop = np.concatenate([self.stop, other.stop])
+
+        key = atom_i * self.n_atoms + atom_j
+        order = np.lexsort((start, key))
+        key, start, stop = key[order], start[order], stop[order]
+
+        # Join intervals of the same pair that touch.
+        first = np.ones(len(key), dtype=bool)
+        first[1:] = (key[1:] != key[:-1]) | (start[1:] != stop[:-1])
+        last = np.roll(first, -1)
+
+        self.atom_i, self.atom_j = np.divmod(key[first], self.n_atoms)
+        self.start = start[first]
+        self.stop = stop[last]
+        return
+
+
+class PackedContacts(_ContactStore):
+    """
+    Bit-packed contact matrix.
+
+    Contacts are either 0 or 1, so each unique atom pair stores its
+    signal as bits, 8 frames per byte. Rows follow the order of the
+    pairs from `numpy.triu_indices`, which makes each pair's signal
+    contiguous in memory and ready for the packed Viterbi decoder.
+
+    Attributes
+    ----------
+    n_atoms : int
+        Number of atoms in topology.
+    n_frames : int
+        Number of frames in the trajectory.
+    bits : numpy.ndarray
+        Packed signal of every unique atom pair. Shape is
+        (n_pairs, ceil(n_frames / 8)) and type is uint8. The first
+        frame is the most significant bit of the first byte.
+    """
+
+    def __init__(self, n_atoms, n_frames):
+        """Inits an empty `PackedContacts` object."""
+        self.n_atoms = n_atoms
+        self.n_frames = n_frames
+        n_pairs = n_atoms * (n_atoms - 1) // 2
+        self.bits = np.zeros((n_pairs, (n_frames + 7) // 8), dtype=np.uint8)
+        return
+
+    @classmethod
+    def from_contacts(cls, n_atoms, n_frames, frames, atom_i, atom_j,
+                      bits=None):
+        """Packs a list of contacts.
+
+        Parameters
+        ----------
+        n_atoms : int
+        n_frames : int
+        frames, atom_i, atom_j : numpy.ndarray
+            Frame index and atom indices of every contact, with
+            `atom_i` < `atom_j`.
+        bits : numpy.ndarray, optional
+            Zeroed array to pack the contacts into, e.g. a memory map.
+            See `from_bits`.
+
+        Returns
+        -------
+        PackedContacts
+        """
+        if bits is None:
+            contacts = cls(n_atoms, n_frames)
+        else:
+            contacts = cls.from_bits(n_atoms, n_frames, bits)
+        frames = np.asarray(frames, dtype=np.int64)
+        rows = contacts.rows(atom_i, atom_j)
+        np.bitwise_or.at(contacts.bits, (rows, frames >> 3),
+                         (128 >> (frames & 7)).astype(np.uint8))
+        return contacts
+
+    @classmethod
+    def from_bits(cls, n_atoms, n_frames, bits):
+        """Wraps already packed bits without copying them.
+
+        Parameters
+        ----------
+        n_atoms : int
+        n_frames : int
+        bits : numpy.ndarray
+            uint8 array of shape (n_pairs, ceil(n_frames / 8)), e.g. a
+            memory map.
+
+        Returns
+        -------
+        PackedContacts
+        """
+        n_pairs = n_atoms * (n_atoms - 1) // 2
+        if bits.shape != (n_pairs, (n_frames + 7) // 8):
+            raise ValueError("'bits' does not match 'n_atoms' and "
+                             "'n_frames'.")
+        contacts = cls.__new__(cls)
+        contacts.n_atoms = n_atoms
+        contacts.n_frames = n_frames
+        contacts.bits = bits
+        return contacts
+
+    @classmethod
+    def from_dense(cls, cmat):
+        """Packs a dense contact matrix.
+
+        Parameters
+        ----------
+        cmat : numpy.ndarray
+            Contact matrix at all frames. Only the upper off-diagonal
+            elements are read.
+
+        Returns
+        -------
+        PackedContacts
+        """
+        n_atoms, _, n_frames = cmat.shape
+        contacts = cls(n_atoms, n_frames)
+        atom_i, atom_j = np.triu_indices(n_atoms, 1)
+        contacts.bits[:] = np.packbits(cmat[atom_i, atom_j, :] != 0, axis=1)
+        return contacts
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def rows(self, atom_i, atom_j):
+        """Finds the rows of several pairs in `bits`.
+
+        Parameters
+        ----------
+        atom_i, atom_j : array-like of int
+            Atom indices of each pair, with `atom_i` < `atom_j`.
+
+        Returns
+        -------
+        numpy.ndarray
+        """
+        atom_i = np.asarray(atom_i, dtype=np.int64)
+        atom_j = np.asarray(atom_j, dtype=np.int64)
+        return atom_i * (2 * self.n_atoms - atom_i - 1) // 2 + \
+            atom_j - atom_i - 1
+
+    def frame(self, f):
+        """Contact matrix of a single frame.
+
+        Parameters
+        ----------
+        f : int
+            Frame index, negative values count from the end.
+
+        Returns
+        -------
+        cmat : numpy.ndarray
+            Contact matrix with only the upper off-diagonal elements
+            populated. Shape is (n_atoms, n_atoms).
+        """
+        f = self._check_frame(f)
+        cmat = np.zeros((self.n_atoms, self.n_atoms), dtype=np.int32)
+        bonded = (self.bits[:, f >> 3] >> (7 - (f & 7))) & 1
+        atom_i, atom_j = np.triu_indices(self.n_atoms, 1)
+        cmat[atom_i, atom_j] = bonded
+        return cmat
+
+    def counts(self, block=4096):
+        """Number of frames in which each pair is in contact.
+
+        Bits are counted a block of rows at a time with a lookup
+        table, so the signals are never unpacked.
+
+        Returns
+        -------
+        numpy.ndarray
+            Shape is (n_pairs,).
+        """
+        counts = np.zeros(len(self.bits), dtype=np.int64)
+        for start in range(0, len(self.bits), block):
+            counts[start:start + block] = \
+                _POPCOUNT[self.bits[start:start + block]].sum(axis=1)
+        return counts
+
+    def active(self):
+        """Finds every pair that is in contact in at least one frame.
+
+        Returns
+        -------
+        atom_i, atom_j : numpy.ndarray
+            Atom indices of each active pair.
+        counts : numpy.ndarray
+            Number of frames in which each pair is in contact.
+        """
+        counts = self.counts()
+        rows = np.flatnonzero(counts)
+        atom_i, atom_j = np.triu_indices(self.n_atoms, 1)
+        return atom_i[rows], atom_j[rows], counts[rows]
+
+    def signals(self, atom_i, atom_j, start=0, stop=None):
+        """Unpacks the signals of several pairs into a dense block.
+
+        Parameters
+        ----------
+        atom_i, atom_j : array-like of int
+            Atom indices of each pair, with `atom_i` < `atom_j`.
+        start, stop : int, optional
+            Range of frames to unpack. Default is all frames.
+
+        Returns
+        -------
+        block : numpy.ndarray
+            Contact signal of each pair. Shape is
+            (n_pairs, stop - start) and type is int32.
+        """
+        if stop is None:
+            stop = self.n_frames
+        stop = min(stop, self.n_frames)
+        first = start >> 3
+        rows = self.rows(atom_i, atom_j)
+        block = np.unpackbits(self.bits[rows, first:(stop + 7) >> 3], axis=1)
+        return block[:, start - 8 * first:stop - 8 * first].astype(np.int32)
+
+    def set_signals(self, atom_i, atom_j, block, start=0):
+        """Replaces the signals of several pairs.
+
+        Parameters
+        ----------
+        atom_i, atom_j : array-like of int
+            Atom indices of each pair, with `atom_i` < `atom_j`.
+        block : numpy.ndarray
+            New contact signal of each pair. Shape is
+            (n_pairs, n_frames).
+        start : int, optional
+            First frame replaced by `block`. Default is 0.
+        """
+        stop = start + block.shape[1]
+        first = start >> 3
+        last = (stop + 7) >> 3
+        rows = self.rows(atom_i, atom_j)
+
+        # Bytes at the edges of the range are shared with other frames.
+        unpacked = np.unpackbits(self.bits[rows, first:last], axis=1)
+        unpacked[:, start - 8 * first:stop - 8 * first] = block != 0
+        self.bits[rows, first:last] = np.packbits(unpacked, axis=1)
+        return
+
+    def fill(self, atom_i, atom_j, value):
+        """Sets several pairs to a single value at all frames.
+
+        Parameters
+        ----------
+        atom_i, atom_j : array-like of int
+            Atom indices of each pair, with `atom_i` < `atom_j`.
+        value : int
+            Either 0 or 1.
+        """
+        rows = self.rows(atom_i, atom_j)
+        if value:
+            self.bits[rows] = np.packbits(np.ones(self.n_frames,
+                                                  dtype=np.uint8))
+        else:
+            self.bits[rows] = 0
+        return
+
+    def remove_atoms(self, atoms):
+        """Removes every contact of the given atoms.
+
+        Parameters
+        ----------
+        atoms : list of int
+        """
+        atom_i, atom_j = np.triu_indices(self.n_atoms, 1)
+        self.bits[np.isin(atom_i, atoms) | np.isin(atom_j, atoms)] = 0
+        return
+
+    def transition_frames(self):
+        """Finds the frames at which each pair changes state.
+
+        Each row is compared against itself shifted by one frame while
+        still packed, and only rows with a change are unpacked.
+
+        Returns
+        -------
+        numpy.ndarray
+            For each change, the last frame before the change. Ordered
+            by pair, then by frame, matching `numpy.diff` on a dense
+            contact matrix.
+        """
+        return self._changes()[1]
+
+    def transitions(self):
+        """Finds every change of state and the pair that changed.
+
+        Returns
+        -------
+        frames, atom_i, atom_j : numpy.ndarray
+            For each change, the last frame before the change and the
+            atom indices of the pair. Sorted by frame, then by pair.
+        """
+        rows, frames = self._changes()
+        order = np.argsort(frames, kind='stable')
+        atom_i, atom_j = np.triu_indices(self.n_atoms, 1)
+        return (frames[order], atom_i[rows[order]], atom_j[rows[order]])
+
+    def _changes(self, block=4096):
+        """Row and frame of every change, ordered by row, then frame.
+
+        Rows are compared a block at a time, so only one block of the
+        bits is copied into memory, even from a memory map.
+        """
+        empty = np.zeros(0, dtype=np.int64)
+        if self.n_frames < 2:
+            return empty, empty
+
+        # Mask the last frame and the padding bits.
+        n_valid = self.n_frames - 1
+        mask = np.packbits(np.arange(8 * self.bits.shape[1]) < n_valid)
+
+        all_rows, all_frames = [empty], [empty]
+        for start in range(0, len(self.bits), block):
+            bits = np.asarray(self.bits[start:start + block])
+            shifted = bits << 1
+            shifted[:, :-1] |= bits[:, 1:] >> 7
+            changes = bits ^ shifted
+            changes &= mask
+
+            rows = np.flatnonzero(changes.any(axis=1))
+            index, frames = np.nonzero(np.unpackbits(changes[rows], axis=1))
+            all_rows.append(start + rows[index])
+            all_frames.append(frames)
+        return np.concatenate(all_rows), np.concatenate(all_frames)
+
+    def to_dense(self):
+        """Unpacks the bits into a dense contact matrix."""
+        cmat = np.zeros(self.shape, dtype=np.uint8)
+        atom_i, atom_j = np.triu_indices(self.n_atoms, 1)
+        cmat[atom_i, atom_j, :] = np.unpackbits(self.bits, axis=1,
+                                                count=self.n_frames)
+        return cmat
@@ -1,25 +1,38 @@
 from numbers import Number
+from threading import Lock, Semaphore
 from itertools import combinations
 # import re
+import os
 from os.path import abspath, dirname, join
 
 import mdtraj as md
-from multiprocessing import Manager, Process
+from multiprocessing import Manager, Pool, Process, resource_tracker
+from multiprocessing.shared_memory import SharedMemory
 import networkx as nx
 from networkx.drawing.nx_agraph import to_agraph
 import numpy as np
 import pandas as pd
 import pybel
 
+from .cache import ContactCache, cache_key
+from .checkpoint import save_checkpoint, load_checkpoint
+from .contacts import (neighbor_contacts, find_transitions, SparseContacts,
+                       PackedContacts)
 from .data import radii
 from .graphs import combine_graphs, prepare_graph
-from .hmm import generate_ignore_list, viterbi
-from .hmm_cython import decode_cpp   # , viterbi_cpp
-from .molecules import (contact_matrix_to_SMILES, cmat_to_structure,
-                        molecule_to_json_string, json_string_to_molecule)
+from .hmm import (triage, triage_contacts, batch_viterbi, batch_posteriors,
+                  quantize, baum_welch, ChunkedViterbi)
+try:
+    from .hmm_cython import (decode_cpp, decode_bytes_cpp,  # , viterbi_cpp
+                             decode_packed_cpp, posteriors_cpp)
+except(ImportError):
+    # Without the compiled extension, decode with `batch_viterbi`.
+    decode_cpp = decode_bytes_cpp = decode_packed_cpp = posteriors_cpp = None
+from .molecules import (StructureCache, molecule_to_json_string,
+                        json_string_to_molecule)
 from .smiles import (remove_consecutive_repeats, save_unique_SMILES,
-                     find_reaction)
-from .util import find_nearest
+                     find_reaction, StructureRecords)
+from .util import find_nearest_sorted, frames_near
 
 __all__ = ['Network']
 
@@ -39,7 +52,9 @@ class Network:
     ----------
     replica : dict
         Container for each trajectory and it's associated contact
-        matrix. All trajectories must have matching topologies.
+        matrix. All trajectories must have matching topologies. Each
+        contact matrix is either a dense uint8 array, a `SparseContacts`
+        object or a `PackedContacts` object.
     atoms : list
         List of atoms for in topologoy.
     n_atoms : int
@@ -47,7 +62,18 @@ class Network:
     pbc : bool
         Periodic boundary condition.
     frames : tuple
-        Frames at which an transition is recorded.
+        Frames at which an transition is recorded, sorted and without
+        repeats. The pairs that changed at every frame are in the
+        'transitions' entry of each replica.
+    hmm_params : dict
+        HMM parameters fitted by `fit_hmm`, keyed by the frozenset of
+        the two elements of a pair.
+    structure_cache : StructureCache
+        Structures of the bond patterns already converted to SMILES,
+        shared by all replicas.
+    cache : ContactCache or None
+        On-disk cache of raw and decoded contact matrices, see
+        `set_cache`.
     """
 
     def __init__(self):
@@ -61,12 +87,18 @@ class Network:
         self.topology = None
         self.first_smiles = None
         self.first_mol = None
+        self.hmm_params = {}
+        self.structure_cache = StructureCache()
+        self.cache = None
 
         self._pairs = []
         self._cutoff = {}
+        self._pair_cutoff = None
+        self._method = 'neighbors'
+        self._memmap = None
         return
 
-    def add_replica(self, trajectory, topology=None, **kwargs):
+    def add_replica(self, trajectory, topology=None, chunk=None, **kwargs):
         """
         Adds a replica to the class object.
 
@@ -82,6 +114,11 @@ class Network:
             File name of the trajectory file.
         topology : str
             File name of the topology file.
+        chunk : int, optional
+            If specified, the trajectory is not loaded into memory.
+            Instead, it is streamed in chunks of `chunk` frames with
+            `mdtraj.iterload()` whenever it is processed, and its
+            contact matrix is stored as a `SparseContacts` object.
         **kwargs
             Additional keywords that can be sent to `mdtraj.load()`.
 
@@ -102,11 +139,16 @@ class Network:
             for _ in range(len(trajectory)):
                 self.replica.append({'traj': None, 'cmat': None, 'path': None,
                                      'processed': False, 'network': None,
-                                     'structures': None})
+                                     'structures': None, 'chunk': None,
+                                     'posteriors': None,
+                                     'transitions': None,
+                                     'cache_key': None})
         else:
             self.replica.append({'traj': None, 'cmat': None, 'path': None,
                                  'processed': False, 'network': None,
-                                 'structures': None})
+                                 'structures': None, 'chunk': None,
+                                 'posteriors': None, 'transitions': None,
+                                 'cache_key': None})
         if topology:
             pass
         else:
@@ -131,6 +173,14 @@ class Network:
                 proc.join()
                 self.replica[i]['traj'] = rep_dict[i]['traj']
 
+        elif chunk:
+            # Only record where to find the trajectory.
+            self.replica[-1]['chunk'] = {'size': chunk, 'top': topology,
+                                         'kwargs': kwargs}
+            self.replica[-1]['path'] = abspath(trajectory)
+            # Add a sub-list for frames.
+            self.frames.append([])
+
         else:
             self.replica[-1]['traj'] = md.load(trajectory, top=topology,
                                                **kwargs)
@@ -146,7 +196,7 @@ class Network:
 
         # Set the number of atoms.
         if self.n_atoms is None:
-            self.n_atoms = self.replica[0]['traj'].n_atoms
+            self.n_atoms = self.topology.n_atoms
         else:
             pass
 
@@ -186,7 +236,9 @@ class Network:
         return
 
     def generate_contact_matrix(self, cutoff_frac=1.4, ignore=None,
-                                parallel=False):
+                                parallel=False, method='neighbors',
+                                sparse=False, packed=False, memmap=None,
+                                cores=None):
         """
         Converts each trajectory frame to a contact matrix.
 
@@ -212,19 +264,62 @@ class Network:
             all frames. Can be useful for species that are not
             covalently bonded, such as ions. Must pass either an atomic
             symbol, list of atomic symbols, or list of atom id's.
+        parallel : bool, optional
+            If `True`, the replicas are processed on a pool of `cores`
+            worker processes. Coordinates and contact matrices are
+            exchanged through shared memory rather than pickled.
+            Default is `False`.
+        method : {'neighbors', 'pairs'}, optional
+            If 'neighbors', only atom pairs within the largest cutoff
+            are evaluated in each frame using a periodic KD-tree, which
+            scales linearly with the number of atoms. If 'pairs', the
+            distances between all pairs of atoms are computed. Boxes
+            that are not orthorhombic always use 'pairs'. Default is
+            'neighbors'.
+        sparse : bool, optional
+            If `True`, each contact matrix is stored as a
+            `SparseContacts` object, which only records the intervals
+            of frames in which each pair is in contact. Default is
+            `False`.
+        packed : bool, optional
+            If `True`, each contact matrix is stored as a
+            `PackedContacts` object, which packs the signal of every
+            atom pair into bits. Default is `False`.
+        memmap : str, optional
+            If specified, the dense or packed contact matrix of each
+            replica is written to `replica<i>.npy` in this directory
+            and used as a memory map, so replicas larger than memory
+            can be processed. The signal of every pair is contiguous
+            on disk and is decoded in place by `decode`. Streamed
+            replicas are written this way as well. With `parallel`,
+            each worker writes its own file.
+        cores : int, optional
+            Number of worker processes used with `parallel`. Default
+            is the number of CPUs.
         """
 
+        if method not in ['neighbors', 'pairs']:
+            raise ValueError("'method' must be 'neighbors' or 'pairs'.")
+        if sparse and packed:
+            raise ValueError("Choose either 'sparse' or 'packed'.")
+        if sparse and memmap:
+            raise ValueError("Sparse contact matrices cannot be "
+                             "memory-mapped.")
+        self._method = method
+        self._sparse = sparse
+        self._packed = packed
+        self._memmap = memmap
+        if memmap:
+            os.makedirs(memmap, exist_ok=True)
+
         # Check if atom pairs have been determined.
-        if not self._pairs:
+        if not self._pairs and method == 'pairs':
             self._generate_pairs()
         else:
             pass
 
-        # Check if cutoff matrix has been built.
-        if len(self._cutoff) < len(self._pairs):
-            self._build_cutoff(cutoff_frac)
-        else:
-            pass
+        # Add cutoffs for any element pairs that are missing.
+        self._build_cutoff(cutoff_frac)
 
         # Check if topology file has been converted to a SMILES string.
         if self.first_smiles:
@@ -258,44 +353,471 @@ class Network:
         else:
             pass
 
-        if parallel:
-            processes = []
-            manager = Manager()
-            rep_dict = []
-            for i, rep in enumerate(self.replica):
-                rep_dict.append(manager.dict(rep))
-                p = Process(target=self._build_single_cmat,
-                            args=(i, rep_dict[i]))
-                processes.append(p)
-                p.start()
-
-            for i, proc in enumerate(processes):
-                proc.join()
-                self.replica[i]['cmat'] = rep_dict[i]['cmat']
+        # Reuse the contact matrices of previous runs.
+        computed = []
+        for i, rep in enumerate(self.replica):
+            cached = False
+            if self.cache is not None and rep['cmat'] is None:
+                rep['cache_key'] = self._contact_key(rep, ignore_list)
+                rep['cmat'], _ = self.cache.load(rep['cache_key'])
+                cached = rep['cmat'] is not None
+            if rep['cmat'] is None or (parallel and not cached):
+                computed.append(i)
+
+        if parallel and computed:
+            cmats = self._parallel_cmats(computed, cores)
+            for i in computed:
+                self.replica[i]['cmat'] = cmats[i]
                 if ignore:
-                    self.replica[i]['cmat'][ignore_list, :, :] = 0
-                    self.replica[i]['cmat'][:, ignore_list, :] = 0
+                    self._ignore_atoms(self.replica[i]['cmat'], ignore_list)
         else:
-            for i, rep in enumerate(self.replica):
-                if rep['cmat'] is None:
-                    distances = self._compute_distances(i)
-                    distances = self._reshape_to_square(distances)
-                    rep['cmat'] = self._build_connections(distances)
-                    if ignore:
-                        rep['cmat'][ignore_list, :, :] = 0
-                        rep['cmat'][:, ignore_list, :] = 0
-                    else:
-                        pass
+            for i in computed:
+                rep = self.replica[i]
+                rep['cmat'] = self._replica_cmat(rep, i)
+                if ignore:
+                    self._ignore_atoms(rep['cmat'], ignore_list)
                 else:
                     pass
+
+        if self.cache is not None:
+            for i in computed:
+                rep = self.replica[i]
+                rep['cache_key'] = self._contact_key(rep, ignore_list)
+                self.cache.save(rep['cache_key'], rep['cmat'])
         return
 
-    def _build_single_cmat(self, rep_id, rep):
-        distances = self._compute_distances(rep_id)
-        distances = self._reshape_to_square(distances)
-        rep['cmat'] = self._build_connections(distances)
+    def set_cache(self, directory):
+        """
+        Keeps contact matrices on disk to be reused by later runs.
+
+        `generate_contact_matrix` stores the contact matrix of every
+        replica, keyed by the trajectory file (its path, size and
+        modification time), the topology, the cutoffs, the ignored
+        atoms and the contact method. `decode` stores the decoded
+        contact matrix, additionally keyed by the HMM parameters. A
+        rerun with the same inputs loads both as memory maps and goes
+        straight to `get_structures`, whatever `tol` or `min_lifetime`
+        it uses. Streamed replicas (see `add_replica`) are then never
+        read at all.
+
+        Parameters
+        ----------
+        directory : str or None
+            Directory of the cache, created if needed. None disables
+            the cache.
+        """
+        self.cache = None if directory is None else ContactCache(directory)
         return
 
+    def _contact_key(self, rep, ignore_list):
+        """Cache key of the raw contact matrix of a replica."""
+        stat = os.stat(rep['path'])
+        if rep.get('chunk'):
+            frames = [rep['chunk']['top'], rep['chunk']['kwargs']]
+        else:
+            frames = [rep['traj'].n_frames, rep['traj'].time[[0, -1]]]
+        return cache_key('contacts', rep['path'], stat.st_size,
+                         stat.st_mtime_ns, frames, self.atoms, self._cutoff,
+                         sorted(ignore_list), self._method, self.pbc,
+                         self._sparse or (bool(rep.get('chunk')) and
+                                          not self._memmap),
+                         self._packed)
+
+    def _parallel_cmats(self, rep_ids, cores=None):
+        """
+        Computes the contact matrices of several replicas on a pool of
+        worker processes.
+
+        No more than `cores` workers are started, however many
+        replicas there are. The coordinates of a replica are copied
+        into shared memory, and its dense or packed contact matrix is
+        written by the worker into a shared buffer allocated here, so
+        neither is pickled. Only twice as many replicas as workers are
+        staged in shared memory at a time. Streamed replicas are read
+        by the workers themselves.
+
+        A finished dense or packed contact matrix is copied out of its
+        shared buffer, which is then freed: closing `SharedMemory`
+        unmaps the buffer under any array still using it, so the
+        buffer cannot be handed to the replica. Each of these replicas
+        thus briefly takes twice its size. Memory-mapped contact
+        matrices are written to their files and are not copied.
+
+        Parameters
+        ----------
+        rep_ids : list of int
+        cores : int, optional
+            Number of worker processes. Default is the number of CPUs.
+
+        Returns
+        -------
+        dict
+            Contact matrix of every replica in `rep_ids`.
+        """
+        if cores is None:
+            cores = os.cpu_count() or 1
+        workers = max(1, min(cores, len(rep_ids)))
+        slots = Semaphore(2 * workers)
+        # Guards `stop` and `buffers`, so that no replica is staged
+        # once the shared memory is being freed.
+        lock = Lock()
+        stop = []
+        buffers = {}
+
+        def tasks():
+            # Runs in the task thread of the pool, which waits here
+            # until finished replicas free their shared memory.
+            for rep_id in rep_ids:
+                slots.acquire()
+                with lock:
+                    if stop:
+                        return
+                    task, buffers[rep_id] = self._contact_task(rep_id)
+                yield task
+
+        # Workers must share the tracker of this process, otherwise
+        # each of them would remove the shared memory when it exits.
+        resource_tracker.ensure_running()
+        cmats = {}
+        try:
+            with Pool(workers, initializer=_init_contact_worker,
+                      initargs=(self._contact_worker_network(),)) as pool:
+                try:
+                    for rep_id, n_frames, cmat in pool.imap_unordered(
+                            _contact_worker, tasks()):
+                        if self._memmap:
+                            cmat = self._open_memmap(rep_id, n_frames)
+                        elif cmat is None:
+                            dtype, shape = self._cmat_layout(n_frames)
+                            array = np.ndarray(
+                                shape, dtype=dtype,
+                                buffer=buffers[rep_id][-1].buf).copy()
+                            cmat = self._wrap_cmat(array, n_frames)
+                        cmats[rep_id] = cmat
+                        with lock:
+                            shared = buffers.pop(rep_id)
+                        _free_shared(shared)
+                        slots.release()
+                finally:
+                    with lock:
+                        stop.append(True)
+                    slots.release()
+        finally:
+            with lock:
+                stop.append(True)
+                for shared in buffers.values():
+                    _free_shared(shared)
+                buffers.clear()
+        return cmats
+
+    def _contact_task(self, rep_id):
+        """
+        Stages a replica for `_contact_worker`.
+
+        Returns
+        -------
+        task : dict
+            Everything the worker needs, with shared memory referred to
+            by name.
+        shared : list of SharedMemory
+            Shared memory of the coordinates and of the contact matrix,
+            to be freed once the worker is done.
+        """
+        rep = self.replica[rep_id]
+        task = {'rep_id': rep_id, 'path': rep['path'],
+                'chunk': rep.get('chunk'), 'shared': []}
+        if rep.get('chunk'):
+            return task, []
+
+        traj = rep['traj']
+        shared = []
+        try:
+            xyz = SharedMemory(create=True, size=max(1, traj.xyz.nbytes))
+            shared.append(xyz)
+            np.ndarray(traj.xyz.shape, dtype=np.float32,
+                       buffer=xyz.buf)[...] = traj.xyz
+            task.update({'n_frames': traj.n_frames,
+                         'unitcell_lengths': traj.unitcell_lengths,
+                         'unitcell_angles': traj.unitcell_angles})
+
+            if not self._memmap and not self._sparse:
+                dtype, shape = self._cmat_layout(traj.n_frames)
+                size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+                shared.append(SharedMemory(create=True, size=max(1, size)))
+        except BaseException:
+            _free_shared(shared)
+            raise
+        task['shared'] = [shm.name for shm in shared]
+        return task, shared
+
+    def _task_cmat(self, task, buffers):
+        """
+        Computes the contact matrix of a task from `_contact_task`
+        inside a worker.
+
+        Parameters
+        ----------
+        task : dict
+        buffers : list of memoryview
+            Shared memory named in the task.
+
+        Returns
+        -------
+        n_frames : int
+        cmat : SparseContacts or None
+            Sparse contact matrices are returned, all others are
+            written to shared memory or to their memory-mapped file.
+        """
+        rep_id = task['rep_id']
+        if task['chunk']:
+            cmat = self._replica_cmat(task, rep_id)
+        else:
+            n_frames = task['n_frames']
+            xyz = np.ndarray((n_frames, self.n_atoms, 3), dtype=np.float32,
+                             buffer=buffers[0])
+            traj = md.Trajectory(xyz, self.topology.topology,
+                                 unitcell_lengths=task['unitcell_lengths'],
+                                 unitcell_angles=task['unitcell_angles'])
+            if self._memmap:
+                out = self._open_memmap(rep_id, n_frames, mode='w+')
+            elif len(buffers) > 1:
+                dtype, shape = self._cmat_layout(n_frames)
+                array = np.ndarray(shape, dtype=dtype, buffer=buffers[1])
+                array[...] = 0
+                out = self._wrap_cmat(array, n_frames)
+            else:
+                out = None
+            cmat = self._compute_cmat(traj, sparse=self._sparse,
+                                      packed=self._packed, out=out)
+
+        if isinstance(cmat, SparseContacts):
+            return cmat.n_frames, cmat
+        elif isinstance(cmat, PackedContacts):
+            n_frames, array = cmat.n_frames, cmat.bits
+        else:
+            n_frames, array = cmat.shape[2], cmat
+        if isinstance(array, np.memmap):
+            array.flush()
+        return n_frames, None
+
+    def _contact_worker_network(self):
+        """Copy of the settings used to compute contact matrices,
+        without any replicas, to be sent to worker processes."""
+        net = Network()
+        for name in ['atoms', 'n_atoms', 'pbc', 'topology', '_pairs',
+                     '_cutoff', '_pair_cutoff', '_method', '_sparse',
+                     '_packed', '_memmap']:
+            setattr(net, name, getattr(self, name))
+        return net
+
+    def _replica_cmat(self, rep, rep_id=None):
+        """
+        Computes the contact matrix of a replica.
+
+        Streamed replicas are read one chunk at a time and their
+        contacts are appended to a `SparseContacts` object, so that
+        the trajectory is never held in memory all at once. With
+        `memmap`, the intervals are then written to the replica's file
+        a batch of pairs at a time.
+
+        Parameters
+        ----------
+        rep : dict
+            Replica from `replica`.
+        rep_id : int, optional
+            Index of the replica, which names its memory-mapped file.
+
+        Returns
+        -------
+        cmat : numpy.ndarray or SparseContacts or PackedContacts
+            Contact matrix at all frames.
+        """
+        if not rep.get('chunk'):
+            if self._memmap:
+                out = self._open_memmap(rep_id, rep['traj'].n_frames,
+                                        mode='w+')
+                return self._compute_cmat(rep['traj'], out=out)
+            return self._compute_cmat(rep['traj'], sparse=self._sparse,
+                                      packed=self._packed)
+
+        cmat = SparseContacts(self.n_atoms)
+        for traj in md.iterload(rep['path'], chunk=rep['chunk']['size'],
+                                top=rep['chunk']['top'],
+                                **rep['chunk']['kwargs']):
+            frames, atom_i, atom_j = self._compute_contacts(traj)
+            cmat.append(traj.n_frames, frames, atom_i, atom_j)
+        if not self._memmap:
+            return cmat
+
+        out = self._open_memmap(rep_id, cmat.n_frames, mode='w+')
+        atom_i, atom_j, _ = cmat.active()
+        for start in range(0, len(atom_i), 1024):
+            pairs = slice(start, start + 1024)
+            block = cmat.signals(atom_i[pairs], atom_j[pairs])
+            if isinstance(out, PackedContacts):
+                out.set_signals(atom_i[pairs], atom_j[pairs], block)
+            else:
+                out[atom_i[pairs], atom_j[pairs], :] = block
+        return out
+
+    def _compute_cmat(self, traj, sparse=False, packed=False, out=None):
+        """
+        Computes the contact matrix of a trajectory.
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+        sparse : bool, optional
+            If `True`, return a `SparseContacts` object.
+        packed : bool, optional
+            If `True`, return a `PackedContacts` object.
+        out : numpy.ndarray or PackedContacts, optional
+            Empty contact matrix to write the contacts into, e.g. one
+            from `_open_memmap`.
+
+        Returns
+        -------
+        cmat : numpy.ndarray or SparseContacts or PackedContacts
+            Contact matrix at all frames.
+        """
+        frames, atom_i, atom_j = self._compute_contacts(traj)
+        if isinstance(out, PackedContacts):
+            return PackedContacts.from_contacts(self.n_atoms, traj.n_frames,
+                                                frames, atom_i, atom_j,
+                                                bits=out.bits)
+        elif sparse:
+            return SparseContacts.from_contacts(self.n_atoms, traj.n_frames,
+                                                frames, atom_i, atom_j)
+        elif packed:
+            return PackedContacts.from_contacts(self.n_atoms, traj.n_frames,
+                                                frames, atom_i, atom_j)
+        if out is None:
+            out = np.zeros((self.n_atoms, self.n_atoms, traj.n_frames),
+                           dtype=np.uint8)
+        out[atom_i, atom_j, frames] = 1
+        return out
+
+    def _open_memmap(self, rep_id, n_frames, mode='r+'):
+        """
+        Opens the memory-mapped contact matrix of a replica.
+
+        Parameters
+        ----------
+        rep_id : int
+        n_frames : int
+        mode : {'r+', 'w+'}, optional
+            'w+' creates a new, empty file. Default is 'r+'.
+
+        Returns
+        -------
+        cmat : numpy.memmap or PackedContacts
+            Dense contact matrix, or packed if `packed` was given to
+            `generate_contact_matrix`.
+        """
+        filename = join(self._memmap, 'replica{}.npy'.format(rep_id))
+        if mode == 'w+':
+            dtype, shape = self._cmat_layout(n_frames)
+            array = np.lib.format.open_memmap(filename, mode='w+',
+                                              dtype=dtype, shape=shape)
+        else:
+            array = np.load(filename, mmap_mode=mode)
+        return self._wrap_cmat(array, n_frames)
+
+    def _cmat_layout(self, n_frames):
+        """Data type and shape of the array behind a dense or packed
+        contact matrix."""
+        if self._packed:
+            n_pairs = self.n_atoms * (self.n_atoms - 1) // 2
+            return np.uint8, (n_pairs, (n_frames + 7) // 8)
+        return np.uint8, (self.n_atoms, self.n_atoms, n_frames)
+
+    def _wrap_cmat(self, array, n_frames):
+        """Contact matrix backed by an array from `_cmat_layout`."""
+        if self._packed:
+            return PackedContacts.from_bits(self.n_atoms, n_frames, array)
+        return array
+
+    def _compute_contacts(self, traj):
+        """
+        Finds all atom pairs within their cutoff in a trajectory.
+
+        Uses the contact method chosen in `generate_contact_matrix`.
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+
+        Returns
+        -------
+        frames, atom_i, atom_j : numpy.ndarray
+            Frame index and atom indices of every contact, with
+            `atom_i` < `atom_j`.
+        """
+        box = self._orthorhombic_box(traj)
+        if self._method == 'pairs' or box is False:
+            if not self._pairs:
+                self._generate_pairs()
+            distances = md.compute_distances(traj, self._pairs,
+                                             periodic=self.pbc)
+            # Compare every frame against the cutoff of every pair at
+            # once, shape is (n_frames, n_pairs).
+            frames, pair = np.nonzero(distances < self._pair_cutoffs())
+            atom_i, atom_j = np.triu_indices(self.n_atoms, 1)
+            return frames, atom_i[pair], atom_j[pair]
+
+        elements, table = self._cutoff_table()
+        return neighbor_contacts(traj.xyz, elements, table, box=box)
+
+    def _ignore_atoms(self, cmat, ignore_list):
+        """Removes all contacts of the ignored atoms."""
+        if isinstance(cmat, (SparseContacts, PackedContacts)):
+            cmat.remove_atoms(ignore_list)
+        else:
+            cmat[ignore_list, :, :] = 0
+            cmat[:, ignore_list, :] = 0
+        return
+
+    def _orthorhombic_box(self, traj):
+        """
+        Fetches the periodic box lengths of a trajectory.
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+
+        Returns
+        -------
+        numpy.ndarray or None or False
+            Box lengths at every frame with shape (n_frames, 3).
+            `None` if distances are not periodic and `False` if the
+            box is not orthorhombic.
+        """
+        if not self.pbc or traj.unitcell_lengths is None:
+            return None
+        elif not np.allclose(traj.unitcell_angles, 90.0):
+            return False
+        else:
+            return traj.unitcell_lengths.astype(np.float64)
+
+    def _cutoff_table(self):
+        """
+        Builds a lookup table of cutoffs indexed by element.
+
+        Returns
+        -------
+        elements : numpy.ndarray
+            Index of each atom's element in `table`.
+        table : numpy.ndarray
+            Cutoff for every pair of elements. Shape is
+            (n_elements, n_elements).
+        """
+        unique, elements = np.unique(self.atoms, return_inverse=True)
+        table = np.zeros((len(unique), len(unique)))
+        for a, atom1 in enumerate(unique):
+            for b, atom2 in enumerate(unique):
+                table[a, b] = self._cutoff[frozenset([atom1, atom2])]
+        return elements, table
+
     def set_cutoff(self, atoms, cutoff):
         """Assigns the cutoff for a pair of atoms.
 
@@ -322,12 +844,107 @@ class Network:
             pass
 
         self._cutoff[frozenset(atoms)] = cutoff
+        self._pair_cutoff = None
         return
 
+    def fit_hmm(self, n=10, start_p=[0.5, 0.5],
+                trans_p=[[0.999, 0.001], [0.001, 0.999]],
+                emission_p=[[0.60, 0.40], [0.40, 0.60]], max_signals=200,
+                n_iter=100, tol=1e-4, cores=1, use_python=False, seed=None):
+        """Fits HMM parameters for every pair of elements.
+
+        Signals of the pairs that `decode` would process, i.e. those
+        with more than `n` occurrences of their least common value, are
+        sampled from every replica and grouped by the elements of the
+        pair. The Baum-Welch algorithm then fits start, transition and
+        emission probabilities to each group, and `decode` uses them
+        for pairs of those elements. Must be called before `decode`.
+
+        Parameters
+        ----------
+        n : int, optional
+            Threshold for selecting the signals, as in `decode`.
+            Default is 10.
+        start_p : list of float, optional
+            Initial probabilities of starting in a particular hidden
+            state. Default is [0.5, 0.5].
+        trans_p : list of list of float, optional
+            Initial probabilities of transitioning from one hidden
+            state to another. Default is [[0.999, 0.001], [0.001,
+            0.999]].
+        emission_p : list of of list of float, optional
+            Initial probabilities of emitting an observable given the
+            present hidden state. Default is [[0.6, 0.4], [0.4, 0.6]].
+        max_signals : int, optional
+            Maximum number of signals sampled per element pair from
+            each replica. Default is 200.
+        n_iter : int, optional
+            Maximum number of Baum-Welch iterations. Default is 100.
+        tol : float, optional
+            Convergence threshold on the log-likelihood per frame.
+            Default is 1e-4.
+        cores : int, optional
+            Number of threads used by the compiled kernel. Default is 1.
+        use_python : bool, optional
+            Fit with the NumPy implementation. Default is False.
+        seed : int, optional
+            Seed for sampling the signals.
+
+        Returns
+        -------
+        dict
+            `hmm_params`, the fitted 'start_p', 'trans_p', 'emission_p'
+            and 'loglik' keyed by the frozenset of the two elements.
+        """
+        for rep in self.replica:
+            assert rep['cmat'] is not None,\
+                "Not all contact matrices have been generated."
+            assert not rep['processed'],\
+                "Parameters must be fitted before decoding."
+
+        rng = np.random.RandomState(seed)
+        unique, elements = np.unique(self.atoms, return_inverse=True)
+        samples = {}
+        for rep in self.replica:
+            cmat = rep['cmat']
+            if isinstance(cmat, (SparseContacts, PackedContacts)):
+                atom_i, atom_j, counts = cmat.active()
+                run = triage(counts, cmat.n_frames, n)[2]
+            else:
+                atom_i, atom_j, _, _, run = triage_contacts(cmat, n)
+            atom_i, atom_j = atom_i[run], atom_j[run]
+
+            first = np.minimum(elements[atom_i], elements[atom_j])
+            second = np.maximum(elements[atom_i], elements[atom_j])
+            codes = first * len(unique) + second
+            for code in np.unique(codes):
+                index = np.flatnonzero(codes == code)
+                if len(index) > max_signals:
+                    index = np.sort(rng.choice(index, max_signals,
+                                               replace=False))
+                if isinstance(cmat, (SparseContacts, PackedContacts)):
+                    block = cmat.signals(atom_i[index], atom_j[index])
+                else:
+                    block = cmat[atom_i[index], atom_j[index], :]
+                samples.setdefault(code, []).append(block)
+
+        for code, blocks in samples.items():
+            key = frozenset([unique[code // len(unique)],
+                             unique[code % len(unique)]])
+            fit_start, fit_trans, fit_emission, loglik = baum_welch(
+                blocks, start_p, trans_p, emission_p, n_iter=n_iter,
+                tol=tol, cores=cores, use_python=use_python)
+            self.hmm_params[key] = {'start_p': fit_start,
+                                    'trans_p': fit_trans,
+                                    'emission_p': fit_emission,
+                                    'loglik': loglik}
+        return self.hmm_params
+
     def decode(self, n=10, states=[0, 1], start_p=[0.5, 0.5],
                trans_p=[[0.999, 0.001], [0.001, 0.999]],
                emission_p=[[0.60, 0.40], [0.40, 0.60]], min_lifetime=20,
-               cores=1, use_python=False):
+               cores=1, use_python=False, chunk=None, low_memory=None,
+               posteriors=False, min_confidence=None, pair_params=None):
         """Uses Viterbi algorithm to clean the signal for each bond.
 
         Prior to processing each individual index in the contact
@@ -345,8 +962,10 @@ class Network:
             bond has more than `n` occurrences of the least common
             state, then it will be processed with the Viterbi algorithm.
         states : list of int, optional
-            Numerical representations of the states in the system.
-            Default is [0, 1].
+            Contact value written to the contact matrix for each hidden
+            state, e.g. [0, 1, 1] for an unbonded, a transient and a
+            bonded state. Models with more than two hidden states are
+            decoded by the compiled N-state kernel. Default is [0, 1].
         start_p : list of float, optional
             Probabilities of starting in a particular hidden state.
             Default is [0.5, 0.5].
@@ -355,12 +974,77 @@ class Network:
             another. Default is [[0.999, 0.001], [0.001, 0.999]].
         emission_p : list of of list of float, optional
             Probabilities of emitting an observable given the present
-            hidden state. Default is [[0.6, 0.4], [0.4, 0.6]].
+            hidden state. Default is [[0.6, 0.4], [0.4, 0.6]]. The
+            parameters fitted by `fit_hmm` take precedence for pairs of
+            the elements they were fitted for.
+        cores : int, optional
+            Number of threads used by the compiled decoder. Default is 1.
+        use_python : bool, optional
+            Decode with the NumPy implementation, `batch_viterbi`,
+            instead of the compiled one. This is always done if the
+            compiled extension is not available. Default is False.
+        chunk : int, optional
+            If specified, `SparseContacts` contact matrices are decoded
+            `chunk` frames at a time, carrying the Viterbi scores over
+            between chunks. Streamed replicas default to the chunk size
+            given in `add_replica`. This bounds the expanded signals and
+            the backpointers to one chunk, see `ChunkedViterbi`, but
+            uses the NumPy decoder, so `cores` does not apply.
+        low_memory : bool, optional
+            If True, the compiled decoder keeps only checkpoints of the
+            Viterbi scores and recomputes backpointers while tracing
+            back, trading some speed for memory that grows with the
+            square root of the number of frames. Default is None, which
+            does so only for very long trajectories.
+        posteriors : bool, optional
+            Also compute the forward-backward posterior probability of
+            each decoded pair being bonded at every frame, stored as
+            uint8 in the 'posteriors' entry of each replica. Only pairs
+            that are decoded pay the cost. See `transition_confidence`.
+            The posteriors of every frame are held in memory, so they
+            cannot be combined with `chunk`, streamed replicas or
+            memory-mapped contact matrices. Default is False.
+        min_confidence : float, optional
+            Drop transition frames whose confidence is below this
+            value, so that no structures are generated for uncertain
+            flickers. Implies `posteriors`. Default is None.
+        pair_params : dict, optional
+            HMM parameters for particular pairs of elements, keyed by
+            the frozenset of the two elements, e.g.
+            ``{frozenset(['Li', 'O']): (start_p, trans_p, emission_p)}``.
+            These take precedence over the parameters fitted by
+            `fit_hmm` and over the defaults. All parameter sets must
+            have the same number of states and observables. Bonds are
+            grouped by parameter set inside the compiled decoder, so
+            every pair is still decoded in a single pass.
+
+        Notes
+        -----
+        If a cache is set with `set_cache`, the decoded contact matrix
+        of every replica is stored and, on a rerun with the same
+        contact matrix and HMM parameters, loaded instead of decoded
+        again. Only the transition frames are then recomputed, so
+        `min_lifetime` and `min_confidence` can be changed freely.
         """
         for rep in self.replica:
             assert rep['cmat'] is not None,\
                 "Not all contact matrices have been generated."
 
+        if decode_cpp is None:
+            use_python = True
+        if min_confidence is not None:
+            posteriors = True
+        if posteriors:
+            for rep in self.replica:
+                store = isinstance(rep['cmat'],
+                                   (SparseContacts, PackedContacts))
+                if not rep['processed'] and (self._memmap or store and
+                                             (chunk or rep.get('chunk'))):
+                    raise ValueError("Posteriors cover every frame in "
+                                     "memory, so they cannot be used with "
+                                     "chunked decoding or memory-mapped "
+                                     "contact matrices.")
+
         # Convert HMM parameters to ndarrays.
         if type(states) is not np.ndarray:
             states = np.array(states)
@@ -370,54 +1054,316 @@ class Network:
             trans_p = np.array(trans_p)
         if type(emission_p) is not np.ndarray:
             emission_p = np.array(emission_p)
+        if pair_params is None:
+            pair_params = {}
 
         for rep in self.replica:
+            key = None
+            if not rep['processed'] and self.cache is not None and\
+                    rep.get('cache_key'):
+                key = cache_key('decoded', rep['cache_key'], n, states,
+                                start_p, trans_p, emission_p, pair_params,
+                                self.hmm_params, use_python, chunk)
+                cmat, post = self.cache.load(key)
+                if cmat is not None and (post is not None or
+                                         not posteriors):
+                    rep['cmat'], rep['posteriors'] = cmat, post
+                    rep['processed'] = True
+                    continue
+
             if rep['processed']:
                 pass
+            elif isinstance(rep['cmat'], (SparseContacts, PackedContacts)):
+                if chunk is None and rep.get('chunk'):
+                    rep_chunk = rep['chunk']['size']
+                else:
+                    rep_chunk = chunk
+                rep['posteriors'] = self._decode_store(
+                    rep['cmat'], n, states, start_p, trans_p, emission_p,
+                    cores, use_python, chunk=rep_chunk,
+                    low_memory=low_memory, posteriors=posteriors,
+                    pair_params=pair_params)
+                rep['processed'] = True
             else:
-                run_indices_i = []
-                run_indices_j = []
-                ignore_list = generate_ignore_list(rep['cmat'], n)
-
-                # if cores == 1:
-                for i in range(self.n_atoms - 1):
-                    for j in range(i + 1, self.n_atoms):
-                        if [i, j] in ignore_list[0]:
-                            rep['cmat'][i, j, :] = 0
-                        elif [i, j] in ignore_list[1]:
-                            rep['cmat'][i, j, :] = 1
-                        else:
-                            if use_python:
-                                rep['cmat'][i, j, :] =\
-                                    viterbi(rep['cmat'][i, j, :], states,
-                                            start_p, trans_p, emission_p)
-                            else:
-                                run_indices_i.append(i)
-                                run_indices_j.append(j)
-
-                if not use_python:
-                    # Check if there is anything to decode.
-                    if run_indices_i and run_indices_j:
-                        rep['cmat'][run_indices_i, run_indices_j, :] = \
-                            decode_cpp(rep['cmat'][run_indices_i,
-                                                   run_indices_j, :],
-                                       start_p, trans_p, emission_p, cores)
-                    else:
-                        pass
+                atom_i, atom_j, zeros, ones, run = \
+                    triage_contacts(rep['cmat'], n)
+                rep['cmat'][atom_i[zeros], atom_j[zeros], :] = 0
+                rep['cmat'][atom_i[ones], atom_j[ones], :] = 1
+                run_indices_i = atom_i[run]
+                run_indices_j = atom_j[run]
+
+                groups = self._hmm_groups(run_indices_i, run_indices_j,
+                                          start_p, trans_p, emission_p,
+                                          pair_params)
+                if posteriors:
+                    block = rep['cmat'][run_indices_i, run_indices_j, :]
+                    rep['posteriors'] = {
+                        'atom_i': run_indices_i, 'atom_j': run_indices_j,
+                        'probs': self._posteriors(block, groups, states,
+                                                  cores, use_python)}
+
+                # Check if there is anything to decode.
+                if run.any():
+                    self._decode_dense(rep['cmat'], run_indices_i,
+                                       run_indices_j, groups, states, cores,
+                                       use_python, low_memory)
                 else:
                     pass
                 rep['processed'] = True
 
+            if key is not None:
+                self.cache.save(key, rep['cmat'],
+                                rep['posteriors'] if posteriors else None)
+
         # After processing, locate all frames at which a
         # transition occurred and store it into `self.frames`
         self._find_transition_frames()
 
+        if min_confidence is not None:
+            for rep_id, frames in enumerate(self.frames):
+                confidence = self._frame_confidence(rep_id)
+                self.frames[rep_id] = [f for f in frames
+                                       if confidence.get(f, 0) >=
+                                       min_confidence]
+
         # Clean the transition frames such that only relavent reactive
         # events remain.
         self._clean_frames(min_lifetime=min_lifetime)
 
         return
 
+    def _decode_store(self, cmat, n, states, start_p, trans_p, emission_p,
+                      cores, use_python, chunk=None, low_memory=None,
+                      posteriors=False, pair_params=None):
+        """Decodes a `SparseContacts` or `PackedContacts` in place.
+
+        Pairs that are never in contact are already unbonded at every
+        frame, so only the active pairs are considered. Packed signals
+        are decoded without being unpacked. See `decode` for parameter
+        descriptions.
+
+        Returns
+        -------
+        dict or None
+            Posteriors of the decoded pairs if `posteriors` is True.
+        """
+        atom_i, atom_j, counts = cmat.active()
+        zeros, ones, run = triage(counts, cmat.n_frames, n)
+        run_i, run_j = atom_i[run], atom_j[run]
+        groups = self._hmm_groups(run_i, run_j, start_p, trans_p,
+                                  emission_p, pair_params)
+
+        post = None
+        if posteriors:
+            post = {'atom_i': run_i, 'atom_j': run_j,
+                    'probs': self._posteriors(cmat.signals(run_i, run_j),
+                                              groups, states, cores,
+                                              use_python)}
+
+        cmat.fill(atom_i[zeros], atom_j[zeros], 0)
+        cmat.fill(atom_i[ones], atom_j[ones], 1)
+
+        # Check if there is anything to decode.
+        if run.any() and chunk:
+            labels, params = groups
+            for label in np.unique(labels):
+                mask = labels == label
+                decoder = ChunkedViterbi(*[p[label] for p in params])
+                for start in range(0, cmat.n_frames, chunk):
+                    stop = min(start + chunk, cmat.n_frames)
+                    decoder.update(cmat.signals(run_i[mask], run_j[mask],
+                                                start, stop))
+                # Each chunk is read again before its states are set.
+                for start, block in decoder.backtrace(
+                        lambda start, stop: cmat.signals(
+                            run_i[mask], run_j[mask], start, stop)):
+                    cmat.set_signals(run_i[mask], run_j[mask],
+                                     states[block], start)
+        elif run.any() and isinstance(cmat, PackedContacts) and\
+                not use_python:
+            # The rows are decoded in place, even in a memory map.
+            labels, params = groups
+            cmat.bits = decode_packed_cpp(
+                cmat.bits, cmat.n_frames, *params, cores,
+                low_memory=low_memory, values=states, groups=labels,
+                rows=cmat.rows(run_i, run_j))
+        elif run.any():
+            block = cmat.signals(run_i, run_j)
+            cmat.set_signals(run_i, run_j,
+                             self._decode_signals(block, groups, states,
+                                                  cores, use_python,
+                                                  low_memory))
+        else:
+            pass
+        return post
+
+    def _hmm_groups(self, atom_i, atom_j, start_p, trans_p, emission_p,
+                    pair_params=None):
+        """Groups pairs by the HMM parameters used to decode them.
+
+        Pairs whose elements are in `pair_params` use those parameters,
+        then pairs whose elements have parameters in `hmm_params`, and
+        all other pairs use the given parameters.
+
+        Returns
+        -------
+        labels : np.ndarray
+            Index of the parameter set of every pair.
+        params : tuple of np.ndarray
+            Start, transition and emission probabilities of every
+            parameter set, stacked along the first axis.
+        """
+        default = (start_p, trans_p, emission_p)
+        if not self.hmm_params and not pair_params:
+            return (np.zeros(len(atom_i), dtype=np.intp),
+                    tuple(np.asarray(p)[np.newaxis] for p in default))
+
+        unique, elements = np.unique(self.atoms, return_inverse=True)
+        first = np.minimum(elements[atom_i], elements[atom_j])
+        second = np.maximum(elements[atom_i], elements[atom_j])
+        codes, labels = np.unique(first * len(unique) + second,
+                                  return_inverse=True)
+
+        sets = []
+        for code in codes:
+            key = frozenset([unique[code // len(unique)],
+                             unique[code % len(unique)]])
+            if pair_params and key in pair_params:
+                params = pair_params[key]
+            elif key in self.hmm_params:
+                params = self.hmm_params[key]
+            else:
+                params = default
+            if isinstance(params, dict):
+                params = (params['start_p'], params['trans_p'],
+                          params['emission_p'])
+            sets.append(tuple(np.asarray(p, dtype=np.float64)
+                              for p in params))
+
+        for params in sets:
+            assert all(p.shape == q.shape for p, q in zip(params, sets[0])),\
+                "All HMM parameter sets must have the same shapes."
+        return labels.ravel(), tuple(np.stack(p) for p in zip(*sets))
+
+    def _decode_dense(self, cmat, atom_i, atom_j, groups, states, cores,
+                      use_python, low_memory):
+        """Decodes several pairs of a dense contact matrix in place.
+
+        The frames of every pair are contiguous, so the compiled
+        decoder works on the rows of the contact matrix directly,
+        whether it is in memory or memory-mapped, instead of on a copy.
+        """
+        n_atoms, _, n_frames = cmat.shape
+        kernel = {np.dtype(np.uint8): decode_bytes_cpp,
+                  np.dtype(np.int32): decode_cpp}.get(cmat.dtype)
+        if use_python or kernel is None or not cmat.flags['C_CONTIGUOUS']:
+            cmat[atom_i, atom_j, :] = self._decode_signals(
+                cmat[atom_i, atom_j, :], groups, states, cores, use_python,
+                low_memory)
+            return
+
+        labels, params = groups
+        kernel(cmat.reshape(n_atoms * n_atoms, n_frames), *params, cores,
+               low_memory=low_memory, values=states, groups=labels,
+               rows=atom_i * n_atoms + atom_j)
+        return
+
+    def _decode_signals(self, block, groups, states, cores, use_python,
+                        low_memory):
+        """Decodes a block of signals, grouped by parameter set."""
+        labels, params = groups
+        signals = np.ascontiguousarray(block, dtype=np.int32)
+        if not use_python:
+            return decode_cpp(signals, *params, cores, low_memory=low_memory,
+                              values=states, groups=labels)
+
+        decoded = np.empty_like(signals)
+        for label in np.unique(labels):
+            mask = labels == label
+            decoded[mask] = states[batch_viterbi(
+                signals[mask], *[p[label] for p in params])]
+        return decoded
+
+    def _posteriors(self, block, groups, states, cores, use_python):
+        """Posterior bond probabilities of a block of raw signals,
+        quantized to uint8."""
+        labels, params = groups
+        signals = np.ascontiguousarray(block, dtype=np.int32)
+        if not use_python:
+            return posteriors_cpp(signals, *params, cores, values=states,
+                                  groups=labels)
+
+        probs = np.zeros(block.shape, dtype=np.uint8)
+        for label in np.unique(labels):
+            mask = labels == label
+            probs[mask] = quantize(batch_posteriors(
+                signals[mask], *[p[label] for p in params], values=states))
+        return probs
+
+    def transition_confidence(self, rep_id):
+        """Ranks the transitions of a decoded replica by confidence.
+
+        Each decoded pair is split into runs of constant state, and a
+        run's certainty is the mean posterior probability of its state.
+        The confidence of a pair changing state between frames `f` and
+        `f + 1` is the smaller certainty of the runs on either side, so
+        short flickers score low even though the exact frame of a real
+        transition is itself uncertain. A frame takes the confidence of
+        its most certain transition. Requires `decode` to have been
+        called with `posteriors=True`.
+
+        Parameters
+        ----------
+        rep_id : int
+            Replica identifier.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns 'frame' and 'confidence', most confident first.
+        """
+        confidence = self._frame_confidence(rep_id)
+        df = pd.DataFrame({'frame': list(confidence.keys()),
+                           'confidence': list(confidence.values())},
+                          columns=['frame', 'confidence'])
+        return df.sort_values('confidence', ascending=False)\
+            .reset_index(drop=True)
+
+    def _frame_confidence(self, rep_id):
+        """Maps each transition frame of a replica to its confidence."""
+        rep = self.replica[rep_id]
+        assert rep.get('posteriors') is not None,\
+            "Decode with `posteriors=True` to compute confidences."
+
+        post = rep['posteriors']
+        if isinstance(rep['cmat'], (SparseContacts, PackedContacts)):
+            decoded = rep['cmat'].signals(post['atom_i'], post['atom_j'])
+        else:
+            decoded = rep['cmat'][post['atom_i'], post['atom_j'], :]
+
+        # Posterior of the decoded state at every frame.
+        probs = post['probs'].astype(np.float64) / 255
+        certainty = np.where(decoded > 0, probs, 1 - probs)
+        n_frames = certainty.shape[1]
+        change = np.diff(decoded, axis=1) != 0
+        pairs, frames = np.nonzero(change)
+
+        # Mean certainty of every run of constant state.
+        runs = np.zeros(certainty.shape, dtype=np.int64)
+        runs[:, 1:] = np.cumsum(change, axis=1)
+        runs += np.arange(len(runs))[:, np.newaxis] * n_frames
+        totals = np.bincount(runs.ravel(), weights=certainty.ravel())
+        lengths = np.maximum(np.bincount(runs.ravel()), 1)
+        mean = totals / lengths
+
+        pair_confidence = np.minimum(mean[runs[pairs, frames]],
+                                     mean[runs[pairs, frames + 1]])
+
+        confidence = {}
+        for f, c in zip(frames.tolist(), pair_confidence.tolist()):
+            confidence[f] = max(c, confidence.get(f, 0.0))
+        return confidence
+
     def generate_SMILES(self, rep_id, tol=10):
         """Generates list of SMILES strings from trajectory.
 
@@ -442,7 +1388,8 @@ class Network:
         # if not frames:
         if frames.size == 0:
             num_frames = cmat.shape[2]
-            last_smiles = contact_matrix_to_SMILES(cmat[:, :, -1], self.atoms)
+            last_smiles = self.structure_cache.smiles(cmat[:, :, -1],
+                                                      self.atoms)
             if last_smiles == self.first_smiles:
                 return [(self.first_smiles, 0)]
             else:
@@ -453,15 +1400,16 @@ class Network:
 
         smiles = []
 
-        for f in range(cmat.shape[2]):
-            if np.isclose(frames - f, 0, atol=tol).any():
-                smi = contact_matrix_to_SMILES(cmat[:, :, f], self.atoms)
-                frame = find_nearest(f, frames)
-                smiles.append((smi, frame))
-            else:
-                pass
+        # Only frames within `tol` of a transition frame are visited.
+        frames = np.unique(frames)
+        near = frames_near(frames, tol, cmat.shape[2])
+        nearest = find_nearest_sorted(near, frames)
+        for f, frame in zip(near.tolist(), nearest.tolist()):
+            smi = self.structure_cache.smiles(cmat[:, :, f], self.atoms)
+            smiles.append((smi, frame))
 
-        last_smiles = contact_matrix_to_SMILES(cmat[:, :, -1], self.atoms)
+        last_smiles = self.structure_cache.smiles(cmat[:, :, -1],
+                                                  self.atoms)
         smiles.append((last_smiles, cmat.shape[2] - 1))
 
         reduced_smiles = remove_consecutive_repeats(smiles)
@@ -474,21 +1422,34 @@ class Network:
         self.replica[rep_id]['smiles'] = reduced_smiles
         return reduced_smiles
 
-    def get_structures(self, tol=10):
-        for rep_id in range(len(self.replica)):
-            if self.replica[rep_id]['structures'] is None:
+    def get_structures(self, tol=10, cores=1):
+        """Builds the structures near the transitions of every replica.
+
+        Parameters
+        ----------
+        tol : int, optional
+            Frames within `tol` frames of a transition frame are
+            converted to structures. Default is 10.
+        cores : int, optional
+            If greater than 1, the SMILES of new bond patterns are
+            built on a pool of `cores` processes, see
+            `StructureCache.map_smiles`. Default is 1.
+        """
+        pending = [rep_id for rep_id, rep in enumerate(self.replica)
+                   if rep['structures'] is None]
+        with self.structure_cache.workers(self.atoms,
+                                          cores if pending else 1):
+            for rep_id in pending:
                 self.replica[rep_id]['structures'] =\
                     self.get_structures_from_replica(rep_id, tol)
-            else:
-                pass
         return
 
     def get_structures_from_replica(self, rep_id, tol):
         frames = np.array(self.frames[rep_id])
         cmat = self.replica[rep_id]['cmat']
 
-        last_smiles, last_mol = cmat_to_structure(cmat[:, :, -1],
-                                                  self.atoms)
+        last_smiles, last_mol = self.structure_cache.get(cmat[:, :, -1],
+                                                         self.atoms)
         num_frames = cmat.shape[2]
         # Handles if there are no recorded transitions.
         if frames.size == 0:
@@ -510,32 +1471,28 @@ class Network:
         else:
             pass
 
-        structures = pd.DataFrame(columns=['smiles', 'molecule', 'frame',
-                                           'transition_frame'])
-        for f in range(cmat.shape[2]):
-            # If the current frame is within `tol` of any of the
-            # transition frames in `frames`.
-            if np.isclose(frames - f, 0, atol=tol).any():
-                smi, mol = cmat_to_structure(cmat[..., f], self.atoms)
-                transition_frame = find_nearest(f, frames)
-                new_row = pd.DataFrame({'smiles': smi,
-                                        'molecule': mol,
-                                        'frame': f,
-                                        'transition_frame': transition_frame},
-                                       index=[0])
-                structures = structures.append(new_row, ignore_index=True)
-            else:
-                pass
+        # Only frames within `tol` of any of the transition frames in
+        # `frames` are visited, each with its nearest transition frame.
+        frames = np.unique(frames)
+        near = frames_near(frames, tol, num_frames)
+        nearest = find_nearest_sorted(near, frames)
+        records = StructureRecords()
+        smiles = self.structure_cache.map_smiles(
+            (cmat[..., f] for f in near.tolist()), self.atoms)
+        for f, transition_frame, frame_smiles in zip(
+                near.tolist(), nearest.tolist(), smiles):
+            records.append(frame_smiles, f, transition_frame)
 
         # Adds the last structure to the end.
-        last_row = pd.DataFrame({'smiles': last_smiles,
-                                 'molecule': last_mol,
-                                 'frame': num_frames - 1,
-                                 'transition_frame': num_frames - 1},
-                                index=[0])
-        structures = structures.append(last_row, ignore_index=True)
+        records.append(last_smiles, num_frames - 1, num_frames - 1,
+                       last_mol)
 
-        reduced_structures = remove_consecutive_repeats(structures)
+        # Molecules are only built for the rows left after removing
+        # consecutive repeats.
+        reduced_structures = records.to_frame(
+            rows=records.changes(),
+            molecule=lambda f: self.structure_cache.get(cmat[..., f],
+                                                        self.atoms)[1])
 
         if reduced_structures.loc[0, 'smiles'] != self.first_smiles:
             first_row = pd.DataFrame({'smiles': [self.first_smiles],
@@ -638,116 +1595,30 @@ class Network:
             self._pairs.append([i, j])
         return
 
-    def _compute_distances(self, rep_id):
+    def _pair_cutoffs(self):
         """
-        Computes the interatomic distances for all pairs of atoms.
+        Fetches the cutoff of every unique atom pair.
 
-        Parameters
-        ----------
-        rep_id : int
-            ID number of the replica of interest.
+        The cutoffs are computed once and cached until `set_cutoff` is
+        called again.
 
         Returns
         -------
         numpy.ndarray
-            Interatomic distances for all specified atom pairs. Shape
-            is (n_frames, n_pairs).
-
-        Raises
-        ------
-        IndexError
-            If `rep_id` is not an index in `replica`.
-        AssertionError
-            If the trajectory associated with `rep_id` does not exist.
-        AssertionError
-            If the atom pairs have not been determined.
-        """
-        if rep_id > len(self.replica) - 1:
-            raise IndexError(str(rep_id) + " is outside of index range.")
-        assert self.replica[rep_id]['traj'],\
-            "Trajectory does not exist."
-        assert self._pairs, "Atom pairs not determined yet."
-
-        return md.compute_distances(self.replica[rep_id]['traj'],
-                                    self._pairs, periodic=self.pbc)
-
-    def _reshape_to_square(self, linear_matrix):
-        """
-        Converts a row matrix into a square matrix.
-
-        Takes each row and reshapes it to fit into the upper triangle
-        of a square matrix, i.e. populating the upper off-diagonal
-        elements.
-
-        Parameters
-        ----------
-        linear_matrix : numpy.ndarray
-            Row of interatomic distances at every frame. Shape is
-            (n_frames, n_pairs).
-
-        Returns
-        -------
-        square_matrix : numpy.ndarray
-            Reshaped matrix to be 3D. Each row is reshaped into a square
-            matrix with only the upper off-diagonal elements populated
-            for all frames.
-
-        Example
-        -------
-        >>> foo = np.array([[1, 2, 3],
-        ...                 [4, 5, 6]])
-        >>> bar = self._reshape_to_square(foo)
-        >>> bar[:, :, 0]  # first frame
-        array([[0, 1, 2],
-               [0, 0, 3],
-               [0, 0, 0]])
-        >>> bar[:, :, 1]  # second frame
-        array([[0, 4, 5],
-               [0, 0, 6],
-               [0, 0, 0]])
+            Cutoff of each atom pair in the same order as the pairs
+            from `_generate_pairs`. Shape is (n_pairs,).
         """
-        frames = linear_matrix.shape[0]
-        square_matrix = np.zeros((self.n_atoms, self.n_atoms, frames))
-        upper_tri_id = np.triu_indices(self.n_atoms, 1)
-
-        for f in range(frames):
-            square_matrix[upper_tri_id[0], upper_tri_id[1], f] =\
-                linear_matrix[f, :]
-
-        return square_matrix
-
-    def _build_connections(self, distances):
-        """
-        Converts an array of distances to a contact matrix.
-
-        Parameters
-        ----------
-        distances : numpy.ndarray
-            Interatomic distances at all frames for all unique atom
-            pairs.
-
-        Returns
-        -------
-        cmat : numpy.ndarray
-            Contact matrix at all frames
-        """
-        frames = distances.shape[2]
-
-        cmat = np.zeros((self.n_atoms, self.n_atoms, frames), dtype=np.int32)
-
-        for i in range(self.n_atoms - 1):
-            for j in range(i + 1, self.n_atoms):
-                atom1 = self.atoms[i]
-                atom2 = self.atoms[j]
-                cmat[i, j, :] =\
-                    np.where(distances[i, j, :] <
-                             self._cutoff[frozenset([atom1, atom2])], 1, 0)
-        return cmat
+        n_pairs = self.n_atoms * (self.n_atoms - 1) // 2
+        if self._pair_cutoff is None or len(self._pair_cutoff) != n_pairs:
+            elements, table = self._cutoff_table()
+            atom_i, atom_j = np.triu_indices(self.n_atoms, 1)
+            self._pair_cutoff = table[elements[atom_i], elements[atom_j]]
+        return self._pair_cutoff
 
     def _get_atoms(self):
         """Generates the list of atoms in the trajectory."""
 
-        table, _ = self.replica[0]['traj'].top.to_dataframe()
+        table, _ = self.topology.top.to_dataframe()
         self.atoms = table['element'].tolist()
         return
 
@@ -783,6 +1654,7 @@ class Network:
                 if frozenset([atom1, atom2]) not in self._cutoff.keys():
                     self._cutoff[frozenset([atom1, atom2])] =\
                         self._bond_distance(atom1, atom2, frac=cutoff_frac)
+                    self._pair_cutoff = None
         return
 
     def _bond_distance(self, atom1, atom2, frac=1.4):
@@ -821,9 +1693,11 @@ class Network:
     def _find_transition_frames(self):
         """Finds transitions in the processed contact matrix.
 
-        Checks if two consecutive contact matrices are not equivalent.
-        If they are not, then a transition likely occured and the frame
-        number is recorded.
+        Compares the signal of every pair that is ever in contact with
+        itself one frame later. The frames at which any pair changes
+        are recorded in `self.frames`, sorted and without repeats, and
+        the changes themselves in the 'transitions' entry of each
+        replica.
 
         Raises
         ------
@@ -845,9 +1719,10 @@ class Network:
             "Number of sets of frames does not equal number of replicas."
 
         for rep_id, rep in enumerate(self.replica):
-            trans_frames = np.where(np.diff(rep['cmat'])
-                                    .reshape((self.n_atoms ** 2, -1)))[1]
-            self.frames[rep_id] = list(trans_frames)
+            frames, atom_i, atom_j = find_transitions(rep['cmat'])
+            rep['transitions'] = {'frame': frames, 'atom_i': atom_i,
+                                  'atom_j': atom_j}
+            self.frames[rep_id] = np.unique(frames).tolist()
         return
 
     def _build_network(self, rep_id):
@@ -986,31 +1861,29 @@ class Network:
         return
 
     def _clean_frames(self, min_lifetime):
+        """Drops transition frames that are followed by another
+        transition within `min_lifetime` frames. The last transition
+        frame of each replica is always kept."""
 
-        for frames in self.frames:
-            bad_frames = []
-            for i, f in enumerate(frames):
-                if f == frames[-1]:
-                    break
-                else:
-                    if frames[i + 1] - f < min_lifetime:
-                        bad_frames.append(f)
-                    else:
-                        pass
-
-            for bad_frame in bad_frames:
-                frames.remove(bad_frame)
+        for rep_id, frames in enumerate(self.frames):
+            frames = np.asarray(frames, dtype=np.int64)
+            keep = np.ones(len(frames), dtype=bool)
+            keep[:-1] = np.diff(frames) >= min_lifetime
+            self.frames[rep_id] = frames[keep].tolist()
 
         return
 
     def _traj_to_smiles(self):
         """Generates the SMILES for the starting point in trajectory."""
-        distances = md.compute_distances(self.replica[0]['traj'][0],
-                                         self._pairs, periodic=self.pbc)
-        distances = self._reshape_to_square(distances)
-        cmat = self._build_connections(distances)
-        self.first_smiles, self.first_mol = cmat_to_structure(cmat[..., 0],
-                                                              self.atoms)
+        rep = self.replica[0]
+        if rep.get('chunk'):
+            first = md.load_frame(rep['path'], 0, top=rep['chunk']['top'],
+                                  **rep['chunk']['kwargs'])
+        else:
+            first = rep['traj'][0]
+        cmat = self._compute_cmat(first)
+        self.first_smiles, self.first_mol = \
+            self.structure_cache.get(cmat[..., 0], self.atoms)
         return
 
     def _traj_to_topology(self, traj, format='xyz'):
@@ -1028,7 +1901,7 @@ class Network:
         mol.write('pdb', topology_path, overwrite=True)
         return topology_path
 
-    def save(self, name):
+    def save(self, name, binary=False):
         """Saves the current state of the reaction network as a txt.
 
         This saves the SMILES list and frames that each SMILES state
@@ -1038,6 +1911,12 @@ class Network:
         ----------
         name : str
             Name of the checkpoint file.
+        binary : bool, optional
+            If `True`, write a versioned binary checkpoint,
+            `name + '.npz'`, instead. It also stores the transition
+            frames, the pairs that changed at each of them and the
+            fitted HMM parameters, and loads much faster. See
+            `save_checkpoint`. Default is `False`.
         """
         for rep in self.replica:
             if rep['structures'] is None:
@@ -1046,6 +1925,11 @@ class Network:
             else:
                 pass
 
+        if binary:
+            save_checkpoint(name + '.npz', self.first_smiles, self.replica,
+                            self.frames, self.hmm_params)
+            return
+
         with open(name + '.txt', 'w') as f:
             f.write('{}\n'.format(self.first_smiles))
             for rep_id, rep in enumerate(self.replica):
@@ -1062,11 +1946,22 @@ class Network:
     def load(self, name):
         """Loads the network from a checkpoint file.
 
+        Binary checkpoints, ending in '.npz', restore the molecules of
+        a replica only when its 'structures' are first accessed.
+
         Parameters
         ----------
         name : str
             Path to the checkpoint file.
         """
+        if name.endswith('.npz'):
+            self.first_smiles, replicas, frames, hmm_params = \
+                load_checkpoint(name)
+            self.replica.extend(replicas)
+            self.frames.extend(frames)
+            self.hmm_params.update(hmm_params)
+            return
+
         column_names = ['frame', 'transition_frame', 'smiles', 'molecule']
         with open(name, 'r') as f:
             self.first_smiles = f.readline().strip('\n')
@@ -1128,3 +2023,31 @@ class Network:
             self._draw_network(final, filename=filename, use_LR=use_LR,
                                layout=layout)
         return
+
+
+_worker_network = None
+
+
+def _init_contact_worker(network):
+    global _worker_network
+    _worker_network = network
+    return
+
+
+def _contact_worker(task):
+    shared = [SharedMemory(name=name) for name in task['shared']]
+    try:
+        n_frames, cmat = _worker_network._task_cmat(
+            task, [shm.buf for shm in shared])
+    finally:
+        for shm in shared:
+            shm.close()
+    return task['rep_id'], n_frames, cmat
+
+
+def _free_shared(shared):
+    """Closes and removes several blocks of shared memory."""
+    for shm in shared:
+        shm.close()
+        shm.unlink()
+    return
@@ -3,11 +3,21 @@
 #include <cmath>
 #include <sys/time.h>
 #include <time.h>
+#include <stdint.h>
+#include <algorithm>
 #include <vector>
+#ifdef _OPENMP
 #include <omp.h>
+#else
+#include <atomic>
+#include <thread>
+#endif
 #include "hmm.h"
 
 
+const int BATCH = 64;
+
+
 double my_timer() {
     struct timeval tv;
     struct timezone tz;
@@ -16,39 +26,738 @@ double my_timer() {
 }
 
 
-void decode(int **obs, const int num_bonds, const int num_frames, float start_p[2], float trans_p[2][2], float emission_p[2][2], int cores) {
-    omp_set_dynamic(0);
-    omp_set_num_threads(cores);
-    #pragma omp parallel for
-    for (int i = 0; i < num_bonds; i++) {
-        viterbi(obs[i], num_frames, start_p, trans_p, emission_p);
+void decode(int **obs, const int num_bonds, const int num_frames, const int num_sets, const int *offsets, const float *start_p, const float *trans_p, const float *emission_p, int cores, int checkpoint) {
+    std::vector <LogParams> params(num_sets);
+    for (int set = 0; set < num_sets; set++) {
+        params[set] = log_params(start_p + 2 * set, trans_p + 4 * set, emission_p + 4 * set);
     }
+    IntSignals signals = {obs};
+    run_groups(num_sets, offsets, cores, [&](const int first, const int num, const int set) {
+        viterbi_batch(signals, first, num, num_frames, params[set], checkpoint);
+    });
 }
 
 
-void viterbi(int *obs, const int num_frames, float start_p[2], float trans_p[2][2], float emission_p[2][2]) {
+void decode_packed(unsigned char **obs, const int num_bonds, const int num_frames, const int num_sets, const int *offsets, const float *start_p, const float *trans_p, const float *emission_p, int cores, int checkpoint) {
+    std::vector <LogParams> params(num_sets);
+    for (int set = 0; set < num_sets; set++) {
+        params[set] = log_params(start_p + 2 * set, trans_p + 4 * set, emission_p + 4 * set);
+    }
+    PackedSignals signals = {obs};
+    run_groups(num_sets, offsets, cores, [&](const int first, const int num, const int set) {
+        viterbi_batch(signals, first, num, num_frames, params[set], checkpoint);
+    });
+}
+
+
+void decode_bytes(unsigned char **obs, const int num_bonds, const int num_frames, const int num_sets, const int *offsets, const float *start_p, const float *trans_p, const float *emission_p, int cores, int checkpoint) {
+    std::vector <LogParams> params(num_sets);
+    for (int set = 0; set < num_sets; set++) {
+        params[set] = log_params(start_p + 2 * set, trans_p + 4 * set, emission_p + 4 * set);
+    }
+    ByteSignals signals = {obs};
+    run_groups(num_sets, offsets, cores, [&](const int first, const int num, const int set) {
+        viterbi_batch(signals, first, num, num_frames, params[set], checkpoint);
+    });
+}
+
+
+void decode_states(int **obs, const int num_bonds, const int num_frames, const int num_sets, const int *offsets, const int num_states, const int num_obs, const double *log_start, const double *log_trans, const double *log_emission, const int *values, int cores, int checkpoint) {
+    std::vector <StateModel> models(num_sets);
+    for (int set = 0; set < num_sets; set++) {
+        models[set] = state_model(set, num_states, num_obs, log_start, log_trans, log_emission, values);
+    }
+    IntSignals signals = {obs};
+    run_groups(num_sets, offsets, cores, [&](const int first, const int num, const int set) {
+        viterbi_batch_states(signals, first, num, num_frames, models[set], checkpoint);
+    });
+}
+
+
+void decode_bytes_states(unsigned char **obs, const int num_bonds, const int num_frames, const int num_sets, const int *offsets, const int num_states, const int num_obs, const double *log_start, const double *log_trans, const double *log_emission, const int *values, int cores, int checkpoint) {
+    std::vector <StateModel> models(num_sets);
+    for (int set = 0; set < num_sets; set++) {
+        models[set] = state_model(set, num_states, num_obs, log_start, log_trans, log_emission, values);
+    }
+    ByteSignals signals = {obs};
+    run_groups(num_sets, offsets, cores, [&](const int first, const int num, const int set) {
+        viterbi_batch_states(signals, first, num, num_frames, models[set], checkpoint);
+    });
+}
+
+
+void decode_packed_states(unsigned char **obs, const int num_bonds, const int num_frames, const int num_sets, const int *offsets, const int num_states, const double *log_start, const double *log_trans, const double *log_emission, const int *values, int cores, int checkpoint) {
+    std::vector <StateModel> models(num_sets);
+    for (int set = 0; set < num_sets; set++) {
+        models[set] = state_model(set, num_states, 2, log_start, log_trans, log_emission, values);
+    }
+    PackedSignals signals = {obs};
+    run_groups(num_sets, offsets, cores, [&](const int first, const int num, const int set) {
+        viterbi_batch_states(signals, first, num, num_frames, models[set], checkpoint);
+    });
+}
+
+
+void posteriors(int **obs, unsigned char **out, const int num_bonds, const int num_frames, const int num_sets, const int *offsets, const int num_states, const int num_obs, const double *start_p, const double *trans_p, const double *emission_p, const double *weight, int cores) {
+    std::vector <ProbModel> models(num_sets);
+    for (int set = 0; set < num_sets; set++) {
+        models[set] = {num_states, num_obs, start_p + set * num_states, trans_p + set * num_states * num_states, emission_p + set * num_states * num_obs, weight};
+    }
+    IntSignals signals = {obs};
+    run_groups(num_sets, offsets, cores, [&](const int first, const int num, const int set) {
+        posterior_batch(signals, out, first, num, num_frames, models[set]);
+    });
+}
+
+
+void expected_counts(int **obs, double **counts, const int num_bonds, const int num_frames, const int num_states, const int num_obs, const double *start_p, const double *trans_p, const double *emission_p, int cores) {
+    ProbModel model = {num_states, num_obs, start_p, trans_p, emission_p, nullptr};
+    IntSignals signals = {obs};
+    run_batches(num_bonds, cores, [&](const int first, const int num) {
+        count_batch(signals, counts, first, num, num_frames, model);
+    });
+}
+
+
+// Splits the bonds of every parameter set into batches and calls
+// `body(first, num, set)` for each of them on `cores` threads. The
+// bonds of set `s` are `offsets[s]` to `offsets[s + 1]`, so a batch
+// never mixes parameter sets. Batches are shrunk when there are too
+// few bonds to keep every thread busy. Uses OpenMP when the extension
+// was built with it and plain C++ threads otherwise.
+template <class Body>
+void run_groups(const int num_sets, const int *offsets, int cores, Body body) {
+    const int num_bonds = offsets[num_sets] - offsets[0];
+    cores = std::max(1, std::min(cores, num_bonds));
+    const int size = std::max(1, std::min(BATCH, (num_bonds + cores - 1) / cores));
+
+    std::vector <int> firsts, sets;
+    for (int set = 0; set < num_sets; set++) {
+        for (int first = offsets[set]; first < offsets[set + 1]; first += size) {
+            firsts.push_back(first);
+            sets.push_back(set);
+        }
+    }
+    const int num_batches = firsts.size();
+
+#ifdef _OPENMP
+    #pragma omp parallel for schedule(dynamic) num_threads(cores)
+    for (int batch = 0; batch < num_batches; batch++) {
+        const int set = sets[batch];
+        body(firsts[batch], std::min(size, offsets[set + 1] - firsts[batch]), set);
+    }
+#else
+    std::atomic <int> next (0);
+    auto worker = [&]() {
+        for (int batch = next++; batch < num_batches; batch = next++) {
+            const int set = sets[batch];
+            body(firsts[batch], std::min(size, offsets[set + 1] - firsts[batch]), set);
+        }
+    };
+    std::vector <std::thread> threads;
+    for (int i = 1; i < cores; i++) {
+        threads.emplace_back(worker);
+    }
+    worker();
+    for (auto &thread : threads) {
+        thread.join();
+    }
+#endif
+}
+
+
+// `run_groups` for bonds that all share one parameter set.
+template <class Body>
+void run_batches(const int num_bonds, int cores, Body body) {
+    const int offsets[2] = {0, num_bonds};
+    run_groups(1, offsets, cores, [&](const int first, const int num, const int) {
+        body(first, num);
+    });
+}
+
+
+LogParams log_params(const float *start_p, const float *trans_p, const float *emission_p) {
+    // Same rounding as `viterbi`, so both kernels find the same path.
+    LogParams params;
+    for (int st = 0; st < 2; st++) {
+        for (int obs = 0; obs < 2; obs++) {
+            params.start[st][obs] = log10(start_p[st] * emission_p[2 * st + obs]);
+            params.emission[st][obs] = log10(emission_p[2 * st + obs]);
+        }
+        for (int next = 0; next < 2; next++) {
+            params.trans[st][next] = log10(trans_p[2 * st + next]);
+        }
+    }
+    return params;
+}
+
+
+// Model of parameter set `set` out of log10 parameters stacked along
+// their first axis.
+StateModel state_model(const int set, const int num_states, const int num_obs, const double *log_start, const double *log_trans, const double *log_emission, const int *values) {
+    StateModel model = {num_states, num_obs,
+                        log_start + set * num_states * num_obs,
+                        log_trans + set * num_states * num_states,
+                        log_emission + set * num_states * num_obs,
+                        values};
+    return model;
+}
+
+
+// Advances the scores of a batch of bonds by frame `t` and returns the
+// backpointers of both states as one bit per bond.
+template <class Signals>
+inline void viterbi_step(Signals &obs, const int first, const int num, const int t, double *v0, double *v1, const LogParams &params, uint64_t &bits0, uint64_t &bits1) {
+    int o[BATCH];
+    unsigned char from0[BATCH], from1[BATCH];
+
+    const double t00 = params.trans[0][0], t10 = params.trans[1][0];
+    const double t01 = params.trans[0][1], t11 = params.trans[1][1];
+
+    for (int b = 0; b < num; b++) {
+        o[b] = obs.get(first + b, t);
+    }
+
+    for (int b = 0; b < num; b++) {
+        double p00 = v0[b] + t00, p10 = v1[b] + t10;
+        double p01 = v0[b] + t01, p11 = v1[b] + t11;
+        // Ties go to the lowest state, as in every other kernel.
+        from0[b] = p10 > p00;
+        from1[b] = p11 > p01;
+        v0[b] = (from0[b] ? p10 : p00) + (o[b] ? params.emission[0][1] : params.emission[0][0]);
+        v1[b] = (from1[b] ? p11 : p01) + (o[b] ? params.emission[1][1] : params.emission[1][0]);
+    }
+
+    bits0 = 0;
+    bits1 = 0;
+    for (int b = 0; b < num; b++) {
+        bits0 |= (uint64_t) from0[b] << b;
+        bits1 |= (uint64_t) from1[b] << b;
+    }
+}
+
+
+// Number of frames between checkpoints. Balances the saved scores
+// (16 bytes per bond per checkpoint) against the backpointers of one
+// segment (16 bytes per frame), about 250 KB per million frames.
+int segment_length(const int num_frames) {
+    return std::max(1, (int) std::sqrt((double) BATCH * num_frames));
+}
+
+
+// Decodes up to `BATCH` bonds at once. Scores are kept as a
+// structure of arrays, one entry per bond, so the inner loop over
+// bonds has no dependencies and can be vectorized. The backpointers
+// of every frame are stored as one bit per bond in a 64-bit word.
+//
+// With `checkpoint`, only the scores at the start of every segment
+// are kept during the forward pass. The backpointers are then
+// recomputed one segment at a time while tracing back, so memory
+// grows with the square root of the number of frames.
+template <class Signals>
+void viterbi_batch(Signals obs, const int first, const int num, const int num_frames, const LogParams &params, int checkpoint) {
+    if (num_frames == 0) {
+        return;
+    }
+
+    // Reused by every call on this thread.
+    static thread_local std::vector <uint64_t> backpointers;
+    static thread_local std::vector <double> checkpoints;
+
+    const int segment = checkpoint ? segment_length(num_frames) : num_frames;
+    const int num_segments = (num_frames - 1 + segment - 1) / segment;
+    backpointers.resize(2 * (size_t) std::min(segment, num_frames));
+    if (checkpoint) {
+        checkpoints.resize(2 * BATCH * (size_t) std::max(num_segments, 1));
+    }
+
+    double v0[BATCH], v1[BATCH];
+    int state[BATCH];
+    uint64_t bits0, bits1;
+
+    for (int b = 0; b < num; b++) {
+        int o0 = obs.get(first + b, 0);
+        v0[b] = params.start[0][o0];
+        v1[b] = params.start[1][o0];
+    }
+
+    if (!checkpoint) {
+        for (int t = 1; t < num_frames; t++) {
+            viterbi_step(obs, first, num, t, v0, v1, params, bits0, bits1);
+            backpointers[2 * (size_t) t] = bits0;
+            backpointers[2 * (size_t) t + 1] = bits1;
+        }
+
+        // Trace back through the backpointers of each bond.
+        for (int b = 0; b < num; b++) {
+            int st = (v1[b] > v0[b]) ? 1 : 0;
+            for (int t = num_frames - 1; t > 0; t--) {
+                obs.set(first + b, t, st);
+                st = (backpointers[2 * (size_t) t + st] >> b) & 1;
+            }
+            obs.set(first + b, 0, st);
+        }
+        return;
+    }
+
+    // Forward pass, saving the scores at frame `seg * segment`.
+    for (int t = 0; t < num_frames; t++) {
+        if (t > 0) {
+            viterbi_step(obs, first, num, t, v0, v1, params, bits0, bits1);
+        }
+        if (t % segment == 0 && t / segment < num_segments) {
+            double *saved = &checkpoints[2 * BATCH * (size_t) (t / segment)];
+            std::copy(v0, v0 + num, saved);
+            std::copy(v1, v1 + num, saved + BATCH);
+        }
+    }
+
+    for (int b = 0; b < num; b++) {
+        state[b] = (v1[b] > v0[b]) ? 1 : 0;
+    }
+
+    // Replay each segment from its checkpoint, last one first. Frames
+    // are only overwritten after every segment reading them is done.
+    for (int seg = num_segments - 1; seg >= 0; seg--) {
+        const int begin = seg * segment;
+        const int end = std::min(begin + segment, num_frames - 1);
+        const double *saved = &checkpoints[2 * BATCH * (size_t) seg];
+        std::copy(saved, saved + num, v0);
+        std::copy(saved + BATCH, saved + BATCH + num, v1);
+
+        for (int t = begin + 1; t <= end; t++) {
+            viterbi_step(obs, first, num, t, v0, v1, params, bits0, bits1);
+            backpointers[2 * (size_t) (t - begin - 1)] = bits0;
+            backpointers[2 * (size_t) (t - begin - 1) + 1] = bits1;
+        }
+
+        for (int b = 0; b < num; b++) {
+            int st = state[b];
+            for (int t = end; t > begin; t--) {
+                obs.set(first + b, t, st);
+                st = (backpointers[2 * (size_t) (t - begin - 1) + st] >> b) & 1;
+            }
+            state[b] = st;
+        }
+    }
+
+    for (int b = 0; b < num; b++) {
+        obs.set(first + b, 0, state[b]);
+    }
+}
+
+
+// Advances the scores of a batch of bonds by frame `t` for a model
+// with any number of states. `v` and `next` hold the scores of state
+// `st` for bond `b` at `st * BATCH + b`, and `from` receives the
+// backpointers in the same layout. Ties go to the lowest state,
+// matching `fast_viterbi`.
+template <class Signals>
+inline void viterbi_step_states(Signals &obs, const int first, const int num, const int t, const double *v, double *next, unsigned char *from, const StateModel &model) {
+    const int num_states = model.num_states;
+    int o[BATCH];
+    double best[BATCH];
+    unsigned char arg[BATCH];
+
+    for (int b = 0; b < num; b++) {
+        o[b] = obs.get(first + b, t);
+    }
+
+    for (int st = 0; st < num_states; st++) {
+        const double trans0 = model.log_trans[st];
+        for (int b = 0; b < num; b++) {
+            best[b] = v[b] + trans0;
+            arg[b] = 0;
+        }
+        for (int prev = 1; prev < num_states; prev++) {
+            const double trans = model.log_trans[prev * num_states + st];
+            const double *v_prev = v + prev * BATCH;
+            for (int b = 0; b < num; b++) {
+                double score = v_prev[b] + trans;
+                bool better = score > best[b];
+                best[b] = better ? score : best[b];
+                arg[b] = better ? (unsigned char) prev : arg[b];
+            }
+        }
+        const double *emission = model.log_emission + st * model.num_obs;
+        for (int b = 0; b < num; b++) {
+            next[st * BATCH + b] = best[b] + emission[o[b]];
+            from[st * BATCH + b] = arg[b];
+        }
+    }
+}
+
+
+// Same as `viterbi_batch` for a model with any number of states. The
+// decoded state `st` is written to the signal as `model.values[st]`.
+template <class Signals>
+void viterbi_batch_states(Signals obs, const int first, const int num, const int num_frames, const StateModel &model, int checkpoint) {
+    if (num_frames == 0) {
+        return;
+    }
 
-    omp_set_dynamic(0);
-    omp_set_num_threads(2);
-    // 2-D array of pointers
-    double **V = (double **) malloc(2 * sizeof(double *));
-    double **prev = (double **) malloc(2 * sizeof(double *));
+    const int num_states = model.num_states;
+    const size_t width = (size_t) num_states * BATCH;
 
-    // Declare 2nd layer of pointers
-    #pragma omp parallel for
-    for (int i = 0; i < 2; i++) {
-        V[i] = (double *) malloc(num_frames * sizeof(double));
-        prev[i] = (double *) malloc(num_frames * sizeof(double));
+    // Reused by every call on this thread.
+    static thread_local std::vector <unsigned char> backpointers;
+    static thread_local std::vector <double> checkpoints;
+    static thread_local std::vector <double> scores;
+
+    const int segment = checkpoint ? segment_length(num_frames) : std::max(num_frames - 1, 1);
+    const int num_segments = (num_frames - 1 + segment - 1) / segment;
+    backpointers.resize(width * segment);
+    checkpoints.resize(width * (size_t) std::max(num_segments, 1));
+    scores.resize(2 * width);
+    double *v = scores.data();
+    double *next = v + width;
+    int state[BATCH];
+
+    for (int b = 0; b < num; b++) {
+        int o0 = obs.get(first + b, 0);
+        for (int st = 0; st < num_states; st++) {
+            v[st * BATCH + b] = model.log_start[st * model.num_obs + o0];
+        }
+    }
+
+    // Forward pass. Without checkpoints there is a single segment and
+    // its backpointers are kept as they are computed.
+    for (int t = 0; t < num_frames; t++) {
+        if (t > 0) {
+            unsigned char *from = checkpoint ? backpointers.data() : &backpointers[width * (t - 1)];
+            viterbi_step_states(obs, first, num, t, v, next, from, model);
+            std::swap(v, next);
+        }
+        if (checkpoint && t % segment == 0 && t / segment < num_segments) {
+            std::copy(v, v + width, &checkpoints[width * (t / segment)]);
+        }
+    }
+
+    for (int b = 0; b < num; b++) {
+        int best = 0;
+        for (int st = 1; st < num_states; st++) {
+            if (v[st * BATCH + b] > v[best * BATCH + b]) {
+                best = st;
+            }
+        }
+        state[b] = best;
+    }
+
+    // Replay each segment from its checkpoint, last one first. Frames
+    // are only overwritten after every segment reading them is done.
+    for (int seg = num_segments - 1; seg >= 0; seg--) {
+        const int begin = seg * segment;
+        const int end = std::min(begin + segment, num_frames - 1);
+
+        if (checkpoint) {
+            std::copy(&checkpoints[width * seg], &checkpoints[width * seg] + width, v);
+            for (int t = begin + 1; t <= end; t++) {
+                viterbi_step_states(obs, first, num, t, v, next, &backpointers[width * (t - begin - 1)], model);
+                std::swap(v, next);
+            }
+        }
+
+        for (int b = 0; b < num; b++) {
+            int st = state[b];
+            for (int t = end; t > begin; t--) {
+                obs.set(first + b, t, model.values[st]);
+                st = backpointers[width * (t - begin - 1) + st * BATCH + b];
+            }
+            state[b] = st;
+        }
+    }
+
+    for (int b = 0; b < num; b++) {
+        obs.set(first + b, 0, model.values[state[b]]);
+    }
+}
+
+
+// Forward step of the scaled forward-backward algorithm. `alpha` and
+// `next` use the same layout as the Viterbi scores, and every bond's
+// probabilities are normalized to sum to one.
+template <class Signals>
+inline void forward_step(Signals &obs, const int first, const int num, const int t, const double *alpha, double *next, const ProbModel &model, double *log_scale) {
+    const int num_states = model.num_states;
+    int o[BATCH];
+    double total[BATCH];
+
+    for (int b = 0; b < num; b++) {
+        o[b] = obs.get(first + b, t);
+        total[b] = 0.0;
+    }
+
+    for (int st = 0; st < num_states; st++) {
+        double *next_st = next + st * BATCH;
+        for (int b = 0; b < num; b++) {
+            next_st[b] = 0.0;
+        }
+        for (int prev = 0; prev < num_states; prev++) {
+            const double trans = model.trans_p[prev * num_states + st];
+            const double *alpha_prev = alpha + prev * BATCH;
+            for (int b = 0; b < num; b++) {
+                next_st[b] += alpha_prev[b] * trans;
+            }
+        }
+        const double *emission = model.emission_p + st * model.num_obs;
+        for (int b = 0; b < num; b++) {
+            next_st[b] *= emission[o[b]];
+            total[b] += next_st[b];
+        }
+    }
+    if (log_scale) {
+        for (int b = 0; b < num; b++) {
+            log_scale[b] += std::log(total[b]);
+        }
+    }
+    normalize(next, num, num_states, total);
+}
+
+
+// Backward step from frame `t` to frame `t - 1`.
+template <class Signals>
+inline void backward_step(Signals &obs, const int first, const int num, const int t, const double *beta, double *next, const ProbModel &model) {
+    const int num_states = model.num_states;
+    double emitted[BATCH];
+    double total[BATCH];
+
+    for (int b = 0; b < num; b++) {
+        total[b] = 0.0;
+    }
+    for (int prev = 0; prev < num_states; prev++) {
+        for (int b = 0; b < num; b++) {
+            next[prev * BATCH + b] = 0.0;
+        }
     }
 
-    // Initialize values
-    #pragma omp parallel for
-    for (int i = 0; i < 2; i++) {
-        for (int j = 0; j < num_frames; j++) {
-            V[i][j] = 0;
-            prev[i][j] = 0;
+    for (int st = 0; st < num_states; st++) {
+        const double *emission = model.emission_p + st * model.num_obs;
+        for (int b = 0; b < num; b++) {
+            emitted[b] = emission[obs.get(first + b, t)] * beta[st * BATCH + b];
+        }
+        for (int prev = 0; prev < num_states; prev++) {
+            const double trans = model.trans_p[prev * num_states + st];
+            double *next_prev = next + prev * BATCH;
+            for (int b = 0; b < num; b++) {
+                next_prev[b] += trans * emitted[b];
+            }
+        }
+    }
+    for (int prev = 0; prev < num_states; prev++) {
+        for (int b = 0; b < num; b++) {
+            total[b] += next[prev * BATCH + b];
+        }
+    }
+    normalize(next, num, num_states, total);
+}
+
+
+inline void normalize(double *probs, const int num, const int num_states, double *total) {
+    for (int b = 0; b < num; b++) {
+        // Observations the model cannot emit leave all states at zero.
+        total[b] = total[b] > 0.0 ? 1.0 / total[b] : 1.0;
+    }
+    for (int st = 0; st < num_states; st++) {
+        for (int b = 0; b < num; b++) {
+            probs[st * BATCH + b] *= total[b];
         }
     }
+}
+
+
+// Runs the scaled forward-backward algorithm on up to `BATCH` bonds
+// and calls `visit(t, alpha, beta, beta_next)` for every frame from
+// the last to the first, where `beta_next` belongs to frame `t + 1`
+// and is null at the last frame. The forward probabilities are
+// checkpointed like `viterbi_batch` and recomputed one segment at a
+// time during the backward pass. The log-likelihood of each bond is
+// added to `loglik` if it is not null.
+template <class Signals, class Visit>
+void forward_backward_batch(Signals &obs, const int first, const int num, const int num_frames, const ProbModel &model, double *loglik, Visit visit) {
+    const int num_states = model.num_states;
+    const size_t width = (size_t) num_states * BATCH;
+    const int segment = segment_length(num_frames);
+    const int num_segments = (num_frames + segment - 1) / segment;
+
+    // Reused by every call on this thread.
+    static thread_local std::vector <double> checkpoints;
+    static thread_local std::vector <double> alphas;
+    static thread_local std::vector <double> work;
+    checkpoints.resize(width * num_segments);
+    alphas.resize(width * segment);
+    work.resize(3 * width);
+    double *alpha = work.data();
+    double *beta = alpha + width;
+    double *beta_next = beta + width;
+    double total[BATCH];
+
+    for (int b = 0; b < num; b++) {
+        total[b] = 0.0;
+        int o0 = obs.get(first + b, 0);
+        for (int st = 0; st < num_states; st++) {
+            alpha[st * BATCH + b] = model.start_p[st] * model.emission_p[st * model.num_obs + o0];
+            total[b] += alpha[st * BATCH + b];
+        }
+        if (loglik) {
+            loglik[b] += std::log(total[b]);
+        }
+    }
+    normalize(alpha, num, num_states, total);
+
+    for (int t = 0; t < num_frames; t++) {
+        if (t % segment == 0) {
+            std::copy(alpha, alpha + width, &checkpoints[width * (t / segment)]);
+        }
+        if (t + 1 < num_frames) {
+            forward_step(obs, first, num, t + 1, alpha, &alphas[0], model, loglik);
+            std::copy(&alphas[0], &alphas[0] + width, alpha);
+        }
+    }
+
+    std::fill(beta, beta + width, 1.0);
+    for (int seg = num_segments - 1; seg >= 0; seg--) {
+        const int begin = seg * segment;
+        const int end = std::min(begin + segment, num_frames) - 1;
+
+        std::copy(&checkpoints[width * seg], &checkpoints[width * seg] + width, &alphas[0]);
+        for (int t = begin + 1; t <= end; t++) {
+            forward_step(obs, first, num, t, &alphas[width * (t - begin - 1)], &alphas[width * (t - begin)], model, nullptr);
+        }
+
+        for (int t = end; t >= begin; t--) {
+            visit(t, &alphas[width * (t - begin)], beta, t + 1 < num_frames ? beta_next : nullptr);
+            if (t > 0) {
+                std::swap(beta, beta_next);
+                backward_step(obs, first, num, t, beta_next, beta, model);
+            }
+        }
+    }
+}
+
+
+// Writes the posterior probability of the weighted states, scaled to
+// 0-255, for each frame of up to `BATCH` bonds.
+template <class Signals>
+void posterior_batch(Signals obs, unsigned char **out, const int first, const int num, const int num_frames, const ProbModel &model) {
+    if (num_frames == 0) {
+        return;
+    }
+
+    const int num_states = model.num_states;
+    forward_backward_batch(obs, first, num, num_frames, model, nullptr, [&](const int t, const double *alpha, const double *beta, const double *) {
+        double total[BATCH], weighted[BATCH];
+        for (int b = 0; b < num; b++) {
+            total[b] = 0.0;
+            weighted[b] = 0.0;
+        }
+        for (int st = 0; st < num_states; st++) {
+            for (int b = 0; b < num; b++) {
+                double gamma = alpha[st * BATCH + b] * beta[st * BATCH + b];
+                total[b] += gamma;
+                weighted[b] += gamma * model.weight[st];
+            }
+        }
+        for (int b = 0; b < num; b++) {
+            double prob = total[b] > 0.0 ? weighted[b] / total[b] : 0.0;
+            prob = std::min(1.0, std::max(0.0, prob));
+            out[first + b][t] = (unsigned char) std::lround(255.0 * prob);
+        }
+    });
+}
+
+
+// Accumulates the expected counts used by Baum-Welch for up to `BATCH`
+// bonds. Each bond's row of `counts` holds the expected number of
+// times it starts in each state (num_states), makes each transition
+// (num_states * num_states), emits each observable from each state
+// (num_states * num_obs), and finally its log-likelihood.
+template <class Signals>
+void count_batch(Signals obs, double **counts, const int first, const int num, const int num_frames, const ProbModel &model) {
+    if (num_frames == 0) {
+        return;
+    }
+
+    const int num_states = model.num_states;
+    const int num_obs = model.num_obs;
+    const int trans_offset = num_states;
+    const int emission_offset = trans_offset + num_states * num_states;
+    const int loglik_offset = emission_offset + num_states * num_obs;
+
+    double loglik[BATCH];
+    std::fill(loglik, loglik + BATCH, 0.0);
+
+    forward_backward_batch(obs, first, num, num_frames, model, loglik, [&](const int t, const double *alpha, const double *beta, const double *beta_next) {
+        double total[BATCH], gamma[BATCH];
+        int o[BATCH];
+        for (int b = 0; b < num; b++) {
+            total[b] = 0.0;
+            o[b] = obs.get(first + b, t);
+        }
+        for (int st = 0; st < num_states; st++) {
+            for (int b = 0; b < num; b++) {
+                total[b] += alpha[st * BATCH + b] * beta[st * BATCH + b];
+            }
+        }
+        for (int b = 0; b < num; b++) {
+            total[b] = total[b] > 0.0 ? 1.0 / total[b] : 0.0;
+        }
+        for (int st = 0; st < num_states; st++) {
+            for (int b = 0; b < num; b++) {
+                gamma[b] = alpha[st * BATCH + b] * beta[st * BATCH + b] * total[b];
+                counts[first + b][emission_offset + st * num_obs + o[b]] += gamma[b];
+                if (t == 0) {
+                    counts[first + b][st] += gamma[b];
+                }
+            }
+        }
+
+        if (!beta_next) {
+            return;
+        }
+
+        // Expected transitions from frame t to frame t + 1.
+        double emitted[BATCH];
+        for (int b = 0; b < num; b++) {
+            o[b] = obs.get(first + b, t + 1);
+            total[b] = 0.0;
+        }
+        for (int st = 0; st < num_states; st++) {
+            for (int prev = 0; prev < num_states; prev++) {
+                const double trans = model.trans_p[prev * num_states + st];
+                for (int b = 0; b < num; b++) {
+                    total[b] += alpha[prev * BATCH + b] * trans * model.emission_p[st * num_obs + o[b]] * beta_next[st * BATCH + b];
+                }
+            }
+        }
+        for (int b = 0; b < num; b++) {
+            total[b] = total[b] > 0.0 ? 1.0 / total[b] : 0.0;
+        }
+        for (int st = 0; st < num_states; st++) {
+            for (int b = 0; b < num; b++) {
+                emitted[b] = model.emission_p[st * num_obs + o[b]] * beta_next[st * BATCH + b] * total[b];
+            }
+            for (int prev = 0; prev < num_states; prev++) {
+                const double trans = model.trans_p[prev * num_states + st];
+                for (int b = 0; b < num; b++) {
+                    counts[first + b][trans_offset + prev * num_states + st] += alpha[prev * BATCH + b] * trans * emitted[b];
+                }
+            }
+        }
+    });
+
+    for (int b = 0; b < num; b++) {
+        counts[first + b][loglik_offset] = loglik[b];
+    }
+}
+
+
+void viterbi(int *obs, const int num_frames, float start_p[2], float trans_p[2][2], float emission_p[2][2]) {
+
+    // Scores and backpointers of both states, freed on return
+    std::vector <double> V_data (2 * (size_t) num_frames, 0.0);
+    std::vector <double> prev_data (2 * (size_t) num_frames, 0.0);
+    double *V[2] = {V_data.data(), V_data.data() + num_frames};
+    double *prev[2] = {prev_data.data(), prev_data.data() + num_frames};
 
     // Get starting probabilities
     for (int st = 0; st < 2; st++) {
@@ -67,7 +776,7 @@ void viterbi(int *obs, const int num_frames, float start_p[2], float trans_p[2][
         for (int st = 0; st < 2; st++) {
             prob_0 = V[0][t - 1] + log10(trans_p[0][st]);
             prob_1 = V[1][t - 1] + log10(trans_p[1][st]);
-            if (prob_0 > prob_1) {
+            if (prob_0 >= prob_1) {
                 max_prob = prob_0 + log10(emission_p[st][obs[t]]);
                 prev_st = 0;
             } else {
@@ -99,7 +808,7 @@ void viterbi(int *obs, const int num_frames, float start_p[2], float trans_p[2][
     // printf("mat final prob 1: %f\n", V[num_frames - 1][1]);
 
     // Find last optimal state
-    if (V[0][num_frames - 1] > V[1][num_frames - 1]) {
+    if (V[0][num_frames - 1] >= V[1][num_frames - 1]) {
         // printf("USING STATE 0\n");
         optimal_path[num_frames - 1] = 0;
         previous = 0;
@@ -1,7 +1,99 @@
 #ifndef HMM_H
 #define HMM_H
 
-void decode(int **obs, const int num_bonds, const int num_frames, float start_p[2], float trans_p[2][2], float emission_p[2][2], int cores);
+#include <stdint.h>
+
+// Log10 of the two-state HMM parameters. `start` already includes the
+// emission of the first observation.
+struct LogParams {
+    double start[2][2];
+    double trans[2][2];
+    double emission[2][2];
+};
+
+// Log10 of the parameters of a model with any number of states,
+// stored row-major. `log_start` already includes the emission of the
+// first observation. Decoded states are written as `values[state]`.
+struct StateModel {
+    int num_states;
+    int num_obs;
+    const double *log_start;
+    const double *log_trans;
+    const double *log_emission;
+    const int *values;
+};
+
+// Probabilities of a model with any number of states, stored
+// row-major, for the forward-backward algorithm. Posteriors are
+// reported for the states weighted by `weight`.
+struct ProbModel {
+    int num_states;
+    int num_obs;
+    const double *start_p;
+    const double *trans_p;
+    const double *emission_p;
+    const double *weight;
+};
+
+// Signals stored as one int per frame.
+struct IntSignals {
+    int **obs;
+    inline int get(const int bond, const int t) const { return obs[bond][t]; }
+    inline void set(const int bond, const int t, const int state) { obs[bond][t] = state; }
+};
+
+// Signals stored as one byte per frame, e.g. a uint8 contact matrix.
+struct ByteSignals {
+    unsigned char **obs;
+    inline int get(const int bond, const int t) const { return obs[bond][t]; }
+    inline void set(const int bond, const int t, const int state) { obs[bond][t] = (unsigned char) state; }
+};
+
+// Signals packed with `numpy.packbits`, 8 frames per byte.
+struct PackedSignals {
+    unsigned char **obs;
+    inline int get(const int bond, const int t) const { return (obs[bond][t >> 3] >> (7 - (t & 7))) & 1; }
+    inline void set(const int bond, const int t, const int state) {
+        unsigned char mask = (unsigned char) (128 >> (t & 7));
+        obs[bond][t >> 3] = state ? (obs[bond][t >> 3] | mask) : (obs[bond][t >> 3] & ~mask);
+    }
+};
+
+LogParams log_params(const float *start_p, const float *trans_p, const float *emission_p);
+StateModel state_model(const int set, const int num_states, const int num_obs, const double *log_start, const double *log_trans, const double *log_emission, const int *values);
+int segment_length(const int num_frames);
+template <class Body>
+void run_groups(const int num_sets, const int *offsets, int cores, Body body);
+template <class Body>
+void run_batches(const int num_bonds, int cores, Body body);
+template <class Signals>
+inline void viterbi_step(Signals &obs, const int first, const int num, const int t, double *v0, double *v1, const LogParams &params, uint64_t &bits0, uint64_t &bits1);
+template <class Signals>
+void viterbi_batch(Signals obs, const int first, const int num, const int num_frames, const LogParams &params, int checkpoint);
+template <class Signals>
+inline void viterbi_step_states(Signals &obs, const int first, const int num, const int t, const double *v, double *next, unsigned char *from, const StateModel &model);
+template <class Signals>
+void viterbi_batch_states(Signals obs, const int first, const int num, const int num_frames, const StateModel &model, int checkpoint);
+
+void decode(int **obs, const int num_bonds, const int num_frames, const int num_sets, const int *offsets, const float *start_p, const float *trans_p, const float *emission_p, int cores, int checkpoint);
+void decode_packed(unsigned char **obs, const int num_bonds, const int num_frames, const int num_sets, const int *offsets, const float *start_p, const float *trans_p, const float *emission_p, int cores, int checkpoint);
+void decode_bytes(unsigned char **obs, const int num_bonds, const int num_frames, const int num_sets, const int *offsets, const float *start_p, const float *trans_p, const float *emission_p, int cores, int checkpoint);
+void decode_bytes_states(unsigned char **obs, const int num_bonds, const int num_frames, const int num_sets, const int *offsets, const int num_states, const int num_obs, const double *log_start, const double *log_trans, const double *log_emission, const int *values, int cores, int checkpoint);
+void decode_states(int **obs, const int num_bonds, const int num_frames, const int num_sets, const int *offsets, const int num_states, const int num_obs, const double *log_start, const double *log_trans, const double *log_emission, const int *values, int cores, int checkpoint);
+void decode_packed_states(unsigned char **obs, const int num_bonds, const int num_frames, const int num_sets, const int *offsets, const int num_states, const double *log_start, const double *log_trans, const double *log_emission, const int *values, int cores, int checkpoint);
+template <class Signals>
+inline void forward_step(Signals &obs, const int first, const int num, const int t, const double *alpha, double *next, const ProbModel &model, double *log_scale);
+template <class Signals>
+inline void backward_step(Signals &obs, const int first, const int num, const int t, const double *beta, double *next, const ProbModel &model);
+inline void normalize(double *probs, const int num, const int num_states, double *total);
+template <class Signals, class Visit>
+void forward_backward_batch(Signals &obs, const int first, const int num, const int num_frames, const ProbModel &model, double *loglik, Visit visit);
+template <class Signals>
+void posterior_batch(Signals obs, unsigned char **out, const int first, const int num, const int num_frames, const ProbModel &model);
+void posteriors(int **obs, unsigned char **out, const int num_bonds, const int num_frames, const int num_sets, const int *offsets, const int num_states, const int num_obs, const double *start_p, const double *trans_p, const double *emission_p, const double *weight, int cores);
+template <class Signals>
+void count_batch(Signals obs, double **counts, const int first, const int num, const int num_frames, const ProbModel &model);
+void expected_counts(int **obs, double **counts, const int num_bonds, const int num_frames, const int num_states, const int num_obs, const double *start_p, const double *trans_p, const double *emission_p, int cores);
 void viterbi(int *obs, const int num_frames, float start_p[2], float trans_p[2][2], float emission_p[2][2]);
 
 #endif
@@ -1,6 +1,13 @@
 import numpy as np
 
-__all__ = ['generate_ignore_list', 'viterbi']
+try:
+    from .hmm_cython import expected_counts_cpp
+except(ImportError):
+    expected_counts_cpp = None
+
+__all__ = ['generate_ignore_list', 'triage_contacts', 'triage', 'viterbi',
+           'batch_viterbi', 'batch_posteriors', 'quantize',
+           'expected_counts', 'baum_welch', 'ChunkedViterbi', 'OnlineViterbi']
 
 
 def generate_ignore_list(cmat, n):
@@ -24,33 +31,70 @@ def generate_ignore_list(cmat, n):
         than 0 frequently enough to be processed. The same anology goes
         for `ignore_list[1]`.
     """
-    ignore_list = [[], []]
+    atom_i, atom_j, zeros, ones, _ = triage_contacts(cmat, n)
+    ignore_list = [np.column_stack([atom_i[zeros], atom_j[zeros]]).tolist(),
+                   np.column_stack([atom_i[ones], atom_j[ones]]).tolist()]
+    return ignore_list
+
+
+def triage_contacts(cmat, n):
+    """
+    Sorts every unique atom pair by whether it needs to be decoded.
+
+    The number of frames in contact is counted for all pairs in a
+    single reduction over the frame axis. See `triage`.
+
+    Parameters
+    ----------
+    cmat : numpy.ndarray
+        Contact matrix. Shape is (n_atoms, n_atoms, n_frames).
+    n : int
+        Threshold for being placed on the ignore list.
+
+    Returns
+    -------
+    atom_i, atom_j : numpy.ndarray
+        Atom indices of every unique pair.
+    zeros, ones, run : numpy.ndarray
+        Boolean masks over the pairs, see `triage`.
+    """
     n_atoms = cmat.shape[1]
+    atom_i, atom_j = np.triu_indices(n_atoms, 1)
+    counts = cmat.sum(axis=2)[atom_i, atom_j]
+    zeros, ones, run = triage(counts, cmat.shape[2], n)
+    return atom_i, atom_j, zeros, ones, run
 
-    for i in range(n_atoms - 1):
-        for j in range(i + 1, n_atoms):
-            # Find all unique values and their respective counts
-            values, counts = np.unique(cmat[i, j, :], return_counts=True)
-            unique = dict(zip(values, counts))
 
-            # If 0 or 1 never appear, place that index on
-            # the ignore_list.
-            if 1 not in unique.keys():
-                ignore_list[0].append([i, j])
-                continue
-            elif 0 not in unique.keys():
-                ignore_list[1].append([i, j])
-                continue
-            else:
-                pass
+def triage(counts, n_frames, n):
+    """
+    Sorts signals by whether they need to be decoded.
 
-            if unique[1] <= n:
-                ignore_list[0].append([i, j])
-            elif unique[0] <= n:
-                ignore_list[1].append([i, j])
-            else:
-                pass
-    return ignore_list
+    A signal whose least common value appears `n` times or fewer is
+    set to its most common value instead of being decoded.
+
+    Parameters
+    ----------
+    counts : numpy.ndarray
+        Number of frames in which each signal is 1.
+    n_frames : int
+        Number of frames in each signal.
+    n : int
+        Threshold for being placed on the ignore list.
+
+    Returns
+    -------
+    zeros : numpy.ndarray
+        Mask of the signals that are always 0.
+    ones : numpy.ndarray
+        Mask of the signals that are always 1.
+    run : numpy.ndarray
+        Mask of the signals that need to be decoded.
+    """
+    counts = np.asarray(counts)
+    zeros = counts <= n
+    ones = ~zeros & (n_frames - counts <= n)
+    run = ~(zeros | ones)
+    return zeros, ones, run
 
 
 def viterbi(obs, states, start_p, trans_p, emission_p):
@@ -171,3 +215,613 @@ def fast_viterbi(obs, states, start_p, trans_p, emission_p):
         previous = optimal_path[t]
 
     return optimal_path
+
+
+def batch_viterbi(obs, start_p, trans_p, emission_p):
+    """Decodes many signals at once with the Viterbi algorithm.
+
+    The recursion runs over the frames while every step is vectorized
+    across the signals, so this is much faster than calling `viterbi`
+    on each signal. Ties go to the lowest state, as in `fast_viterbi`.
+
+    Parameters
+    ----------
+    obs : numpy.ndarray
+        Observations of every signal. Shape is (n_signals, n_frames).
+    start_p : array-like
+        Probabilities of starting in a particular hidden state.
+    trans_p : array-like
+        Probabilities of transitioning from one hidden state to
+        another.
+    emission_p : array-like
+        Probabilities of emitting an observable given the present
+        hidden state.
+
+    Returns
+    -------
+    optimal_path : numpy.ndarray
+        Most likely hidden state of every signal at every frame. Shape
+        is (n_signals, n_frames).
+    """
+    obs = np.asarray(obs)
+    n_signals, n_frames = obs.shape
+    optimal_path = np.zeros((n_signals, n_frames), dtype=np.int32)
+    if n_signals == 0 or n_frames == 0:
+        return optimal_path
+
+    decoder = _ViterbiScores(start_p, trans_p, emission_p)
+    prev = decoder._forward(obs)
+
+    signals = np.arange(n_signals)
+    state = decoder.scores.argmax(axis=1)
+    for t in range(n_frames - 1, -1, -1):
+        optimal_path[:, t] = state
+        state = prev[t, signals, state]
+    return optimal_path
+
+
+def batch_posteriors(obs, start_p, trans_p, emission_p, values=None):
+    """Posterior probability of being bonded at every frame.
+
+    Runs the scaled forward-backward algorithm on many signals at once,
+    vectorized across signals like `batch_viterbi`. Unlike the single
+    Viterbi path, the posteriors say how certain each frame's state is.
+
+    Parameters
+    ----------
+    obs : numpy.ndarray
+        Observations of every signal. Shape is (n_signals, n_frames).
+    start_p : array-like
+        Probabilities of starting in a particular hidden state.
+    trans_p : array-like
+        Probabilities of transitioning from one hidden state to
+        another.
+    emission_p : array-like
+        Probabilities of emitting an observable given the present
+        hidden state.
+    values : array-like, optional
+        Contact value, 0 or 1, of each hidden state. Default is the
+        index of the state.
+
+    Returns
+    -------
+    probs : numpy.ndarray
+        Probability that each signal is bonded at each frame. Shape is
+        (n_signals, n_frames).
+    """
+    obs = np.asarray(obs)
+    start_p = np.asarray(start_p, dtype=np.float64)
+    trans_p = np.asarray(trans_p, dtype=np.float64)
+    emission = np.asarray(emission_p, dtype=np.float64).T[obs]
+    if values is None:
+        values = np.arange(len(start_p))
+    values = np.asarray(values, dtype=np.float64)
+
+    n_signals, n_frames = obs.shape
+    probs = np.zeros((n_signals, n_frames))
+    if n_signals == 0 or n_frames == 0:
+        return probs
+
+    def scale(p):
+        total = p.sum(axis=1, keepdims=True)
+        total[total == 0] = 1
+        return p / total
+
+    alpha = np.zeros((n_frames, n_signals, len(start_p)))
+    alpha[0] = scale(start_p * emission[:, 0])
+    for t in range(1, n_frames):
+        alpha[t] = scale(alpha[t - 1].dot(trans_p) * emission[:, t])
+
+    beta = np.ones((n_signals, len(start_p)))
+    for t in range(n_frames - 1, -1, -1):
+        gamma = scale(alpha[t] * beta)
+        probs[:, t] = gamma.dot(values)
+        beta = scale((emission[:, t] * beta).dot(trans_p.T))
+    return probs
+
+
+def expected_counts(obs, start_p, trans_p, emission_p):
+    """Expected counts of the Baum-Welch E-step, summed over signals.
+
+    NumPy reference of `hmm_cython.expected_counts_cpp`, vectorized
+    across signals like `batch_posteriors`.
+
+    Parameters
+    ----------
+    obs : numpy.ndarray
+        Observations of every signal. Shape is (n_signals, n_frames).
+    start_p : array-like
+        Probabilities of starting in a particular hidden state.
+    trans_p : array-like
+        Probabilities of transitioning from one hidden state to
+        another.
+    emission_p : array-like
+        Probabilities of emitting an observable given the present
+        hidden state.
+
+    Returns
+    -------
+    start : numpy.ndarray
+        Expected number of signals starting in each state.
+    trans : numpy.ndarray
+        Expected number of transitions between each pair of states.
+    emission : numpy.ndarray
+        Expected number of times each state emits each observable.
+    loglik : float
+        Log-likelihood of all signals.
+    """
+    obs = np.asarray(obs)
+    start_p = np.asarray(start_p, dtype=np.float64)
+    trans_p = np.asarray(trans_p, dtype=np.float64)
+    emission_p = np.asarray(emission_p, dtype=np.float64)
+    emission = emission_p.T[obs]
+    n_signals, n_frames = obs.shape
+    n_states, n_obs = emission_p.shape
+
+    start = np.zeros(n_states)
+    trans = np.zeros((n_states, n_states))
+    counts = np.zeros((n_states, n_obs))
+    loglik = 0.0
+    if n_signals == 0 or n_frames == 0:
+        return start, trans, counts, loglik
+
+    def scale(p):
+        total = p.sum(axis=1, keepdims=True)
+        return p / np.where(total > 0, total, 1), total
+
+    alpha = np.zeros((n_frames, n_signals, n_states))
+    alpha[0], total = scale(start_p * emission[:, 0])
+    loglik += np.log(total).sum()
+    for t in range(1, n_frames):
+        alpha[t], total = scale(alpha[t - 1].dot(trans_p) * emission[:, t])
+        loglik += np.log(total).sum()
+
+    beta = np.ones((n_signals, n_states))
+    for t in range(n_frames - 1, -1, -1):
+        if t < n_frames - 1:
+            # Expected transitions from frame t to frame t + 1.
+            xi = alpha[t][:, :, np.newaxis] * trans_p *\
+                (emission[:, t + 1] * beta)[:, np.newaxis, :]
+            total = xi.sum(axis=(1, 2), keepdims=True)
+            trans += (xi / np.where(total > 0, total, 1)).sum(axis=0)
+            beta, _ = scale((emission[:, t + 1] * beta).dot(trans_p.T))
+        gamma, _ = scale(alpha[t] * beta)
+        for o in range(n_obs):
+            counts[:, o] += gamma[obs[:, t] == o].sum(axis=0)
+        if t == 0:
+            start += gamma.sum(axis=0)
+    return start, trans, counts, loglik
+
+
+def baum_welch(obs, start_p, trans_p, emission_p, n_iter=100, tol=1e-4,
+               cores=1, use_python=False):
+    """Fits HMM parameters to signals by expectation maximization.
+
+    Every iteration computes the expected counts of all signals with
+    the compiled forward-backward kernel, spread over `cores` threads,
+    and re-estimates the parameters from them.
+
+    Parameters
+    ----------
+    obs : numpy.ndarray or list of numpy.ndarray
+        Observations of every signal. Shape is (n_signals, n_frames).
+        Signals of different lengths can be passed as a list of such
+        blocks.
+    start_p : array-like
+        Initial probabilities of starting in each hidden state.
+    trans_p : array-like
+        Initial probabilities of transitioning from one hidden state
+        to another.
+    emission_p : array-like
+        Initial probabilities of emitting an observable given the
+        present hidden state.
+    n_iter : int, optional
+        Maximum number of iterations. Default is 100.
+    tol : float, optional
+        Stop once the log-likelihood per frame improves by less than
+        this. Default is 1e-4.
+    cores : int, optional
+        Number of threads used by the compiled kernel. Default is 1.
+    use_python : bool, optional
+        Use `expected_counts` instead of the compiled kernel. Always
+        done if the extension is not available. Default is False.
+
+    Returns
+    -------
+    start_p, trans_p, emission_p : numpy.ndarray
+        Fitted parameters.
+    loglik : float
+        Log-likelihood of the signals under the fitted parameters.
+    """
+    if isinstance(obs, np.ndarray):
+        obs = [obs]
+    obs = [np.ascontiguousarray(block, dtype=np.int32) for block in obs]
+    start_p = np.array(start_p, dtype=np.float64)
+    trans_p = np.array(trans_p, dtype=np.float64)
+    emission_p = np.array(emission_p, dtype=np.float64)
+    n_values = max(sum(block.size for block in obs), 1)
+
+    def counts(*params):
+        total = None
+        for block in obs:
+            if use_python or expected_counts_cpp is None:
+                result = expected_counts(block, *params)
+            else:
+                result = expected_counts_cpp(block, *params, cores=cores)
+            if total is None:
+                total = list(result)
+            else:
+                total = [a + b for a, b in zip(total, result)]
+        return total
+
+    def normalized(p):
+        total = p.sum(axis=-1, keepdims=True)
+        return p / np.where(total > 0, total, 1)
+
+    previous = -np.inf
+    for _ in range(n_iter):
+        start, trans, emission, loglik = counts(start_p, trans_p,
+                                                emission_p)
+        if loglik / n_values - previous / n_values < tol:
+            break
+        previous = loglik
+        # States that are never visited keep their parameters.
+        start_p = normalized(start)
+        trans_p = np.where(trans.sum(axis=1, keepdims=True) > 0,
+                           normalized(trans), trans_p)
+        emission_p = np.where(emission.sum(axis=1, keepdims=True) > 0,
+                              normalized(emission), emission_p)
+    else:
+        loglik = counts(start_p, trans_p, emission_p)[3]
+    return start_p, trans_p, emission_p, loglik
+
+
+def quantize(probs):
+    """Stores probabilities in [0, 1] as uint8, ``round(255 * p)``."""
+    return np.rint(np.clip(probs, 0, 1) * 255).astype(np.uint8)
+
+
+class _ViterbiScores:
+    """Forward pass of the Viterbi algorithm shared by the streaming
+    decoders."""
+
+    def __init__(self, start_p, trans_p, emission_p):
+        start_p = np.asarray(start_p, dtype=np.float64)
+        emission_p = np.asarray(emission_p, dtype=np.float64)
+        # Same rounding as `fast_viterbi` for the first frame.
+        self.log_first = np.log10(start_p[:, np.newaxis] * emission_p).T
+        self.log_trans = np.log10(np.asarray(trans_p, dtype=np.float64))
+        self.log_emission = np.log10(emission_p).T
+        self.n_states = len(start_p)
+        self.n_frames = 0
+        self.scores = None
+        return
+
+    def _forward(self, obs):
+        """Advances the scores through `obs` and returns the
+        backpointers of every frame, shape (n_frames, n_signals,
+        n_states). The first frame of the signal has no backpointer and
+        is left as zeros."""
+        self.scores, prev = self._advance(self.scores, obs)
+        self.n_frames += obs.shape[1]
+        return prev
+
+    def _advance(self, scores, obs, backpointers=True):
+        """Advances `scores`, None before the first frame, through
+        `obs` without changing the decoder. Returns the new scores and
+        the backpointers, or None if `backpointers` is False."""
+        n_signals, n_frames = obs.shape
+        prev = None
+        if backpointers:
+            prev = np.zeros((n_frames, n_signals, self.n_states),
+                            dtype=np.uint8)
+
+        for t in range(n_frames):
+            if scores is None:
+                scores = self.log_first[obs[:, t]]
+                continue
+            # Score of every (previous state, state) combination.
+            candidates = scores[:, :, np.newaxis] + self.log_trans
+            if backpointers:
+                prev[t] = candidates.argmax(axis=1)
+            scores = candidates.max(axis=1) + self.log_emission[obs[:, t]]
+        return scores, prev
+
+
+class ChunkedViterbi(_ViterbiScores):
+    """
+    Viterbi decoder for many signals that arrive in chunks of frames.
+
+    The scores of the most likely path ending in each hidden state are
+    carried over from one chunk to the next, so the observations never
+    need to be held in memory all at once. No backpointers are kept
+    while going forward, only the scores at the start of every chunk.
+    `backtrace` reads each chunk a second time, from last to first, and
+    recomputes its backpointers from those scores.
+
+    The observations and backpointers in memory are thus bounded by one
+    chunk, plus (n_signals, n_states) scores per chunk, at the cost of
+    a second forward pass. The recursion is the NumPy one of
+    `batch_viterbi`, vectorized over signals but looping over frames
+    in Python, and does not use the compiled kernel.
+
+    Parameters
+    ----------
+    start_p : array-like
+        Probabilities of starting in a particular hidden state.
+    trans_p : array-like
+        Probabilities of transitioning from one hidden state to
+        another.
+    emission_p : array-like
+        Probabilities of emitting an observable given the present
+        hidden state.
+
+    Attributes
+    ----------
+    n_frames : int
+        Number of frames decoded so far.
+    scores : numpy.ndarray
+        Log probability of the most likely path ending in each state
+        at the last frame. Shape is (n_signals, n_states).
+
+    Example
+    -------
+    >>> decoder = ChunkedViterbi(start_p, trans_p, emission_p)
+    >>> for start in range(0, n_frames, size):
+    ...     decoder.update(obs[:, start:start + size])
+    >>> for start, states in decoder.backtrace(
+    ...         lambda start, stop: obs[:, start:stop]):
+    ...     decoded[:, start:start + states.shape[1]] = states
+    """
+
+    def __init__(self, start_p, trans_p, emission_p):
+        """Inits `ChunkedViterbi` object."""
+        super().__init__(start_p, trans_p, emission_p)
+        # First frame, number of frames and incoming scores of every
+        # chunk.
+        self._checkpoints = []
+        return
+
+    def update(self, obs):
+        """Advances the decoder through a chunk of observations.
+
+        Parameters
+        ----------
+        obs : numpy.ndarray
+            Observations of every signal for the next frames. Shape is
+            (n_signals, n_frames).
+        """
+        obs = np.asarray(obs)
+        n_frames = obs.shape[1]
+        self._checkpoints.append((self.n_frames, n_frames, self.scores))
+        self.scores, _ = self._advance(self.scores, obs,
+                                       backpointers=False)
+        self.n_frames += n_frames
+        return
+
+    def backtrace(self, read):
+        """Follows the backpointers from the last frame to the first.
+
+        Parameters
+        ----------
+        read : callable
+            ``read(start, stop)`` returns the observations of frames
+            `start` to `stop` again, as passed to `update`. Chunks are
+            read from last to first, each one before it is yielded.
+
+        Yields
+        ------
+        start : int
+            First frame of the chunk.
+        states : numpy.ndarray
+            Most likely hidden states of every signal in the chunk.
+            Shape is (n_signals, n_frames). Chunks are yielded from
+            last to first.
+        """
+        state = self.scores.argmax(axis=1)
+        signals = np.arange(len(state))
+
+        for start, n_frames, scores in reversed(self._checkpoints):
+            obs = np.asarray(read(start, start + n_frames))
+            _, prev = self._advance(scores, obs)
+            states = np.zeros((len(state), n_frames), dtype=np.int32)
+            for t in range(n_frames - 1, -1, -1):
+                states[:, t] = state
+                if start + t > 0:
+                    state = prev[t, signals, state]
+            yield start, states
+        return
+
+
+class OnlineViterbi(_ViterbiScores):
+    """
+    Fixed-lag Viterbi decoder for signals that arrive as they are
+    simulated.
+
+    A frame is decoded as soon as the most likely paths ending in every
+    hidden state pass through the same state at that frame, since no
+    later observation can change it. If `lag` is given, frames more
+    than `lag` frames behind the newest one are also emitted using the
+    currently most likely path, which bounds both the delay and the
+    memory at the cost of occasionally differing from the offline
+    result.
+
+    For every pair of final states, the decoder keeps the frame and
+    state at which their most likely paths meet, and updates them once
+    per new frame. Finding the frames that can be emitted thus costs
+    O(n_states ** 2) per signal and frame, however many frames are
+    pending, and only the emitted frames are traced back through the
+    backpointers.
+
+    Parameters
+    ----------
+    start_p : array-like
+        Probabilities of starting in a particular hidden state.
+    trans_p : array-like
+        Probabilities of transitioning from one hidden state to
+        another.
+    emission_p : array-like
+        Probabilities of emitting an observable given the present
+        hidden state.
+    lag : int, optional
+        Maximum number of frames held back before they are emitted.
+        Default is None, which waits until the paths agree.
+
+    Attributes
+    ----------
+    n_frames : int
+        Number of frames received so far.
+    n_emitted : int
+        Number of frames emitted so far.
+
+    Example
+    -------
+    >>> decoder = OnlineViterbi(start_p, trans_p, emission_p, lag=500)
+    >>> for chunk in chunks:
+    ...     start, states = decoder.update(chunk)
+    ...     decoded[:, start:start + states.shape[1]] = states
+    >>> start, states = decoder.flush()
+    >>> decoded[:, start:] = states
+    """
+
+    def __init__(self, start_p, trans_p, emission_p, lag=None):
+        """Inits `OnlineViterbi` object."""
+        super().__init__(start_p, trans_p, emission_p)
+        if lag is not None and lag < 0:
+            raise ValueError("lag must be non-negative.")
+        self.lag = lag
+        self.n_emitted = 0
+        # Backpointers of the pending frames, from `_first` on. The one
+        # of the first pending frame leads to an emitted frame and is
+        # never used.
+        self._prev = None
+        self._first = 0
+        # Frame and state at which the most likely paths ending in two
+        # final states meet, -1 if they never do. Shape is (n_signals,
+        # n_states, n_states).
+        self._meet_frame = None
+        self._meet_state = None
+        return
+
+    def update(self, obs):
+        """Adds frames and emits every frame that can be decided.
+
+        Parameters
+        ----------
+        obs : numpy.ndarray
+            Observations of every signal for the next frames. Shape is
+            (n_signals, n_frames).
+
+        Returns
+        -------
+        start : int
+            First frame of the emitted states.
+        states : numpy.ndarray
+            Decoded hidden states of every signal for the emitted
+            frames. Shape is (n_signals, n_emitted_frames), which may
+            be empty.
+        """
+        obs = np.asarray(obs)
+        first = self.n_frames
+        prev = self._forward(obs)
+        if self.scores is None:
+            return self.n_emitted, np.zeros((obs.shape[0], 0),
+                                            dtype=np.int32)
+
+        self._store(prev)
+        for k in range(len(prev)):
+            self._meet(first + k, prev[k])
+
+        # Every path passes through the earliest meeting point of any
+        # two of them, so the frames up to it are decided.
+        n_emit = self._meet_frame.min(axis=(1, 2)).min() + 1
+        n_emit = max(n_emit - self.n_emitted, 0)
+        if self.lag is not None:
+            n_pending = self.n_frames - self.n_emitted
+            n_emit = max(n_emit, n_pending - self.lag)
+        return self._emit(n_emit)
+
+    def flush(self):
+        """Emits the remaining frames using the most likely path.
+
+        Returns
+        -------
+        start : int
+            First frame of the emitted states.
+        states : numpy.ndarray
+            Decoded hidden states of every signal for the remaining
+            frames. Shape is (n_signals, n_remaining_frames).
+        """
+        if self.scores is None:
+            return self.n_emitted, np.zeros((0, 0), dtype=np.int32)
+        return self._emit(self.n_frames - self.n_emitted)
+
+    def _store(self, prev):
+        """Appends the backpointers of new frames, reallocating the
+        buffer to twice the pending frames when it is full."""
+        n_pending = self.n_frames - len(prev) - self.n_emitted
+        end = self._first + n_pending
+        if self._prev is None or end + len(prev) > len(self._prev):
+            buffer = np.empty((2 * (n_pending + len(prev)),)
+                              + prev.shape[1:], dtype=prev.dtype)
+            if self._prev is not None:
+                buffer[:n_pending] = self._prev[self._first:end]
+            self._prev = buffer
+            self._first = 0
+            end = n_pending
+        self._prev[end:end + len(prev)] = prev
+        return
+
+    def _meet(self, t, prev):
+        """Updates the meeting points for frame `t`, whose backpointers
+        are `prev`."""
+        n_signals = prev.shape[0]
+        states = np.arange(self.n_states)
+        if t == 0:
+            self._meet_frame = np.full(
+                (n_signals, self.n_states, self.n_states), -1)
+            self._meet_state = np.full_like(self._meet_frame, -1)
+        else:
+            # Two paths meet where their previous states' paths did,
+            # or at frame t - 1 if both come from the same state, which
+            # the diagonal holds.
+            signals = np.arange(n_signals)[:, np.newaxis, np.newaxis]
+            pairs = (signals, prev[:, :, np.newaxis],
+                     prev[:, np.newaxis, :])
+            self._meet_frame = self._meet_frame[pairs]
+            self._meet_state = self._meet_state[pairs]
+        self._meet_frame[:, states, states] = t
+        self._meet_state[:, states, states] = states
+        return
+
+    def _emit(self, n_emit):
+        """Emits the next `n_emit` pending frames.
+
+        A signal whose paths all meet at or after the last emitted
+        frame is traced back from the meeting point, any other signal
+        from its currently most likely final state.
+        """
+        start = self.n_emitted
+        stop = start + n_emit
+        n_signals = self.scores.shape[0]
+        signals = np.arange(n_signals)
+
+        meet = self._meet_frame.reshape(n_signals, -1).argmin(axis=1)
+        frames = self._meet_frame.reshape(n_signals, -1)[signals, meet]
+        state = self._meet_state.reshape(n_signals, -1)[signals, meet]
+        decided = frames >= stop - 1
+        frames = np.where(decided, frames, self.n_frames - 1)
+        state = np.where(decided, state, self.scores.argmax(axis=1))
+
+        states = np.zeros((n_signals, n_emit), dtype=np.int32)
+        top = frames.max() if n_emit else start - 1
+        for t in range(top, start - 1, -1):
+            if t < stop:
+                states[:, t - start] = state
+            if t > start:
+                prev = self._prev[self._first + t - start]
+                state = np.where(frames >= t, prev[signals, state], state)
+
+        self.n_emitted = stop
+        self._first += n_emit
+        return start, states
@@ -4,16 +4,289 @@ cimport numpy as np
 import numpy as np
 
 
-cdef extern from "hmm.h":
+# Above this many frames, `low_memory=None` switches to checkpointed
+# backtracking. The full backpointer table takes 16 bytes per frame for
+# every batch of 64 bonds being decoded.
+CHECKPOINT_FRAMES = 2**16
+
+
+cdef extern from "hmm.h" nogil:
     void decode(int **obs, const int num_bonds, const int num_frames,
-                float start_p[2], float trans_p[2][2], float emission_p[2][2],
-                int cores)
+                const int num_sets, const int *offsets, const float *start_p,
+                const float *trans_p, const float *emission_p, int cores,
+                int checkpoint)
+    void decode_packed(unsigned char **obs, const int num_bonds,
+                       const int num_frames, const int num_sets,
+                       const int *offsets, const float *start_p,
+                       const float *trans_p, const float *emission_p,
+                       int cores, int checkpoint)
+    void decode_bytes(unsigned char **obs, const int num_bonds,
+                      const int num_frames, const int num_sets,
+                      const int *offsets, const float *start_p,
+                      const float *trans_p, const float *emission_p,
+                      int cores, int checkpoint)
+    void decode_bytes_states(unsigned char **obs, const int num_bonds,
+                             const int num_frames, const int num_sets,
+                             const int *offsets, const int num_states,
+                             const int num_obs, const double *log_start,
+                             const double *log_trans,
+                             const double *log_emission, const int *values,
+                             int cores, int checkpoint)
+    void decode_states(int **obs, const int num_bonds, const int num_frames,
+                       const int num_sets, const int *offsets,
+                       const int num_states, const int num_obs,
+                       const double *log_start, const double *log_trans,
+                       const double *log_emission, const int *values,
+                       int cores, int checkpoint)
+    void decode_packed_states(unsigned char **obs, const int num_bonds,
+                              const int num_frames, const int num_sets,
+                              const int *offsets, const int num_states,
+                              const double *log_start,
+                              const double *log_trans,
+                              const double *log_emission, const int *values,
+                              int cores, int checkpoint)
+    void posteriors(int **obs, unsigned char **out, const int num_bonds,
+                    const int num_frames, const int num_sets,
+                    const int *offsets, const int num_states,
+                    const int num_obs, const double *start_p,
+                    const double *trans_p, const double *emission_p,
+                    const double *weight, int cores)
+    void expected_counts(int **obs, double **counts, const int num_bonds,
+                         const int num_frames, const int num_states,
+                         const int num_obs, const double *start_p,
+                         const double *trans_p, const double *emission_p,
+                         int cores)
     void viterbi(int *obs, const int num_frames, float start_p[2],
                  float trans_p[2][2], float emission_p[2][2])
 
 
+def _use_checkpoints(num_frames, low_memory):
+    if low_memory is None:
+        return num_frames > CHECKPOINT_FRAMES
+    return bool(low_memory)
+
+
+def _parameter_sets(start_p, trans_p, emission_p, groups, num_bonds,
+                    dtype):
+    """Stacks the HMM parameters along a leading axis with one entry
+    per parameter set and orders the bonds by set.
+
+    Returns the stacked parameters, the order in which the bonds are
+    handed to the kernel and the offset of every set in that order."""
+    start_p = np.asarray(start_p, dtype=dtype)
+    trans_p = np.asarray(trans_p, dtype=dtype)
+    emission_p = np.asarray(emission_p, dtype=dtype)
+    if groups is None:
+        start_p = start_p[np.newaxis]
+        trans_p = trans_p[np.newaxis]
+        emission_p = emission_p[np.newaxis]
+        groups = np.zeros(num_bonds, dtype=np.intp)
+    groups = np.asarray(groups, dtype=np.intp)
+
+    assert start_p.ndim == 2, "start_p must have shape (n_states,)."
+    num_sets, num_states = start_p.shape
+    assert trans_p.shape == (num_sets, num_states, num_states),\
+        "trans_p must have shape (n_states, n_states)."
+    assert emission_p.ndim == 3 and\
+        emission_p.shape[:2] == (num_sets, num_states),\
+        "emission_p must have shape (n_states, n_observables)."
+    assert groups.shape == (num_bonds,),\
+        "groups must give one parameter set per bond."
+    assert num_bonds == 0 or (groups.min() >= 0 and
+                              groups.max() < num_sets),\
+        "groups must index the parameter sets."
+
+    order = np.argsort(groups, kind='mergesort').astype(np.intp)
+    offsets = np.zeros(num_sets + 1, dtype=np.int32)
+    offsets[1:] = np.cumsum(np.bincount(groups, minlength=num_sets))
+    return (np.ascontiguousarray(start_p), np.ascontiguousarray(trans_p),
+            np.ascontiguousarray(emission_p), order, offsets)
+
+
+def _bond_rows(rows, num_rows):
+    """Checks the rows of the signals to decode, None for all."""
+    if rows is None:
+        return None
+    rows = np.asarray(rows, dtype=np.intp)
+    assert rows.ndim == 1, "rows must be one-dimensional."
+    assert rows.size == 0 or (rows.min() >= 0 and rows.max() < num_rows),\
+        "rows must index the signals."
+    return rows
+
+
+def _is_two_state(start_p, trans_p, emission_p, values):
+    """Whether the stacked model can use the two-state kernel."""
+    if values is not None and list(values) != [0, 1]:
+        return False
+    return start_p.shape[1:] == (2,) and trans_p.shape[1:] == (2, 2) and\
+        emission_p.shape[1:] == (2, 2)
+
+
+def _state_model(start_p, trans_p, emission_p, values):
+    """Checks a stacked N-state model and converts it to the log10
+    arrays used by `decode_states`."""
+    num_states = start_p.shape[1]
+    assert 0 < num_states < 256, "Between 1 and 255 states are supported."
+    if values is None:
+        values = np.arange(num_states)
+    values = np.ascontiguousarray(values, dtype=np.int32)
+    assert values.shape == (num_states,),\
+        "values must give one value per state."
+
+    with np.errstate(divide='ignore'):
+        log_start = np.log10(start_p[:, :, np.newaxis] * emission_p)
+        log_trans = np.log10(trans_p)
+        log_emission = np.log10(emission_p)
+    return (np.ascontiguousarray(log_start, dtype=np.float64),
+            np.ascontiguousarray(log_trans, dtype=np.float64),
+            np.ascontiguousarray(log_emission, dtype=np.float64), values)
+
+
+ctypedef fused signal_t:
+    int
+    unsigned char
+
+
+def _decode(obs_arr, num_frames, packed, start_p, trans_p, emission_p,
+            cores, low_memory, values, groups, rows):
+    """Argument handling shared by `decode_cpp`, `decode_bytes_cpp` and
+    `decode_packed_cpp`, which then hand the signals to the two-state
+    or the N-state kernel."""
+    # Force the array to be C-contiguous
+    # i.e., each row has its own contiguous allocation of memory
+    if not obs_arr.flags['C_CONTIGUOUS']:
+        obs_arr = np.ascontiguousarray(obs_arr)
+
+    rows = _bond_rows(rows, obs_arr.shape[0])
+    num_bonds = obs_arr.shape[0] if rows is None else rows.shape[0]
+    checkpoint = _use_checkpoints(num_frames, low_memory)
+
+    start_p, trans_p, emission_p, order, offsets = _parameter_sets(
+        start_p, trans_p, emission_p, groups, num_bonds, np.float64)
+    if rows is not None:
+        order = rows[order]
+
+    two_state = _is_two_state(start_p, trans_p, emission_p, values)
+    if two_state:
+        # Change the HMM parameters into float C arrays
+        model = (start_p.astype(np.float32), trans_p.astype(np.float32),
+                 emission_p.astype(np.float32))
+    else:
+        model = _state_model(start_p, trans_p, emission_p, values)
+        num_obs = model[2].shape[2]
+        if packed:
+            assert num_obs == 2, "Packed signals only have two observables."
+            assert np.isin(model[3], [0, 1]).all(),\
+                "Packed signals can only hold the values 0 and 1."
+        elif obs_arr.dtype == np.uint8:
+            assert model[3].min() >= 0 and model[3].max() < 256,\
+                "uint8 signals can only hold values from 0 to 255."
+
+    if num_bonds == 0 or num_frames == 0:
+        return obs_arr
+
+    if not two_state and not packed:
+        observed = obs_arr if num_bonds == obs_arr.shape[0] else\
+            obs_arr[order]
+        assert observed.min() >= 0 and observed.max() < num_obs,\
+            "Observations must index the columns of emission_p."
+
+    # Do not over-allocate resources if there is not enough
+    # data to fill them.
+    cores = max(1, min(cores, num_bonds))
+    if two_state:
+        _decode_two_state(obs_arr, num_frames, packed, *model, order,
+                          offsets, cores, checkpoint)
+    else:
+        _decode_n_state(obs_arr, num_frames, packed, *model, order, offsets,
+                        cores, checkpoint)
+    return obs_arr
+
+
+cdef signal_t **_row_pointers(signal_t[:, ::1] obs_memview,
+                              np.intp_t[::1] order) except NULL:
+    """Pointers to the rows of the bonds to decode, ordered by
+    parameter set. Freed by the caller."""
+    cdef signal_t **point_to_arr = \
+        <signal_t **>malloc(order.shape[0] * sizeof(signal_t*))
+    if not point_to_arr: raise MemoryError
+    for i in range(order.shape[0]):
+        point_to_arr[i] = &obs_memview[order[i], 0]
+    return point_to_arr
+
+
+def _decode_two_state(signal_t[:, ::1] obs_memview, int num_frames,
+                      bint packed, float[:, ::1] start_p,
+                      float[:, :, ::1] trans_p, float[:, :, ::1] emission_p,
+                      np.intp_t[::1] order, int[::1] offsets, int cores,
+                      int checkpoint):
+    """Decodes signals with the two-state kernel."""
+    cdef int num_bonds = order.shape[0]
+    cdef int num_sets = start_p.shape[0]
+    cdef signal_t **point_to_arr = _row_pointers(obs_memview, order)
+    try:
+        # The signals are only touched through the pointers, so other
+        # Python threads can run while the bonds are decoded.
+        with nogil:
+            if signal_t is int:
+                decode(point_to_arr, num_bonds, num_frames, num_sets,
+                       &offsets[0], &start_p[0, 0], &trans_p[0, 0, 0],
+                       &emission_p[0, 0, 0], cores, checkpoint)
+            elif packed:
+                decode_packed(point_to_arr, num_bonds, num_frames, num_sets,
+                              &offsets[0], &start_p[0, 0], &trans_p[0, 0, 0],
+                              &emission_p[0, 0, 0], cores, checkpoint)
+            else:
+                decode_bytes(point_to_arr, num_bonds, num_frames, num_sets,
+                             &offsets[0], &start_p[0, 0], &trans_p[0, 0, 0],
+                             &emission_p[0, 0, 0], cores, checkpoint)
+    finally:
+        free(point_to_arr)
+    return
+
+
+def _decode_n_state(signal_t[:, ::1] obs_memview, int num_frames,
+                    bint packed, double[:, :, ::1] log_start,
+                    double[:, :, ::1] log_trans,
+                    double[:, :, ::1] log_emission, int[::1] values,
+                    np.intp_t[::1] order, int[::1] offsets, int cores,
+                    int checkpoint):
+    """Decodes signals with the N-state kernel."""
+    cdef int num_bonds = order.shape[0]
+    cdef int num_sets = log_start.shape[0]
+    cdef int num_states = log_start.shape[1]
+    cdef int num_obs = log_emission.shape[2]
+    cdef signal_t **point_to_arr = _row_pointers(obs_memview, order)
+    try:
+        with nogil:
+            if signal_t is int:
+                decode_states(point_to_arr, num_bonds, num_frames, num_sets,
+                              &offsets[0], num_states, num_obs,
+                              &log_start[0, 0, 0], &log_trans[0, 0, 0],
+                              &log_emission[0, 0, 0], &values[0], cores,
+                              checkpoint)
+            elif packed:
+                decode_packed_states(point_to_arr, num_bonds, num_frames,
+                                     num_sets, &offsets[0], num_states,
+                                     &log_start[0, 0, 0],
+                                     &log_trans[0, 0, 0],
+                                     &log_emission[0, 0, 0], &values[0],
+                                     cores, checkpoint)
+            else:
+                decode_bytes_states(point_to_arr, num_bonds, num_frames,
+                                    num_sets, &offsets[0], num_states,
+                                    num_obs, &log_start[0, 0, 0],
+                                    &log_trans[0, 0, 0],
+                                    &log_emission[0, 0, 0], &values[0],
+                                    cores, checkpoint)
+    finally:
+        free(point_to_arr)
+    return
+
+
 def decode_cpp(np.ndarray[int, ndim=2] obs_arr, start_p,
-               trans_p, emission_p, cores):
+               trans_p, emission_p, cores, low_memory=None, values=None,
+               groups=None, rows=None):
     """Viterbi algorithm for decoding noisy signal
 
     Parameters
@@ -25,64 +298,280 @@ def decode_cpp(np.ndarray[int, ndim=2] obs_arr, start_p,
         Probability of transitioning from one state to another.
     emission_p : array-like
         Probability of emitting one state given its hidden state.
+    cores : int
+        Number of threads used to decode the bonds.
+    low_memory : bool, optional
+        If True, keep only periodic checkpoints of the Viterbi scores
+        and recompute the backpointers segment by segment, using memory
+        that grows with the square root of the number of frames. If
+        None, this is done for signals longer than `CHECKPOINT_FRAMES`.
+    values : array-like, optional
+        Value written to the signal for each hidden state. Default is
+        the index of the state. Models with other than two states, or
+        with `values`, are decoded by the N-state kernel. Both kernels
+        break ties towards the lowest state, like `batch_viterbi`.
+    groups : array-like of int, optional
+        Parameter set of each bond. If given, `start_p`, `trans_p` and
+        `emission_p` hold one set of parameters per entry of their
+        first axis, and the bonds of all sets are decoded in a single
+        pass, batched with the other bonds of their set.
+    rows : array-like of int, optional
+        Rows of `obs_arr` holding the bonds to decode, e.g. a few
+        pairs of a memory-mapped contact matrix. The other rows are
+        left untouched and `groups` gives one set per entry of `rows`.
+        Default is every row.
 
     Returns
     -------
-    list
+    np.ndarray
         Cleaned signal with the highest probability of matching the
-        observed data."""
+        observed data. This is `obs_arr` itself, decoded in place,
+        unless it had to be copied to make it C-contiguous."""
+    return _decode(obs_arr, obs_arr.shape[1], False, start_p, trans_p,
+                   emission_p, cores, low_memory, values, groups, rows)
 
-    if type(start_p) is not np.ndarray:
-        start_p = np.array(start_p)
-    if type(trans_p) is not np.ndarray:
-        trans_p = np.array(trans_p)
-    if type(emission_p) is not np.ndarray:
-        emission_p = np.array(emission_p)
 
-    # Change the HMM parameters into float C arrays
-    cdef float cstart_p[2]
-    for i in range(2):
-        cstart_p[i] = start_p[i]
+def decode_bytes_cpp(np.ndarray[np.uint8_t, ndim=2] obs_arr, start_p,
+                     trans_p, emission_p, cores, low_memory=None, values=None,
+                     groups=None, rows=None):
+    """Viterbi algorithm for decoding noisy signals stored as uint8
 
-    cdef float ctrans_p[2][2]
-    for i in range(2):
-        for j in range(2):
-            ctrans_p[i][j] = trans_p[i, j]
+    Same as `decode_cpp` for signals with one byte per frame, such as
+    the rows of a dense uint8 contact matrix.
 
-    cdef float cemission_p[2][2]
-    for i in range(2):
-        for j in range(2):
-            cemission_p[i][j] = emission_p[i, j]
+    Parameters
+    ----------
+    obs_arr : np.ndarray
+        uint8 signal of each bond. Shape is (num_bonds, num_frames).
+    start_p, trans_p, emission_p, cores, low_memory, values, groups, rows
+        See `decode_cpp`. `values` must fit in a uint8.
+
+    Returns
+    -------
+    np.ndarray
+        Cleaned signals. This is `obs_arr` itself, decoded in place,
+        unless it had to be copied to make it C-contiguous."""
+    return _decode(obs_arr, obs_arr.shape[1], False, start_p, trans_p,
+                   emission_p, cores, low_memory, values, groups, rows)
+
+
+def decode_packed_cpp(np.ndarray[np.uint8_t, ndim=2] obs_arr, num_frames,
+                      start_p, trans_p, emission_p, cores, low_memory=None,
+                      values=None, groups=None, rows=None):
+    """Viterbi algorithm for decoding bit-packed noisy signals
+
+    Parameters
+    ----------
+    obs_arr : np.ndarray
+        Signal of each bond packed with `numpy.packbits` along frames.
+        Shape is (num_bonds, ceil(num_frames / 8)).
+    num_frames : int
+        Number of frames in each signal.
+    start_p : array-like
+        Probability of starting in a particular state.
+    trans_p : array-like
+        Probability of transitioning from one state to another.
+    emission_p : array-like
+        Probability of emitting one state given its hidden state.
+    cores : int
+        Number of threads used to decode the bonds.
+    low_memory : bool, optional
+        If True, keep only periodic checkpoints of the Viterbi scores
+        and recompute the backpointers segment by segment, using memory
+        that grows with the square root of the number of frames. If
+        None, this is done for signals longer than `CHECKPOINT_FRAMES`.
+    values : array-like, optional
+        Value written to the signal for each hidden state. Default is
+        the index of the state. Models with other than two states, or
+        with `values`, are decoded by the N-state kernel. Both kernels
+        break ties towards the lowest state, like `batch_viterbi`.
+    groups : array-like of int, optional
+        Parameter set of each bond, as in `decode_cpp`.
+    rows : array-like of int, optional
+        Rows of `obs_arr` holding the bonds to decode, as in
+        `decode_cpp`.
+
+    Returns
+    -------
+    np.ndarray
+        Cleaned signals, packed in the same way as `obs_arr`. This is
+        `obs_arr` itself, decoded in place, unless it had to be copied
+        to make it C-contiguous."""
+
+    assert obs_arr.shape[1] == (num_frames + 7) // 8,\
+        "Packed signals do not match the number of frames."
+    return _decode(obs_arr, num_frames, True, start_p, trans_p, emission_p,
+                   cores, low_memory, values, groups, rows)
+
+
+def posteriors_cpp(np.ndarray[int, ndim=2] obs_arr, start_p, trans_p,
+                   emission_p, cores=1, values=None, groups=None):
+    """Forward-backward posterior probabilities of being bonded
+
+    Parameters
+    ----------
+    obs_arr : np.ndarray
+        Observed signal of each bond. Shape is (num_bonds, num_frames).
+    start_p : array-like
+        Probability of starting in a particular state.
+    trans_p : array-like
+        Probability of transitioning from one state to another.
+    emission_p : array-like
+        Probability of emitting one state given its hidden state.
+    cores : int, optional
+        Number of threads used for the bonds.
+    values : array-like, optional
+        Contact value, 0 or 1, of each hidden state. Default is the
+        index of the state, which suits two-state models.
+    groups : array-like of int, optional
+        Parameter set of each bond, as in `decode_cpp`.
+
+    Returns
+    -------
+    np.ndarray
+        Posterior probability that each bond is bonded at each frame,
+        quantized to uint8 as ``round(255 * p)``."""
 
-    # Force the array to be C-contiguous
-    # i.e., each row has its own contiguous allocation of memory
     if not obs_arr.flags['C_CONTIGUOUS']:
         obs_arr = np.ascontiguousarray(obs_arr)
 
     cdef int num_bonds = obs_arr.shape[0]
     cdef int num_frames = obs_arr.shape[1]
 
-    # Create a memoryview of the numpy array
-    # Again, forcing the memoryview to be C-contiguous
+    start_p, trans_p, emission_p, order, offsets = _parameter_sets(
+        start_p, trans_p, emission_p, groups, num_bonds, np.float64)
+    num_states = start_p.shape[1]
+    if values is None:
+        values = np.arange(num_states)
+    cdef np.ndarray[np.float64_t, ndim=1] weight = \
+        np.ascontiguousarray(values, dtype=np.float64)
+    assert weight.shape[0] == num_states,\
+        "values must give one value per state."
+    assert np.isin(weight, [0, 1]).all(), "values must be 0 or 1."
+
+    cdef int num_sets = start_p.shape[0]
+    cdef int cnum_states = num_states
+    cdef int num_obs = emission_p.shape[2]
+    cdef int num_cores = max(1, min(cores, num_bonds))
+    cdef np.ndarray[np.uint8_t, ndim=2] out = \
+        np.zeros((num_bonds, num_frames), dtype=np.uint8)
+    if num_bonds == 0 or num_frames == 0:
+        return out
+    assert obs_arr.min() >= 0 and obs_arr.max() < num_obs,\
+        "Observations must index the columns of emission_p."
+
+    cdef double[:, ::1] cstart_p = start_p
+    cdef double[:, :, ::1] ctrans_p = trans_p
+    cdef double[:, :, ::1] cemission_p = emission_p
+    cdef int[::1] coffsets = offsets
     cdef int[:, ::1] obs_memview = obs_arr
+    cdef unsigned char[:, ::1] out_memview = out
+
+    cdef np.intp_t[::1] corder = order
+    cdef int **point_to_arr = <int **>malloc(num_bonds * sizeof(int*))
+    cdef unsigned char **point_to_out = \
+        <unsigned char **>malloc(num_bonds * sizeof(unsigned char*))
+    try:
+        if not point_to_arr or not point_to_out: raise MemoryError
+        for i in range(num_bonds):
+            point_to_arr[i] = &obs_memview[corder[i], 0]
+            point_to_out[i] = &out_memview[corder[i], 0]
+        with nogil:
+            posteriors(&point_to_arr[0], &point_to_out[0], num_bonds,
+                       num_frames, num_sets, &coffsets[0], cnum_states,
+                       num_obs, &cstart_p[0, 0], &ctrans_p[0, 0, 0],
+                       &cemission_p[0, 0, 0], &weight[0], num_cores)
+    finally:
+        free(point_to_arr)
+        free(point_to_out)
+    return out
 
-    # Do not over-allocate resources if there is not enough
-    # data to fill them.
-    if num_bonds < cores:
-        cores = num_bonds
 
-    # Build a pointer to array (which will contain pointers to rows)
+def expected_counts_cpp(np.ndarray[int, ndim=2] obs_arr, start_p, trans_p,
+                        emission_p, cores=1):
+    """Expected counts of the Baum-Welch E-step
+
+    Parameters
+    ----------
+    obs_arr : np.ndarray
+        Observed signal of each bond. Shape is (num_bonds, num_frames).
+    start_p : array-like
+        Probability of starting in a particular state.
+    trans_p : array-like
+        Probability of transitioning from one state to another.
+    emission_p : array-like
+        Probability of emitting one state given its hidden state.
+    cores : int, optional
+        Number of threads used for the bonds.
+
+    Returns
+    -------
+    start : np.ndarray
+        Expected number of signals starting in each state.
+    trans : np.ndarray
+        Expected number of transitions between each pair of states.
+    emission : np.ndarray
+        Expected number of times each state emits each observable.
+    loglik : float
+        Log-likelihood of all signals."""
+
+    start_p = np.ascontiguousarray(start_p, dtype=np.float64)
+    trans_p = np.ascontiguousarray(trans_p, dtype=np.float64)
+    emission_p = np.ascontiguousarray(emission_p, dtype=np.float64)
+    num_states = start_p.shape[0]
+    assert trans_p.shape == (num_states, num_states),\
+        "trans_p must have shape (n_states, n_states)."
+    assert emission_p.ndim == 2 and emission_p.shape[0] == num_states,\
+        "emission_p must have shape (n_states, n_observables)."
+
+    if not obs_arr.flags['C_CONTIGUOUS']:
+        obs_arr = np.ascontiguousarray(obs_arr)
+
+    cdef int num_bonds = obs_arr.shape[0]
+    cdef int num_frames = obs_arr.shape[1]
+    cdef int cnum_states = num_states
+    cdef int num_obs = emission_p.shape[1]
+    cdef int num_cores = max(1, min(cores, num_bonds))
+    cdef np.ndarray[np.float64_t, ndim=2] counts = np.zeros(
+        (num_bonds, num_states * (1 + num_states + num_obs) + 1))
+    if num_bonds > 0 and num_frames > 0:
+        assert obs_arr.min() >= 0 and obs_arr.max() < num_obs,\
+            "Observations must index the columns of emission_p."
+
+        _fill_counts(obs_arr, counts, start_p, trans_p, emission_p,
+                     num_cores)
+
+    total = counts.sum(axis=0)
+    start = total[:num_states]
+    trans = total[num_states:num_states * (1 + num_states)]
+    emission = total[num_states * (1 + num_states):-1]
+    return (start, trans.reshape((num_states, num_states)),
+            emission.reshape((num_states, num_obs)), total[-1])
+
+
+cdef _fill_counts(int[:, ::1] obs_memview, double[:, ::1] counts_memview,
+                  double[::1] cstart_p, double[:, ::1] ctrans_p,
+                  double[:, ::1] cemission_p, int num_cores):
+    cdef int num_bonds = obs_memview.shape[0]
+    cdef int num_frames = obs_memview.shape[1]
+    cdef int num_states = cstart_p.shape[0]
+    cdef int num_obs = cemission_p.shape[1]
     cdef int **point_to_arr = <int **>malloc(num_bonds * sizeof(int*))
-    if not point_to_arr: raise MemoryError
+    cdef double **point_to_counts = \
+        <double **>malloc(num_bonds * sizeof(double*))
     try:
+        if not point_to_arr or not point_to_counts: raise MemoryError
         for i in range(num_bonds):
             point_to_arr[i] = &obs_memview[i, 0]
-        decode(&point_to_arr[0], num_bonds, num_frames, cstart_p,
-               ctrans_p, cemission_p, cores)
+            point_to_counts[i] = &counts_memview[i, 0]
+        with nogil:
+            expected_counts(&point_to_arr[0], &point_to_counts[0],
+                            num_bonds, num_frames, num_states, num_obs,
+                            &cstart_p[0], &ctrans_p[0, 0],
+                            &cemission_p[0, 0], num_cores)
     finally:
-        # Deallocate the reserved memory from the pointers
         free(point_to_arr)
-    return obs_arr
+        free(point_to_counts)
 
 
 def viterbi_cpp(np.ndarray[int, ndim=1] obs, start_p, trans_p,
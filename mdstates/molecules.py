@@ -1,12 +1,19 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import hashlib
+from multiprocessing import Pool
+
 import networkx as nx
 from networkx.readwrite import json_graph
 import numpy as np
 from rdkit import Chem
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 
 from .util import json_to_string, load_json_from_string
 
 
-def contact_matrix_to_SMILES(cmat, atom_list):
+def contact_matrix_to_SMILES(cmat, atom_list, memo=None):
     """Converts a contact matrix to a SMILES string.
 
     Parameters
@@ -16,23 +23,102 @@ def contact_matrix_to_SMILES(cmat, atom_list):
     atom_list : array-like
         Atom list with indices matching indices in contact matrix for
         atom type identification.
+    memo : dict, optional
+        SMILES of the fragments already seen, see `fragment_SMILES`.
 
     Returns
     -------
     smiles : str
         SMILES string of molecule built from contact matrix.
     """
+    return fragment_SMILES(cmat, atom_list, memo=memo)
 
-    # Build the molecule
-    mol = build_molecule(cmat, atom_list)
 
-    # Generate SMILES string from molecule
-    smiles = Chem.MolToSmiles(mol)
+def contact_fragments(cmat, atom_list):
+    """Splits a contact matrix into its bonded fragments.
+
+    Bonds to Li are not part of the structure, see `set_structure`.
+
+    Parameters
+    ----------
+    cmat : numpy.ndarray
+        Contact matrix describing connectivity in a molecule.
+    atom_list : array-like
+        Atom list with indices matching indices in contact matrix.
 
-    return smiles
+    Returns
+    -------
+    list of tuple
+        Atom indices of every fragment, sorted, and its bonds as an
+        array of pairs of positions within the fragment.
+    """
+    atom_list = np.asarray(atom_list)
+    n_atoms = len(atom_list)
+    atom_i, atom_j = np.nonzero(np.asarray(cmat) == 1)
+    keep = (atom_list[atom_i] != 'Li') & (atom_list[atom_j] != 'Li')
+    atom_i, atom_j = atom_i[keep], atom_j[keep]
+
+    graph = coo_matrix((np.ones(len(atom_i)), (atom_i, atom_j)),
+                       shape=(n_atoms, n_atoms))
+    n_fragments, labels = connected_components(graph, directed=False)
+
+    # Atoms and bonds of each fragment are contiguous after sorting.
+    atoms = np.argsort(labels, kind='stable')
+    atom_bounds = np.searchsorted(labels[atoms], np.arange(n_fragments + 1))
+    position = np.empty(n_atoms, dtype=np.int64)
+    position[atoms] = np.arange(n_atoms) - atom_bounds[labels[atoms]]
+
+    bonds = np.argsort(labels[atom_i], kind='stable')
+    bond_bounds = np.searchsorted(labels[atom_i][bonds],
+                                  np.arange(n_fragments + 1))
+    local = np.column_stack([position[atom_i[bonds]],
+                             position[atom_j[bonds]]])
+
+    return [(atoms[atom_bounds[k]:atom_bounds[k + 1]],
+             local[bond_bounds[k]:bond_bounds[k + 1]])
+            for k in range(n_fragments)]
+
+
+def fragment_SMILES(cmat, atom_list, memo=None):
+    """Converts a contact matrix to a SMILES string fragment by fragment.
+
+    The SMILES of every bonded fragment is looked up in `memo` by its
+    element labels and bonds, and only new fragments are built with
+    RDKit. A reaction changes one or two fragments, so all others are
+    found in `memo`. The SMILES of the whole system joins the sorted
+    SMILES of its fragments.
 
+    Parameters
+    ----------
+    cmat : numpy.ndarray
+        Contact matrix describing connectivity in a molecule.
+    atom_list : array-like
+        Atom list with indices matching indices in contact matrix.
+    memo : dict, optional
+        SMILES of the fragments already seen. New fragments are added.
 
-def cmat_to_structure(cmat, atom_list):
+    Returns
+    -------
+    smiles : str
+        SMILES string of molecule built from contact matrix.
+    """
+    if memo is None:
+        memo = {}
+    atom_list = np.asarray(atom_list)
+
+    smiles = []
+    for atoms, bonds in contact_fragments(cmat, atom_list):
+        elements = tuple(atom_list[atoms].tolist())
+        key = (elements, bonds.astype(np.int64).tobytes())
+        if key not in memo:
+            fragment = np.zeros((len(atoms), len(atoms)), dtype=np.int32)
+            fragment[bonds[:, 0], bonds[:, 1]] = 1
+            memo[key] = Chem.MolToSmiles(build_molecule(fragment, elements))
+        smiles.append(memo[key])
+    return '.'.join(sorted(smiles))
+
+
+def cmat_to_structure(cmat, atom_list, memo=None):
     """Converts a contact matrix to a SMILES string and molecule.
 
     Parameters
@@ -42,6 +128,8 @@ def cmat_to_structure(cmat, atom_list):
     atom_list : array-like
         Atom list with indices matching indices in contact matrix for
         atom type identification.
+    memo : dict, optional
+        SMILES of the fragments already seen, see `fragment_SMILES`.
 
     Returns
     -------
@@ -54,12 +142,236 @@ def cmat_to_structure(cmat, atom_list):
     # Build the molecule
     mol = build_molecule(cmat, atom_list, with_hydrogens=True)
 
-    # Generate SMILES string from molecule
-    smiles = Chem.MolToSmiles(Chem.RemoveHs(mol))
+    # Generate SMILES string from the fragments
+    smiles = fragment_SMILES(cmat, atom_list, memo=memo)
 
     return smiles, mol
 
 
+class StructureCache:
+    """
+    Least recently used cache of the structures of contact matrices.
+
+    Bonds change rarely, so most frames near a transition share their
+    bond pattern with a frame that was already converted. Structures
+    are keyed by a hash of the bonded pairs of a contact matrix, so a
+    cache must only be used with a single atom list. New bond patterns
+    reuse the SMILES of the fragments seen before, see
+    `fragment_SMILES`.
+
+    Attributes
+    ----------
+    maxsize : int
+        Maximum number of structures kept. The least recently used
+        structure is evicted first.
+    hits, misses : int
+        Number of lookups that were and were not found in the cache.
+    fragments : dict
+        SMILES of every fragment seen so far.
+    """
+
+    def __init__(self, maxsize=4096):
+        """Inits an empty `StructureCache` object."""
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.fragments = {}
+        self._structures = OrderedDict()
+        self._pool = None
+        self._cores = 1
+        return
+
+    def __len__(self):
+        return len(self._structures)
+
+    @property
+    def hit_rate(self):
+        """Fraction of lookups that were found in the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @staticmethod
+    def key(cmat):
+        """Hash of the bonded pairs of a contact matrix."""
+        bonds = np.flatnonzero(np.asarray(cmat) == 1).astype(np.int64)
+        return hashlib.blake2b(bonds.tobytes(), digest_size=16).digest()
+
+    def get(self, cmat, atom_list):
+        """Converts a contact matrix to a SMILES string and molecule.
+
+        Same as `cmat_to_structure`, but the structure is only built
+        the first time a bond pattern is seen.
+
+        Returns
+        -------
+        smiles : str
+        mol : rdkit.Chem.Mol
+            Copy of the cached molecule.
+        """
+        structure = self._lookup(cmat, atom_list)
+        if structure[1] is None:
+            structure[1] = build_molecule(cmat, atom_list,
+                                          with_hydrogens=True)
+        return structure[0], Chem.RWMol(structure[1])
+
+    def smiles(self, cmat, atom_list):
+        """Converts a contact matrix to a SMILES string, like
+        `contact_matrix_to_SMILES`. The molecule is not built."""
+        return self._lookup(cmat, atom_list)[0]
+
+    @contextmanager
+    def workers(self, atom_list, cores):
+        """Builds new bond patterns on a pool of processes.
+
+        Inside the `with` block, `map_smiles` sends the patterns it
+        has to build to a pool of `cores` worker processes. No pool is
+        started if `cores` is 1.
+
+        Parameters
+        ----------
+        atom_list : array-like
+            Atom list with indices matching indices in contact matrix.
+        cores : int
+            Number of worker processes.
+        """
+        if cores <= 1:
+            yield self
+            return
+        with Pool(cores, initializer=_init_structure_worker,
+                  initargs=(list(atom_list),)) as pool:
+            self._pool, self._cores = pool, cores
+            try:
+                yield self
+            finally:
+                self._pool, self._cores = None, 1
+        return
+
+    def map_smiles(self, cmats, atom_list):
+        """Converts many contact matrices to SMILES strings.
+
+        Same as calling `smiles` on each contact matrix, but the new
+        bond patterns are built together, in batches of at most
+        `maxsize` distinct patterns, on the worker processes if
+        `workers` is active. The SMILES of a batch are yielded before
+        the next batch is built, so a batch never evicts its own
+        structures. Molecules are only built by `get`.
+
+        Parameters
+        ----------
+        cmats : iterable of numpy.ndarray
+            Contact matrices of single frames.
+        atom_list : array-like
+            Atom list with indices matching indices in contact matrix.
+
+        Yields
+        ------
+        str
+            SMILES string of each contact matrix, in order.
+        """
+        keys, batch, new = [], set(), {}
+        for cmat in cmats:
+            key = self.key(cmat)
+            if key not in batch:
+                if len(batch) == self.maxsize:
+                    yield from self._drain(keys, new, atom_list)
+                    keys, batch, new = [], set(), {}
+                batch.add(key)
+                if key in self._structures:
+                    # Keep it ahead of the structures the batch evicts.
+                    self._structures.move_to_end(key)
+                else:
+                    new[key] = np.nonzero(np.asarray(cmat) == 1)
+            keys.append(key)
+        yield from self._drain(keys, new, atom_list)
+        return
+
+    def _drain(self, keys, new, atom_list):
+        """Builds the `new` bond patterns of a batch and yields the
+        SMILES of every key in `keys`."""
+        bonds = list(new.values())
+        if self._pool is not None and len(bonds) > 1:
+            smiles = self._pool.map(_structure_worker, bonds,
+                                    chunksize=max(1, len(bonds) //
+                                                  (4 * self._cores)))
+        else:
+            smiles = [bonds_to_SMILES(atom_i, atom_j, atom_list,
+                                      memo=self.fragments)
+                      for atom_i, atom_j in bonds]
+
+        for key, value in zip(new, smiles):
+            self._structures[key] = [value, None]
+            if len(self._structures) > self.maxsize:
+                self._structures.popitem(last=False)
+
+        for key in keys:
+            # The first lookup of a new pattern is a miss.
+            if new.pop(key, None) is not None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self._structures.move_to_end(key)
+            yield self._structures[key][0]
+        return
+
+    def stats(self):
+        """Number of hits, misses and cached structures and hit rate."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self), 'hit_rate': self.hit_rate}
+
+    def clear(self):
+        """Removes every structure and resets the statistics."""
+        self._structures.clear()
+        self.fragments.clear()
+        self.hits = 0
+        self.misses = 0
+        return
+
+    def _lookup(self, cmat, atom_list):
+        """Cached [smiles, mol] of a contact matrix. The molecule is
+        None until `get` builds it."""
+        key = self.key(cmat)
+        if key in self._structures:
+            self.hits += 1
+            self._structures.move_to_end(key)
+            return self._structures[key]
+
+        self.misses += 1
+        structure = [fragment_SMILES(cmat, atom_list, memo=self.fragments),
+                     None]
+        self._structures[key] = structure
+        if len(self._structures) > self.maxsize:
+            self._structures.popitem(last=False)
+        return structure
+
+
+def bonds_to_SMILES(atom_i, atom_j, atom_list, memo=None):
+    """Converts a list of bonds to a SMILES string.
+
+    Same as `fragment_SMILES` for the contact matrix in which only the
+    pairs `atom_i`, `atom_j` are 1.
+    """
+    cmat = np.zeros((len(atom_list), len(atom_list)), dtype=np.int32)
+    cmat[atom_i, atom_j] = 1
+    return fragment_SMILES(cmat, atom_list, memo=memo)
+
+
+# Atom list and fragment SMILES of a `StructureCache.workers` process.
+_worker_atoms = None
+_worker_fragments = {}
+
+
+def _init_structure_worker(atom_list):
+    global _worker_atoms
+    _worker_atoms = atom_list
+    _worker_fragments.clear()
+    return
+
+
+def _structure_worker(bonds):
+    return bonds_to_SMILES(bonds[0], bonds[1], _worker_atoms,
+                           memo=_worker_fragments)
+
+
 def build_molecule(cmat, atom_list, with_hydrogens=False):
     """Builds a molecule from a contact matrix and list of atoms.
 
@@ -1,7 +1,10 @@
+from array import array
 from itertools import groupby
 import shutil
 import os.path
+import sys
 
+import numpy as np
 import pandas as pd
 from rdkit import Chem
 from rdkit.Chem import Draw
@@ -142,29 +145,118 @@ def remove_consecutive_repeats(smiles):
     """
     Removes consecutive repeats from a list.
 
+    Each entry is compared with the one before it in a single
+    vectorized comparison.
+
     Parameters
     ----------
-    smiles : list
-        Raw list of SMILES strings.
+    smiles : pandas.DataFrame or list
+        Structures with a 'smiles' column, or a list of SMILES strings
+        or of tuples that start with a SMILES string.
 
     Returns
     -------
-    true_list : list
-        List with all consecutive repeats removed.
+    true_list : pandas.DataFrame or list
+        Same type as `smiles` with all consecutive repeats removed.
+    """
+    if isinstance(smiles, pd.DataFrame):
+        values = smiles['smiles'].to_numpy()
+    else:
+        values = np.array([smi[0] if isinstance(smi, tuple) else smi
+                           for smi in smiles], dtype=object)
+
+    keep = np.ones(len(values), dtype=bool)
+    keep[1:] = values[1:] != values[:-1]
+
+    if isinstance(smiles, pd.DataFrame):
+        return smiles[keep].reset_index(drop=True)
+    return [smi for smi, k in zip(smiles, keep) if k]
+
+
+class StructureRecords:
     """
-    reduced = pd.DataFrame(columns=['smiles', 'molecule', 'frame',
-                                    'transition_frame'])
-    ref = smiles.loc[0, 'smiles']
-    reduced = reduced.append(smiles.iloc[0], ignore_index=True)
-
-    for i, row in smiles.iterrows():
-        if i == 0:
-            continue
-
-        if row['smiles'] != ref:
-            reduced = reduced.append(row, ignore_index=True)
-            ref = row['smiles']
-    return reduced
+    Column-wise builder of structure tables.
+
+    Rows are accumulated in typed columns and only turned into a
+    `pandas.DataFrame`, with the columns 'smiles', 'molecule', 'frame'
+    and 'transition_frame', once at the end. SMILES strings are
+    interned and stored as integer codes, so consecutive repeats are
+    found by comparing integers.
+    """
+
+    columns = ['smiles', 'molecule', 'frame', 'transition_frame']
+
+    def __init__(self):
+        """Inits an empty `StructureRecords` object."""
+        self.frame = array('q')
+        self.transition_frame = array('q')
+        self.molecules = []
+        self._codes = array('q')
+        self._smiles = []
+        self._index = {}
+        return
+
+    def __len__(self):
+        return len(self._codes)
+
+    def append(self, smiles, frame, transition_frame, molecule=None):
+        """Adds a structure. The molecule may be left out and filled
+        in by `to_frame`."""
+        code = self._index.get(smiles)
+        if code is None:
+            code = self._index[smiles] = len(self._smiles)
+            self._smiles.append(sys.intern(smiles))
+        self._codes.append(code)
+        self.frame.append(frame)
+        self.transition_frame.append(transition_frame)
+        self.molecules.append(molecule)
+        return
+
+    @property
+    def smiles(self):
+        """SMILES string of every row."""
+        return [self._smiles[code] for code in self._codes]
+
+    def changes(self):
+        """Mask of the rows whose SMILES differs from the row before,
+        i.e. the rows left after removing consecutive repeats."""
+        codes = np.frombuffer(self._codes, dtype=np.int64)
+        keep = np.ones(len(codes), dtype=bool)
+        keep[1:] = codes[1:] != codes[:-1]
+        return keep
+
+    def to_frame(self, rows=None, molecule=None):
+        """Builds the table.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray, optional
+            Mask or indices of the rows to keep. Default is all rows.
+        molecule : callable, optional
+            Called with the frame of each kept row that has no
+            molecule to build it.
+
+        Returns
+        -------
+        pandas.DataFrame
+        """
+        index = np.arange(len(self))
+        if rows is not None:
+            index = index[rows]
+        codes = np.frombuffer(self._codes, dtype=np.int64)[index]
+        frame = np.frombuffer(self.frame, dtype=np.int64)[index]
+        molecules = [self.molecules[i] for i in index.tolist()]
+        if molecule is not None:
+            molecules = [molecule(f) if mol is None else mol
+                         for mol, f in zip(molecules, frame.tolist())]
+
+        return pd.DataFrame({
+            'smiles': [self._smiles[code] for code in codes.tolist()],
+            'molecule': molecules,
+            'frame': frame,
+            'transition_frame': np.frombuffer(self.transition_frame,
+                                              dtype=np.int64)[index]},
+            columns=self.columns)
 
 
 def uniqueSMILES(smiles_list):
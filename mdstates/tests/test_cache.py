@@ -0,0 +1,58 @@
+import numpy as np
+
+from ..cache import ContactCache, cache_key
+from ..contacts import SparseContacts, PackedContacts
+
+
+def test_cache_key():
+    cutoff = {frozenset(['C', 'H']): 0.15, frozenset(['O']): 0.2}
+    key = cache_key('contacts', cutoff, np.array([0.5, 0.5]))
+    # Insertion order and container types do not matter.
+    reordered = {frozenset(['O']): 0.2, frozenset(['H', 'C']): 0.15}
+    assert key == cache_key('contacts', reordered, np.array([0.5, 0.5]))
+    assert key != cache_key('contacts', reordered, np.array([0.5, 0.4]))
+    assert key != cache_key('contacts', cutoff, np.array([0.5, 0.5],
+                                                         dtype=np.float32))
+    return
+
+
+def test_contact_cache(tmpdir):
+    cache = ContactCache(str(tmpdir))
+    rng = np.random.RandomState(0)
+    upper = np.triu(np.ones((6, 6), dtype=bool), 1)[..., np.newaxis]
+    dense = ((rng.rand(6, 6, 50) < 0.3) & upper).astype(np.int32)
+    posteriors = {'atom_i': np.array([0, 1]), 'atom_j': np.array([2, 3]),
+                  'probs': rng.randint(0, 256, (2, 50)).astype(np.uint8)}
+
+    stores = [dense, SparseContacts.from_dense(dense),
+              PackedContacts.from_dense(dense)]
+    for k, cmat in enumerate(stores):
+        cache.save(str(k), cmat, posteriors=posteriors if k else None)
+
+    assert cache.load('missing') == (None, None)
+    for k, cmat in enumerate(stores):
+        loaded, post = cache.load(str(k))
+        assert isinstance(loaded, type(cmat))
+        if k == 0:
+            assert post is None
+            test = loaded
+        else:
+            for name in posteriors:
+                assert np.all(post[name] == posteriors[name])
+            test = loaded.to_dense()
+        assert np.all(test == dense)
+
+        # Loaded arrays are copy-on-write.
+        if k == 0:
+            loaded[...] = 0
+        else:
+            loaded.fill(np.array([0]), np.array([2]), 1)
+    for k, cmat in enumerate(stores):
+        loaded, _ = cache.load(str(k))
+        test = loaded if k == 0 else loaded.to_dense()
+        assert np.all(test == dense)
+
+    assert cache.hits == 6 and cache.misses == 1
+    cache.clear()
+    assert '0' not in cache
+    return
@@ -0,0 +1,183 @@
+import numpy as np
+
+from ..contacts import (neighbor_contacts, find_transitions, SparseContacts,
+                        PackedContacts)
+
+
+def test_neighbor_contacts():
+    rng = np.random.RandomState(0)
+    box = np.array([[2.0, 2.5, 3.0], [2.0, 2.5, 3.0]])
+    xyz = rng.uniform(-1.0, 3.0, size=(2, 40, 3))
+    elements = np.array([0, 1] * 20)
+    table = np.array([[0.4, 0.5], [0.5, 0.6]])
+
+    frames, atom_i, atom_j = neighbor_contacts(xyz, elements, table, box=box)
+    assert np.all(atom_i < atom_j), "Pairs must be in the upper triangle."
+
+    # Compare against the minimum image distance of every pair.
+    i, j = np.triu_indices(40, 1)
+    for f in range(2):
+        delta = xyz[f, j] - xyz[f, i]
+        delta -= box[f] * np.round(delta / box[f])
+        dist = np.sqrt((delta ** 2).sum(axis=1))
+        bonded = dist < table[elements[i], elements[j]]
+        true = set(zip(i[bonded], j[bonded]))
+        test = set(zip(atom_i[frames == f], atom_j[frames == f]))
+        assert true == test, "Periodic contacts are incorrect."
+
+    # Without a box the distances are not wrapped.
+    frames, atom_i, atom_j = neighbor_contacts(xyz, elements, table)
+    delta = xyz[0, j] - xyz[0, i]
+    bonded = np.sqrt((delta ** 2).sum(axis=1)) < \
+        table[elements[i], elements[j]]
+    assert set(zip(i[bonded], j[bonded])) ==\
+        set(zip(atom_i[frames == 0], atom_j[frames == 0]))
+    return
+
+
+def _random_cmat(seed=0, n_atoms=5, n_frames=30):
+    rng = np.random.RandomState(seed)
+    cmat = np.zeros((n_atoms, n_atoms, n_frames), dtype=np.int32)
+    i, j = np.triu_indices(n_atoms, 1)
+    # Blocky signals with a few long intervals per pair.
+    signals = np.cumsum(rng.rand(len(i), n_frames) < 0.15, axis=1) % 2
+    cmat[i, j, :] = signals
+    return cmat
+
+
+def test_sparse_contacts():
+    cmat = _random_cmat()
+    sparse = SparseContacts.from_dense(cmat)
+
+    assert sparse.shape == cmat.shape
+    assert np.all(sparse.to_dense() == cmat), "Round trip failed."
+    assert np.all(sparse[..., 7] == cmat[..., 7])
+    assert np.all(sparse[:, :, -1] == cmat[:, :, -1])
+    assert np.all(sparse[1, 3] == cmat[1, 3, :])
+
+    atom_i, atom_j, counts = sparse.active()
+    assert np.all(counts == cmat[atom_i, atom_j, :].sum(axis=1))
+
+    block = sparse.signals(atom_i, atom_j, start=5, stop=20)
+    assert np.all(block == cmat[atom_i, atom_j, 5:20])
+
+    # Transitions are listed in the same order as a dense `np.diff`.
+    true = np.where(np.diff(cmat).reshape((25, -1)))[1]
+    assert np.all(sparse.transition_frames() == true)
+    _check_transitions(sparse, cmat)
+
+    intervals = sparse.intervals(0, 1)
+    assert intervals[0][0] == 0 and intervals[-1][1] == 30
+    for start, stop, state in intervals:
+        assert np.all(cmat[0, 1, start:stop] == state)
+    return
+
+
+def test_signals_past_end():
+    cmat = SparseContacts.from_contacts(3, 10, np.arange(4, 10),
+                                        np.zeros(6, int), np.ones(6, int))
+    packed = PackedContacts.from_contacts(3, 10, np.arange(4, 10),
+                                          np.zeros(6, int), np.ones(6, int))
+    for store in [cmat, packed]:
+        block = store.signals([0], [1], 5, 20)
+        assert block.shape == (1, 5), "Signals must stop at the last frame."
+        assert np.all(block == 1)
+    return
+
+
+def test_sparse_set_signals():
+    cmat = _random_cmat(seed=1)
+    sparse = SparseContacts.from_dense(cmat)
+
+    new = np.zeros((2, 30), dtype=np.int32)
+    new[0, 10:] = 1
+    new[1, :] = 1
+    sparse.set_signals([0, 2], [4, 3], new)
+    cmat[0, 4, :] = new[0]
+    cmat[2, 3, :] = new[1]
+    assert np.all(sparse.to_dense() == cmat)
+
+    # Replace only a window of frames.
+    window = np.ones((1, 6), dtype=np.int32)
+    window[0, 2] = 0
+    sparse.set_signals([1], [4], window, start=12)
+    cmat[1, 4, 12:18] = window[0]
+    assert np.all(sparse.to_dense() == cmat)
+
+    sparse.fill([1], [2], 1)
+    sparse.fill([0], [1], 0)
+    cmat[1, 2, :] = 1
+    cmat[0, 1, :] = 0
+    assert np.all(sparse.to_dense() == cmat)
+
+    sparse.remove_atoms([3])
+    cmat[3, :, :] = 0
+    cmat[:, 3, :] = 0
+    assert np.all(sparse.to_dense() == cmat)
+    return
+
+
+def test_sparse_append():
+    cmat = _random_cmat(seed=2)
+    sparse = SparseContacts(5)
+    for start in range(0, 30, 8):
+        chunk = cmat[..., start:start + 8]
+        atom_i, atom_j, frames = np.nonzero(chunk)
+        sparse.append(chunk.shape[2], frames, atom_i, atom_j)
+
+    full = SparseContacts.from_dense(cmat)
+    assert sparse.n_frames == 30
+    assert np.all(sparse.to_dense() == cmat)
+    # Intervals crossing chunk boundaries are joined.
+    assert len(sparse.start) == len(full.start)
+    return
+
+
+def test_packed_contacts():
+    cmat = _random_cmat(seed=3, n_frames=29)
+    atom_i, atom_j, frames = np.nonzero(cmat)
+    packed = PackedContacts.from_contacts(5, 29, frames, atom_i, atom_j)
+
+    assert packed.bits.shape == (10, 4)
+    assert np.all(packed.to_dense() == cmat), "Round trip failed."
+    assert np.all(PackedContacts.from_dense(cmat).bits == packed.bits)
+    assert np.all(packed[..., 9] == cmat[..., 9])
+    assert np.all(packed[:, :, -1] == cmat[:, :, -1])
+    assert np.all(packed[2, 4] == cmat[2, 4, :])
+
+    atom_i, atom_j, counts = packed.active()
+    assert np.all(counts == cmat[atom_i, atom_j, :].sum(axis=1))
+    assert np.all(packed.signals(atom_i, atom_j, 3, 21) ==
+                  cmat[atom_i, atom_j, 3:21])
+
+    true = np.where(np.diff(cmat).reshape((25, -1)))[1]
+    assert np.all(packed.transition_frames() == true)
+    _check_transitions(packed, cmat)
+    # Blocks of rows that do not divide the rows evenly.
+    for test, full in zip(packed._changes(block=3), packed._changes()):
+        assert np.all(test == full)
+
+    window = np.array([[1, 0, 1, 1, 0, 1, 1, 1, 0, 1, 1]], dtype=np.int32)
+    packed.set_signals([0], [3], window, start=5)
+    cmat[0, 3, 5:16] = window[0]
+    packed.fill([1], [2], 1)
+    cmat[1, 2, :] = 1
+    packed.remove_atoms([4])
+    cmat[4, :, :] = 0
+    cmat[:, 4, :] = 0
+    assert np.all(packed.to_dense() == cmat)
+    # Padding bits stay empty.
+    assert np.all(packed.bits[:, -1] & 0b111 == 0)
+    return
+
+
+def _check_transitions(store, cmat):
+    atom_i, atom_j, frames = np.nonzero(np.diff(cmat))
+    order = np.lexsort((atom_j, atom_i, frames))
+    for cm in [store, cmat]:
+        test = find_transitions(cm)
+        assert np.all(np.diff(test[0]) >= 0)
+        assert np.all(test[0] == frames[order])
+        assert np.all(test[1] == atom_i[order])
+        assert np.all(test[2] == atom_j[order])
+    return
@@ -1,13 +1,15 @@
 from collections import Counter
-# import shutil
+import shutil
 import os
 
 import mdtraj as md
 import numpy as np
 import networkx as nx
 import pandas as pd
+import pytest
 from rdkit import Chem
 
+from ..contacts import SparseContacts, PackedContacts
 from ..core import Network
 # from ..graphs import prepare_graph
 
@@ -43,6 +45,29 @@ def test_add_replica():
     return
 
 
+def test_add_replica_chunk():
+    net = Network()
+    net.add_replica(traj_path, top_path, chunk=100)
+    assert net.replica[0]['traj'] is None, "Trajectory should not be loaded."
+    assert net.n_atoms == 6
+    net.generate_contact_matrix()
+    assert isinstance(net.replica[0]['cmat'], SparseContacts)
+
+    full = Network()
+    full.add_replica(traj_path, top_path)
+    full.generate_contact_matrix()
+    assert np.all(net.replica[0]['cmat'].to_dense() ==
+                  full.replica[0]['cmat'])
+    assert net.first_smiles == full.first_smiles
+
+    # Chunked decoding matches the Python Viterbi algorithm.
+    net.decode()
+    full.decode(use_python=True)
+    assert np.all(net.replica[0]['cmat'].to_dense() ==
+                  full.replica[0]['cmat'])
+    return
+
+
 def test_remove_replica():
     net = Network()
     net.add_replica(traj_path, top_path)
@@ -103,6 +128,28 @@ def test_generate_contact_matrix():
     return
 
 
+def test_contact_methods():
+    net1 = Network()
+    net1.add_replica(traj_path, top_path)
+    net1.generate_contact_matrix(method='pairs')
+
+    net2 = Network()
+    net2.add_replica(traj_path, top_path)
+    net2.generate_contact_matrix(method='neighbors')
+
+    assert np.all(net1.replica[0]['cmat'] == net2.replica[0]['cmat']),\
+        "Neighbor search does not match all pairs."
+    assert net1.first_smiles == net2.first_smiles
+
+    try:
+        net2.generate_contact_matrix(method='grid')
+    except(ValueError):
+        pass
+    else:
+        raise Exception("Bad contact method allowed.")
+    return
+
+
 def test_generate_pairs():
     net = Network()
     net.add_replica(traj_path, top_path)
@@ -202,6 +249,128 @@ def test_decode():
     return
 
 
+def test_decode_states():
+    # Unbonded, transient and bonded hidden states.
+    params = dict(n=0, states=[0, 1, 1], start_p=[0.4, 0.2, 0.4],
+                  trans_p=[[0.99, 0.009, 0.001], [0.05, 0.9, 0.05],
+                           [0.001, 0.009, 0.99]],
+                  emission_p=[[0.8, 0.2], [0.5, 0.5], [0.2, 0.8]])
+    results = []
+    for use_python, sparse in [(True, False), (False, False),
+                               (False, True)]:
+        net = Network()
+        net.add_replica(traj_path, top_path)
+        net.generate_contact_matrix(sparse=sparse)
+        net.decode(use_python=use_python, **params)
+        cmat = net.replica[0]['cmat']
+        results.append(cmat.to_dense() if sparse else cmat)
+    assert np.all(results[0] == results[1])
+    assert np.all(results[0] == results[2])
+    return
+
+
+def test_decode_posteriors():
+    for packed in [False, True]:
+        net = Network()
+        net.add_replica(traj_path, top_path)
+        net.generate_contact_matrix(packed=packed)
+        net.decode(posteriors=True)
+        post = net.replica[0]['posteriors']
+        assert post['probs'].dtype == np.uint8
+        assert post['probs'].shape == (len(post['atom_i']), 1001)
+
+        ranked = net.transition_confidence(0)
+        assert set(net.frames[0]) <= set(ranked['frame'])
+        assert ranked['confidence'].is_monotonic_decreasing
+        assert ranked['confidence'].iloc[0] > 0.9
+
+    net = Network()
+    net.add_replica(traj_path, top_path)
+    net.generate_contact_matrix()
+    net.decode(min_confidence=1.01)
+    assert net.frames == [[]]
+
+    # Chunked and memory-mapped decoding never hold every frame.
+    net = Network()
+    net.add_replica(traj_path, top_path)
+    net.generate_contact_matrix(sparse=True)
+    with pytest.raises(ValueError):
+        net.decode(posteriors=True, chunk=100)
+    with pytest.raises(ValueError):
+        net.decode(min_confidence=0.5, chunk=100)
+    return
+
+
+def test_fit_hmm():
+    net = Network()
+    net.add_replica(traj_path, top_path)
+    net.generate_contact_matrix(sparse=True)
+    params = net.fit_hmm(n=0, seed=0)
+    assert set(params) == {frozenset(['C', 'Cl'])}
+    fitted = params[frozenset(['C', 'Cl'])]
+    assert np.allclose(fitted['trans_p'].sum(axis=1), 1)
+    assert np.allclose(fitted['emission_p'].sum(axis=1), 1)
+
+    net.decode(n=0)
+    assert len(set(net.frames[0])) == 1
+
+    try:
+        net.fit_hmm()
+    except(AssertionError):
+        pass
+    else:
+        raise Exception("Fitted after decoding.")
+    return
+
+
+def test_decode_sparse():
+    dense = Network()
+    dense.add_replica(traj_path, top_path)
+    dense.generate_contact_matrix()
+    dense.decode()
+
+    sparse = Network()
+    sparse.add_replica(traj_path, top_path)
+    sparse.generate_contact_matrix(sparse=True)
+    assert isinstance(sparse.replica[0]['cmat'], SparseContacts)
+    sparse.decode()
+
+    assert np.all(sparse.replica[0]['cmat'].to_dense() ==
+                  dense.replica[0]['cmat'])
+    assert sparse.frames == dense.frames
+
+    dense.get_structures()
+    sparse.get_structures()
+    assert dense.replica[0]['structures']['smiles'].tolist() ==\
+        sparse.replica[0]['structures']['smiles'].tolist()
+    return
+
+
+def test_decode_packed():
+    dense = Network()
+    dense.add_replica(traj_path, top_path)
+    dense.generate_contact_matrix()
+    dense.decode()
+
+    packed = Network()
+    packed.add_replica(traj_path, top_path)
+    packed.generate_contact_matrix(packed=True)
+    assert isinstance(packed.replica[0]['cmat'], PackedContacts)
+    packed.decode()
+
+    assert np.all(packed.replica[0]['cmat'].to_dense() ==
+                  dense.replica[0]['cmat'])
+    assert packed.frames == dense.frames
+
+    try:
+        packed.generate_contact_matrix(sparse=True, packed=True)
+    except(ValueError):
+        pass
+    else:
+        raise Exception("Both sparse and packed allowed.")
+    return
+
+
 def test_chemical_equations():
     net = Network()
     smiles_list = ['A.B.C', 'A.B.D', 'A.E.D']
@@ -234,29 +403,42 @@ def test_traj_to_topology():
     return
 
 
-def test_build_connections():
+def test_compute_contacts():
+    top = md.Topology()
+    residue = top.add_residue('HH', top.add_chain())
+    for _ in range(3):
+        top.add_atom('H', md.element.hydrogen, residue)
+    xyz = np.array([[[0, 0, 0], [1.3, 0, 0], [0, 1.0, 0]],
+                    [[0, 0, 0], [1.0, 0, 0], [0, 1.3, 0]]])
+    traj = md.Trajectory(xyz, top)
+
     net = Network()
-    net.atoms = ['H', 'H']
-    net.n_atoms = 2
+    net.atoms = ['H', 'H', 'H']
+    net.n_atoms = 3
     net.set_cutoff(['H', 'H'], 1.2)
-    dist = np.array([[1.3], [1.0]])
-    # dist = np.array([[[0, 1.3], [0, 0]], [[0, 1.0], [0, 0]]])
-    dist = net._reshape_to_square(dist)
-    cmat = net._build_connections(dist)
-    assert cmat[0, 1, 0] == 0, "Nonbonded cutoff not working."
-    assert cmat[0, 1, 1] == 1, "Bonded cutoff not working."
+    for method in ['pairs', 'neighbors']:
+        net._method = method
+        frames, atom_i, atom_j = net._compute_contacts(traj)
+        order = np.lexsort((atom_j, atom_i, frames))
+        assert np.all(frames[order] == [0, 1])
+        assert np.all(atom_i[order] == [0, 0])
+        assert np.all(atom_j[order] == [2, 1])
     return
 
 
-def test_reshape_to_square():
+def test_pair_cutoffs():
     net = Network()
+    net.atoms = ['H', 'O', 'H']
     net.n_atoms = 3
-    linear = np.array([[1, 2, 3], [4, 5, 6]])
-    square = net._reshape_to_square(linear)
-    true = np.array([[[0, 0], [1, 4], [2, 5]],
-                     [[0, 0], [0, 0], [3, 6]],
-                     [[0, 0], [0, 0], [0, 0]]])
-    assert np.all(square == true), "Not reshaping correctly."
+    net.set_cutoff(['H', 'H'], 0.1)
+    net.set_cutoff(['H', 'O'], 0.2)
+    net.set_cutoff(['O', 'O'], 0.3)
+    net._generate_pairs()
+    assert np.all(net._pair_cutoffs() == [0.2, 0.1, 0.2])
+
+    # Cached cutoffs are updated by `set_cutoff`.
+    net.set_cutoff(['H', 'H'], 0.15)
+    assert np.all(net._pair_cutoffs() == [0.2, 0.15, 0.2])
     return
 
 
@@ -312,11 +494,6 @@ def test_draw_overall_network():
     return
 
 
-def test_compute_distances():
-    pass
-    return
-
-
 def test_build_cutoff():
     pass
     return
@@ -328,7 +505,31 @@ def test_bond_distance():
 
 
 def test_find_transition_frames():
-    pass
+    net = Network()
+    net.replica.append({'traj': None, 'cmat': None, 'path': None,
+                        'processed': True, 'network': None})
+    net.n_atoms = 3
+    net.frames.append([])
+
+    cmat = np.zeros((3, 3, 100), dtype=np.int32)
+    cmat[0, 1, 30:] = 1
+    cmat[0, 2, :30] = 1
+    cmat[1, 2, 40:45] = 1
+    cmat[1, 2, 80:] = 1
+    net.replica[0]['cmat'] = cmat
+
+    net._find_transition_frames()
+    assert net.frames == [[29, 39, 44, 79]]
+    transitions = net.replica[0]['transitions']
+    assert np.all(transitions['frame'] == [29, 29, 39, 44, 79])
+    assert np.all(transitions['atom_i'] == [0, 0, 1, 1, 1])
+    assert np.all(transitions['atom_j'] == [1, 2, 2, 2, 2])
+
+    net._clean_frames(min_lifetime=10)
+    assert net.frames == [[29, 44, 79]]
+    net.frames = [[]]
+    net._clean_frames(min_lifetime=10)
+    assert net.frames == [[]]
     return
 
 
@@ -399,3 +600,164 @@ def test_load():
     # net.network = compiled
     # final = prepare_graph(net.network, root_node=net._first_smiles)
     return
+
+
+def test_binary_checkpoint(tmpdir):
+    net = Network()
+    net.load(os.path.join(currentdir, 'test_cases', 'test_load.txt'))
+    net.frames = [[100, 200], [300, 500]]
+    net.hmm_params[frozenset(['C', 'Cl'])] = {
+        'start_p': np.array([0.5, 0.5]),
+        'trans_p': np.array([[0.99, 0.01], [0.01, 0.99]]),
+        'emission_p': np.array([[0.8, 0.2], [0.2, 0.8]]),
+        'loglik': -10.0}
+    name = str(tmpdir.join('test'))
+    net.save(name, binary=True)
+
+    loaded = Network()
+    loaded.load(name + '.npz')
+    assert loaded.first_smiles == net.first_smiles
+    assert loaded.frames == net.frames
+    fitted = loaded.hmm_params[frozenset(['C', 'Cl'])]
+    assert np.all(fitted['trans_p'] == [[0.99, 0.01], [0.01, 0.99]])
+    for rep, true in zip(loaded.replica, net.replica):
+        structures = rep['structures']
+        for col in ['smiles', 'frame', 'transition_frame']:
+            assert np.all(structures[col] == true['structures'][col])
+        for mol, true_mol in zip(structures['molecule'],
+                                 true['structures']['molecule']):
+            assert Chem.MolToSmiles(mol) == Chem.MolToSmiles(true_mol)
+    return
+
+
+def test_decode_pair_params():
+    # Uninformative emissions leave the C-Cl pairs in their start state.
+    flat = ([0.5, 0.5], [[0.999, 0.001], [0.001, 0.999]],
+            [[0.5001, 0.4999], [0.4999, 0.5001]])
+    for use_python, kwargs, chunk in [(True, {}, None), (False, {}, None),
+                                      (False, {'packed': True}, None),
+                                      (False, {'sparse': True}, 100)]:
+        for key, transitions in [(frozenset(['C', 'Cl']), False),
+                                 (frozenset(['C', 'H']), True)]:
+            net = Network()
+            net.add_replica(traj_path, top_path)
+            net.generate_contact_matrix(**kwargs)
+            net.decode(n=0, use_python=use_python, chunk=chunk,
+                       pair_params={key: flat})
+            assert (len(net.frames[0]) > 0) == transitions
+    return
+
+
+def test_contact_cache(tmpdir):
+    for kwargs in [{}, {'packed': True}]:
+        nets = []
+        for _ in range(2):
+            net = Network()
+            net.set_cache(str(tmpdir.join(str(len(kwargs)))))
+            net.add_replica(traj_path, top_path)
+            net.generate_contact_matrix(ignore='Li', **kwargs)
+            net.decode(posteriors=True)
+            nets.append(net)
+
+        first, rerun = nets
+        assert first.cache.hits == 0 and first.cache.misses == 2
+        assert rerun.cache.hits == 2 and rerun.cache.misses == 0
+        assert rerun.frames == first.frames
+        for name in ['frame', 'atom_i', 'atom_j']:
+            assert np.all(rerun.replica[0]['transitions'][name] ==
+                          first.replica[0]['transitions'][name])
+        assert np.all(rerun.replica[0]['posteriors']['probs'] ==
+                      first.replica[0]['posteriors']['probs'])
+
+        # Other HMM parameters are decoded again.
+        net = Network()
+        net.set_cache(str(tmpdir.join(str(len(kwargs)))))
+        net.add_replica(traj_path, top_path)
+        net.generate_contact_matrix(ignore='Li', **kwargs)
+        net.decode(n=5)
+        assert net.cache.hits == 1 and net.cache.misses == 1
+    return
+
+
+def test_memmap_contacts(tmpdir):
+    def dense(cmat):
+        return cmat if isinstance(cmat, np.ndarray) else cmat.to_dense()
+
+    for kwargs, chunk in [({}, None), ({'packed': True}, None),
+                          ({'parallel': True}, None), ({}, 100),
+                          ({'packed': True}, 100)]:
+        nets = []
+        for memmap in [None, str(tmpdir.join(str(len(nets))))]:
+            net = Network()
+            net.add_replica(traj_path, top_path, chunk=chunk)
+            net.generate_contact_matrix(ignore='Li', memmap=memmap,
+                                        **kwargs)
+            if memmap:
+                cmat = net.replica[0]['cmat']
+                bits = cmat.bits if kwargs.get('packed') else cmat
+                assert isinstance(bits, np.memmap)
+                assert bits.dtype == np.uint8
+                assert os.path.isfile(os.path.join(memmap, 'replica0.npy'))
+                with pytest.raises(ValueError):
+                    net.decode(posteriors=True)
+            raw = dense(net.replica[0]['cmat']).copy()
+            net.decode()
+            nets.append((raw, net))
+
+        (first_raw, first), (mapped_raw, mapped) = nets
+        assert np.all(mapped_raw == first_raw)
+        assert mapped.frames == first.frames
+    return
+
+
+def test_parallel_contacts(tmpdir):
+    def dense(cmat):
+        return cmat if isinstance(cmat, np.ndarray) else cmat.to_dense()
+
+    paths = [traj_path]
+    for k in range(2):
+        paths.append(str(tmpdir.join('copy{}.xyz'.format(k))))
+        shutil.copy(traj_path, paths[-1])
+
+    for kwargs in [{}, {'packed': True}, {'sparse': True},
+                   {'memmap': str(tmpdir.join('memmap'))}]:
+        nets = []
+        for parallel in [False, True]:
+            net = Network()
+            for k, path in enumerate(paths):
+                # The last replica is streamed.
+                net.add_replica(path, top_path,
+                                chunk=100 if k == 2 else None)
+            net.generate_contact_matrix(ignore='Li', parallel=parallel,
+                                        cores=2, **kwargs)
+            nets.append(net)
+
+        serial, parallel = nets
+        for rep, true in zip(parallel.replica, serial.replica):
+            assert type(rep['cmat']) is type(true['cmat'])
+            assert np.all(dense(rep['cmat']) == dense(true['cmat']))
+    return
+
+
+def test_decode_store_partial_chunk():
+    # 105 frames do not split evenly into chunks of 100.
+    net = Network()
+    net.atoms = ['C', 'H', 'H']
+    states = np.array([0, 1])
+    params = (np.array([0.5, 0.5]),
+              np.array([[0.999, 0.001], [0.001, 0.999]]),
+              np.array([[0.6, 0.4], [0.4, 0.6]]))
+
+    decoded = []
+    for chunk in [None, 100, 30]:
+        cmat = SparseContacts.from_contacts(3, 105, np.arange(40, 105),
+                                            np.zeros(65, int),
+                                            np.ones(65, int))
+        net._decode_store(cmat, 0, states, *params, 1, True, chunk=chunk)
+        assert np.all(cmat.stop <= 105)
+        decoded.append(cmat.to_dense())
+    assert np.all(decoded[0][0, 1, 40:] == 1)
+    assert np.all(decoded[0][0, 1, :40] == 0)
+    for test in decoded[1:]:
+        assert np.all(test == decoded[0])
+    return
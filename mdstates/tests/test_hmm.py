@@ -1,7 +1,12 @@
 import numpy as np
 
-from ..hmm import (generate_ignore_list, viterbi, fast_viterbi)
-from ..hmm_cython import viterbi_cpp
+from ..hmm import (generate_ignore_list, triage, triage_contacts, viterbi,
+                   fast_viterbi, batch_viterbi, batch_posteriors, quantize,
+                   expected_counts, baum_welch, ChunkedViterbi,
+                   OnlineViterbi)
+from ..hmm_cython import (viterbi_cpp, decode_cpp, decode_bytes_cpp,
+                          decode_packed_cpp, posteriors_cpp,
+                          expected_counts_cpp)
 
 
 def test_generate_ignore_list():
@@ -39,6 +44,24 @@ def test_generate_ignore_list():
     return
 
 
+def test_triage():
+    counts = np.array([0, 2, 3, 7, 8, 10])
+    zeros, ones, run = triage(counts, 10, n=2)
+    assert np.all(zeros == [True, True, False, False, False, False])
+    assert np.all(ones == [False, False, False, False, True, True])
+    assert np.all(run == [False, False, True, True, False, False])
+
+    cmat = np.zeros((3, 3, 10), dtype=np.int32)
+    cmat[0, 1, :] = 1
+    cmat[0, 2, :5] = 1
+    cmat[1, 2, 4] = 1
+    atom_i, atom_j, zeros, ones, run = triage_contacts(cmat, n=2)
+    assert list(zip(atom_i[zeros], atom_j[zeros])) == [(1, 2)]
+    assert list(zip(atom_i[ones], atom_j[ones])) == [(0, 1)]
+    assert list(zip(atom_i[run], atom_j[run])) == [(0, 2)]
+    return
+
+
 def test_viterbi():
     obs = np.concatenate([np.zeros(100, dtype=int), np.ones(50, dtype=int)])
     obs[[75, 80, 83]] = 1
@@ -87,3 +110,359 @@ def test_viterbi_cpp():
     test2 = viterbi_cpp(obs2, start_p, trans_p, emission_p)
     assert np.all(test2 == 1)
     return
+
+
+def test_chunked_viterbi():
+    rng = np.random.RandomState(0)
+    obs = (np.cumsum(rng.rand(4, 300) < 0.01, axis=1) % 2).astype(np.int32)
+    noise = rng.rand(*obs.shape) < 0.2
+    obs[noise] = 1 - obs[noise]
+
+    states = np.array([0, 1])
+    start_p = np.array([0.5, 0.5])
+    trans_p = np.array([[0.999, 0.001], [0.001, 0.999]])
+    emission_p = np.array([[0.6, 0.4], [0.4, 0.6]])
+
+    decoder = ChunkedViterbi(start_p, trans_p, emission_p)
+    for start in [0, 7, 100, 101, 250]:
+        stop = {0: 7, 7: 100, 100: 101, 101: 250, 250: 300}[start]
+        decoder.update(obs[:, start:stop])
+    assert decoder.n_frames == 300
+
+    test = np.zeros_like(obs)
+    for start, states_block in decoder.backtrace(
+            lambda start, stop: obs[:, start:stop]):
+        test[:, start:start + states_block.shape[1]] = states_block
+
+    for row, true_row in zip(test, obs):
+        true = fast_viterbi(true_row, states, start_p, trans_p, emission_p)
+        assert np.all(row == true), "Chunked decoding does not match."
+    return
+
+
+def test_online_viterbi():
+    rng = np.random.RandomState(4)
+    obs = (np.cumsum(rng.rand(4, 600) < 0.01, axis=1) % 2).astype(np.int32)
+    noise = rng.rand(*obs.shape) < 0.2
+    obs[noise] = 1 - obs[noise]
+
+    states = np.array([0, 1])
+    start_p = np.array([0.5, 0.5])
+    trans_p = np.array([[0.999, 0.001], [0.001, 0.999]])
+    emission_p = np.array([[0.6, 0.4], [0.4, 0.6]])
+    true = np.array([fast_viterbi(row, states, start_p, trans_p, emission_p)
+                     for row in obs])
+
+    for lag in [None, 50]:
+        decoder = OnlineViterbi(start_p, trans_p, emission_p, lag=lag)
+        test = np.full_like(obs, -1)
+        for start in range(0, 600, 37):
+            first, block = decoder.update(obs[:, start:start + 37])
+            assert first + block.shape[1] <= decoder.n_frames
+            if lag is not None:
+                assert decoder.n_frames - decoder.n_emitted <= lag
+            test[:, first:first + block.shape[1]] = block
+        first, block = decoder.flush()
+        test[:, first:] = block
+        assert np.all(test >= 0), "Not every frame was emitted."
+        if lag is None:
+            assert np.all(test == true), "Online decoding does not match."
+
+    # Paths through clean signals meet within a few frames, so emitting
+    # at the lag agrees with the offline result.
+    clean = (np.cumsum(rng.rand(4, 600) < 0.01, axis=1) % 2)
+    emission_p = np.array([[0.9, 0.1], [0.1, 0.9]])
+    true = batch_viterbi(clean, start_p, trans_p, emission_p)
+    decoder = OnlineViterbi(start_p, trans_p, emission_p, lag=20)
+    first, block = decoder.update(clean[:, :0])
+    assert first == 0 and block.shape == (4, 0)
+    test = np.full_like(clean, -1)
+    for start in range(0, 600, 37):
+        first, block = decoder.update(clean[:, start:start + 37])
+        assert decoder.n_frames - decoder.n_emitted <= 20
+        test[:, first:first + block.shape[1]] = block
+    first, block = decoder.flush()
+    test[:, first:] = block
+    assert np.all(test == true), "Fixed-lag decoding does not match."
+    return
+
+
+def test_decode_packed_cpp():
+    rng = np.random.RandomState(1)
+    obs = (np.cumsum(rng.rand(3, 203) < 0.01, axis=1) % 2).astype(np.int32)
+    noise = rng.rand(*obs.shape) < 0.2
+    obs[noise] = 1 - obs[noise]
+
+    start_p = np.array([0.5, 0.5])
+    trans_p = np.array([[0.999, 0.001], [0.001, 0.999]])
+    emission_p = np.array([[0.6, 0.4], [0.4, 0.6]])
+
+    packed = np.packbits(obs, axis=1)
+    test = decode_packed_cpp(packed, 203, start_p, trans_p, emission_p, 1)
+    true = decode_cpp(obs.copy(), start_p, trans_p, emission_p, 1)
+    assert np.all(np.unpackbits(test, axis=1, count=203) == true)
+    return
+
+
+def test_decode_cpp_batched():
+    rng = np.random.RandomState(2)
+    obs = (np.cumsum(rng.rand(130, 257) < 0.01, axis=1) % 2).astype(np.int32)
+    noise = rng.rand(*obs.shape) < 0.3
+    obs[noise] = 1 - obs[noise]
+
+    start_p = np.array([0.5, 0.5])
+    trans_p = np.array([[0.999, 0.001], [0.001, 0.999]])
+    emission_p = np.array([[0.6, 0.4], [0.4, 0.6]])
+
+    test = decode_cpp(obs.copy(), start_p, trans_p, emission_p, 1)
+    for i in range(obs.shape[0]):
+        true = viterbi_cpp(obs[i].copy(), start_p, trans_p, emission_p)
+        assert np.all(test[i] == true), "Row {} differs.".format(i)
+
+    for cores in [2, 3, 200]:
+        threaded = decode_cpp(obs.copy(), start_p, trans_p, emission_p,
+                              cores)
+        assert np.all(threaded == test), "Threads change the result."
+    return
+
+
+def test_decode_cpp_low_memory():
+    rng = np.random.RandomState(3)
+    obs = (np.cumsum(rng.rand(70, 1001) < 0.01, axis=1) % 2).astype(np.int32)
+    noise = rng.rand(*obs.shape) < 0.3
+    obs[noise] = 1 - obs[noise]
+
+    start_p = np.array([0.5, 0.5])
+    trans_p = np.array([[0.999, 0.001], [0.001, 0.999]])
+    emission_p = np.array([[0.6, 0.4], [0.4, 0.6]])
+
+    true = decode_cpp(obs.copy(), start_p, trans_p, emission_p, 1,
+                      low_memory=False)
+    test = decode_cpp(obs.copy(), start_p, trans_p, emission_p, 2,
+                      low_memory=True)
+    assert np.all(test == true)
+
+    packed = decode_packed_cpp(np.packbits(obs, axis=1), 1001, start_p,
+                               trans_p, emission_p, 1, low_memory=True)
+    assert np.all(np.unpackbits(packed, axis=1, count=1001) == true)
+    return
+
+
+def test_decode_cpp_states():
+    rng = np.random.RandomState(5)
+    obs = (np.cumsum(rng.rand(70, 300) < 0.01, axis=1) % 2).astype(np.int32)
+    noise = rng.rand(*obs.shape) < 0.25
+    obs[noise] = 1 - obs[noise]
+
+    states = np.arange(3)
+    start_p = np.array([0.4, 0.2, 0.4])
+    trans_p = np.array([[0.99, 0.009, 0.001],
+                        [0.05, 0.9, 0.05],
+                        [0.001, 0.009, 0.99]])
+    emission_p = np.array([[0.8, 0.2], [0.5, 0.5], [0.2, 0.8]])
+    true = np.array([fast_viterbi(row, states, start_p, trans_p, emission_p)
+                     for row in obs])
+
+    for low_memory in [False, True]:
+        test = decode_cpp(obs.copy(), start_p, trans_p, emission_p, 2,
+                          low_memory=low_memory)
+        assert np.all(test == true)
+
+    values = np.array([0, 1, 1])
+    packed = decode_packed_cpp(np.packbits(obs, axis=1), 300, start_p,
+                               trans_p, emission_p, 1, values=values)
+    assert np.all(np.unpackbits(packed, axis=1, count=300) == values[true])
+    return
+
+
+def test_batch_viterbi():
+    rng = np.random.RandomState(6)
+    obs = (np.cumsum(rng.rand(20, 300) < 0.01, axis=1) % 2).astype(np.int32)
+    noise = rng.rand(*obs.shape) < 0.3
+    obs[noise] = 1 - obs[noise]
+
+    states = np.array([0, 1])
+    start_p = np.array([0.5, 0.5])
+    trans_p = np.array([[0.999, 0.001], [0.001, 0.999]])
+    emission_p = np.array([[0.6, 0.4], [0.4, 0.6]])
+
+    test = batch_viterbi(obs, start_p, trans_p, emission_p)
+    for row, true_row in zip(test, obs):
+        true = viterbi(true_row, states, start_p, trans_p, emission_p)
+        assert np.all(row == true), "Batched decoding does not match."
+
+    assert batch_viterbi(obs[:0], start_p, trans_p, emission_p).shape ==\
+        (0, 300)
+
+    # Uninformative emissions tie every path. All decoders pick the
+    # lowest state.
+    flat = np.array([[0.5, 0.5], [0.5, 0.5]])
+    true = batch_viterbi(obs, start_p, trans_p, flat)
+    assert np.all(true == 0)
+    assert np.all(true[0] == viterbi(obs[0], states, start_p, trans_p,
+                                     flat))
+    for low_memory in [False, True]:
+        test = decode_cpp(obs.copy(), start_p, trans_p, flat, 2,
+                          low_memory=low_memory)
+        assert np.all(test == true), "Ties are broken differently."
+        test = decode_packed_cpp(np.packbits(obs.astype(np.uint8), axis=1),
+                                 300, start_p, trans_p, flat, 2,
+                                 low_memory=low_memory)
+        assert np.all(np.unpackbits(test, axis=1, count=300) == true)
+    test = obs[0].copy()
+    viterbi_cpp(test, start_p, trans_p, flat)
+    assert np.all(test == true[0])
+    return
+
+
+def test_posteriors():
+    rng = np.random.RandomState(7)
+    obs = (np.cumsum(rng.rand(70, 301) < 0.01, axis=1) % 2).astype(np.int32)
+    noise = rng.rand(*obs.shape) < 0.25
+    obs[noise] = 1 - obs[noise]
+
+    start_p = np.array([0.5, 0.5])
+    trans_p = np.array([[0.999, 0.001], [0.001, 0.999]])
+    emission_p = np.array([[0.6, 0.4], [0.4, 0.6]])
+
+    probs = batch_posteriors(obs, start_p, trans_p, emission_p)
+    assert np.all((probs >= 0) & (probs <= 1))
+    # The decoded path mostly follows the more likely state.
+    decoded = batch_viterbi(obs, start_p, trans_p, emission_p)
+    assert np.mean((probs > 0.5) == decoded) > 0.9
+
+    test = posteriors_cpp(obs, start_p, trans_p, emission_p, 2)
+    assert test.dtype == np.uint8
+    assert np.all(test == quantize(probs))
+
+    # Bonded and transient states of a three-state model.
+    start_p = np.array([0.4, 0.2, 0.4])
+    trans_p = np.array([[0.99, 0.009, 0.001],
+                        [0.05, 0.9, 0.05],
+                        [0.001, 0.009, 0.99]])
+    emission_p = np.array([[0.8, 0.2], [0.5, 0.5], [0.2, 0.8]])
+    values = [0, 1, 1]
+    probs = batch_posteriors(obs, start_p, trans_p, emission_p, values)
+    test = posteriors_cpp(obs, start_p, trans_p, emission_p, 1,
+                          values=values)
+    assert np.all(test == quantize(probs))
+    return
+
+
+def test_baum_welch():
+    rng = np.random.RandomState(8)
+    obs = (np.cumsum(rng.rand(100, 2000) < 0.002, axis=1) % 2)
+    noise = rng.rand(*obs.shape) < 0.15
+    obs[noise] = 1 - obs[noise]
+    obs = obs.astype(np.int32)
+
+    start_p = np.array([0.5, 0.5])
+    trans_p = np.array([[0.9, 0.1], [0.1, 0.9]])
+    emission_p = np.array([[0.6, 0.4], [0.4, 0.6]])
+
+    true = expected_counts(obs[:10, :300], start_p, trans_p, emission_p)
+    test = expected_counts_cpp(obs[:10, :300], start_p, trans_p,
+                               emission_p, 2)
+    for a, b in zip(true, test):
+        assert np.allclose(a, b)
+    assert np.isclose(true[0].sum(), 10)
+    assert np.isclose(true[1].sum(), 10 * 299)
+    assert np.isclose(true[2].sum(), 10 * 300)
+
+    fit_start, fit_trans, fit_emission, loglik = \
+        baum_welch(obs, start_p, trans_p, emission_p)
+    assert np.allclose(np.diag(fit_trans), 0.998, atol=0.001)
+    assert np.allclose(np.diag(fit_emission), 0.85, atol=0.01)
+    assert loglik > expected_counts_cpp(obs, start_p, trans_p,
+                                        emission_p)[3]
+    return
+
+
+def test_decode_cpp_groups():
+    rng = np.random.RandomState(5)
+    obs = (rng.rand(150, 400) < 0.5).astype(np.int32)
+    groups = rng.randint(0, 3, 150)
+    start_p = np.array([[0.5, 0.5], [0.3, 0.7], [0.9, 0.1]])
+    trans_p = np.array([[[0.999, 0.001], [0.001, 0.999]],
+                        [[0.99, 0.01], [0.01, 0.99]],
+                        [[0.9, 0.1], [0.2, 0.8]]])
+    emission_p = np.array([[[0.6, 0.4], [0.4, 0.6]],
+                           [[0.8, 0.2], [0.3, 0.7]],
+                           [[0.7, 0.3], [0.3, 0.7]]])
+
+    true = np.empty_like(obs)
+    probs = np.empty(obs.shape, dtype=np.uint8)
+    for k in range(3):
+        mask = groups == k
+        true[mask] = decode_cpp(obs[mask].copy(), start_p[k], trans_p[k],
+                                emission_p[k], 1)
+        probs[mask] = posteriors_cpp(obs[mask].copy(), start_p[k],
+                                     trans_p[k], emission_p[k])
+
+    test = decode_cpp(obs.copy(), start_p, trans_p, emission_p, 4,
+                      groups=groups)
+    assert np.all(test == true)
+    packed = decode_packed_cpp(
+        np.packbits(obs.astype(np.uint8), axis=1), 400, start_p, trans_p,
+        emission_p, 2, groups=groups)
+    assert np.all(np.unpackbits(packed, axis=1)[:, :400] == true)
+    test = posteriors_cpp(obs, start_p, trans_p, emission_p, 3,
+                          groups=groups)
+    assert np.all(test == probs)
+    return
+
+
+def test_decode_cpp_rows():
+    rng = np.random.RandomState(6)
+    obs = (rng.rand(20, 300) < 0.5).astype(np.int32)
+    rows = np.array([17, 3, 8, 11])
+    groups = np.array([1, 0, 1, 0])
+    start_p = np.array([[0.5, 0.5], [0.3, 0.7]])
+    trans_p = np.array([[[0.999, 0.001], [0.001, 0.999]],
+                        [[0.9, 0.1], [0.2, 0.8]]])
+    emission_p = np.array([[[0.6, 0.4], [0.4, 0.6]],
+                           [[0.8, 0.2], [0.3, 0.7]]])
+    others = np.setdiff1d(np.arange(20), rows)
+
+    for values in [None, [1, 0]]:
+        true = decode_cpp(obs[rows].copy(), start_p, trans_p, emission_p, 1,
+                          values=values, groups=groups)
+        test = obs.copy()
+        out = decode_cpp(test, start_p, trans_p, emission_p, 2,
+                         values=values, groups=groups, rows=rows)
+        assert out is test, "Signals must be decoded in place."
+        assert np.all(test[rows] == true)
+        assert np.all(test[others] == obs[others])
+
+        packed = np.packbits(obs.astype(np.uint8), axis=1)
+        decode_packed_cpp(packed, 300, start_p, trans_p, emission_p, 2,
+                          values=values, groups=groups, rows=rows)
+        test = np.unpackbits(packed, axis=1)[:, :300]
+        assert np.all(test[rows] == true)
+        assert np.all(test[others] == obs[others])
+    return
+
+
+def test_decode_bytes_cpp():
+    rng = np.random.RandomState(7)
+    obs = (np.cumsum(rng.rand(40, 250) < 0.01, axis=1) % 2).astype(np.int32)
+    noise = rng.rand(*obs.shape) < 0.3
+    obs[noise] = 1 - obs[noise]
+    start_p = np.array([0.5, 0.5])
+    trans_p = np.array([[0.999, 0.001], [0.001, 0.999]])
+    emission_p = np.array([[0.6, 0.4], [0.4, 0.6]])
+
+    for values in [None, [0, 1, 1]]:
+        if values is None:
+            params = (start_p, trans_p, emission_p)
+        else:
+            params = (np.array([0.4, 0.2, 0.4]),
+                      np.array([[0.99, 0.01, 0.0], [0.01, 0.98, 0.01],
+                                [0.0, 0.01, 0.99]]),
+                      np.array([[0.7, 0.3], [0.5, 0.5], [0.3, 0.7]]))
+        true = decode_cpp(obs.copy(), *params, 1, values=values)
+        test = obs.astype(np.uint8)
+        out = decode_bytes_cpp(test, *params, 2, values=values)
+        assert out is test and test.dtype == np.uint8
+        assert np.all(test == true)
+    return
@@ -2,7 +2,8 @@ import numpy as np
 from rdkit import Chem
 
 from ..molecules import set_structure, estimate_bonds, build_radical_graph,\
-    set_positive_charges
+    set_positive_charges, cmat_to_structure, contact_matrix_to_SMILES,\
+    fragment_SMILES, StructureCache
 
 
 def test_set_structure():
@@ -115,3 +116,64 @@ def test_set_positive_charges():
     assert mol.GetAtomWithIdx(0).GetFormalCharge() == 1,\
         "Oxygen must have a positive charge."
     return
+
+
+def test_structure_cache():
+    atom_list = ['O', 'H', 'H', 'O', 'H', 'H']
+    water = np.zeros((6, 6), dtype=np.int32)
+    water[0, 1] = water[0, 2] = water[3, 4] = water[3, 5] = 1
+    hydroxide = water.copy()
+    hydroxide[3, 5] = 0
+    hydroxide[0, 5] = 1
+
+    cache = StructureCache(maxsize=1)
+    for cmat in [water, water, hydroxide, water]:
+        smiles, mol = cache.get(cmat, atom_list)
+        true_smiles, true_mol = cmat_to_structure(cmat, atom_list)
+        assert smiles == true_smiles
+        assert Chem.MolToSmiles(mol) == Chem.MolToSmiles(true_mol)
+        assert cache.smiles(cmat, atom_list) == true_smiles
+
+    # The second water is a hit, the last one had been evicted.
+    assert cache.stats() == {'hits': 5, 'misses': 3, 'size': 1,
+                             'hit_rate': 5 / 8}
+    cache.clear()
+    assert len(cache) == 0 and cache.hit_rate == 0.0
+
+    # SMILES built by worker processes match the serial ones. Batches
+    # of more patterns than fit in the cache are built one at a time.
+    proton = water.copy()
+    proton[3, 5] = 0
+    cmats = [water, hydroxide, water, proton, hydroxide, proton, water]
+    true = [cmat_to_structure(cmat, atom_list)[0] for cmat in cmats]
+    for maxsize, cores, misses in [(4096, 1, 3), (4096, 2, 3), (2, 1, 4),
+                                   (2, 2, 4)]:
+        cache = StructureCache(maxsize=maxsize)
+        with cache.workers(atom_list, cores):
+            assert list(cache.map_smiles(cmats, atom_list)) == true
+        assert cache.misses == misses and cache.hits == 7 - misses
+        assert len(cache) == min(maxsize, 3)
+
+        # Molecules are only built on request.
+        smiles, mol = cache.get(water, atom_list)
+        true_mol = cmat_to_structure(water, atom_list)[1]
+        assert Chem.MolToSmiles(mol) == Chem.MolToSmiles(true_mol)
+    return
+
+
+def test_fragment_SMILES():
+    atom_list = ['O', 'H', 'H', 'Li', 'O', 'H', 'H', 'C', 'Cl', 'H']
+    cmat = np.zeros((10, 10), dtype=np.int32)
+    cmat[0, 1] = cmat[0, 2] = cmat[4, 5] = cmat[4, 6] = 1
+    cmat[7, 8] = cmat[7, 9] = 1
+    # Bonds to Li are left out of the structure.
+    cmat[0, 3] = 1
+
+    memo = {}
+    smiles = fragment_SMILES(cmat, atom_list, memo=memo)
+    assert smiles == 'O.O.[CH]Cl.[Li]'
+    assert smiles == contact_matrix_to_SMILES(cmat, atom_list)
+    assert smiles == cmat_to_structure(cmat, atom_list)[0]
+    # Both waters share one entry.
+    assert len(memo) == 3
+    return
@@ -5,7 +5,8 @@ import pandas as pd
 
 from ..smiles import (get_mol_dict, remove_common_molecules,
                       to_chemical_equation, find_reaction,
-                      remove_consecutive_repeats, uniqueSMILES)
+                      remove_consecutive_repeats, uniqueSMILES,
+                      StructureRecords)
 
 
 def test_get_mol_dict():
@@ -104,6 +105,31 @@ def test_remove_consecutive_repeats():
     for col in test_df_after:
         assert np.all(true_df_after[col] == test_df_after[col]),\
             "Lists not the same."
+
+    assert remove_consecutive_repeats(test_list) == true_after
+    test_tuples = list(zip(test_list, range(len(test_list))))
+    assert remove_consecutive_repeats(test_tuples) ==\
+        [('a', 0), ('b', 3), ('c', 4), ('a', 6)]
+    return
+
+
+def test_structure_records():
+    test_list = ['a', 'a', 'a', 'b', 'c', 'c', 'a']
+    records = StructureRecords()
+    for f, smi in enumerate(test_list):
+        records.append(smi, f, 10 * f, molecule='mol' if f == 4 else None)
+    assert len(records) == 7
+    assert records.smiles == test_list
+
+    df = records.to_frame(rows=records.changes(),
+                          molecule=lambda f: 'built{}'.format(f))
+    assert list(df.columns) == ['smiles', 'molecule', 'frame',
+                                'transition_frame']
+    assert list(df['smiles']) == ['a', 'b', 'c', 'a']
+    assert list(df['molecule']) == ['built0', 'built3', 'mol', 'built6']
+    assert list(df['frame']) == [0, 3, 4, 6]
+    assert list(df['transition_frame']) == [0, 30, 40, 60]
+    assert len(StructureRecords().to_frame()) == 0
     return
 
 
@@ -1,8 +1,10 @@
 from os.path import abspath, dirname, join
 
+import numpy as np
 from numpy.testing import assert_almost_equal
 
-from ..util import getpath, Scaler, find_nearest
+from ..util import (getpath, Scaler, find_nearest, find_nearest_sorted,
+                    frames_near)
 
 
 def test_getpath():
@@ -24,6 +26,22 @@ def test_find_nearest():
         assert val == 5
 
 
+def test_find_nearest_sorted():
+    values = np.arange(-3, 14)
+    true = [find_nearest(n, [0, 5, 10]) for n in values]
+    assert np.all(find_nearest_sorted(values, [0, 5, 10]) == true)
+    return
+
+
+def test_frames_near():
+    frames = [-2, 10, 14, 40, 98]
+    true = [f for f in range(100)
+            if np.isclose(np.array(frames) - f, 0, atol=3).any()]
+    assert np.all(frames_near(frames, 3, 100) == true)
+    assert frames_near([], 3, 100).size == 0
+    return
+
+
 def test_set_data_range():
     scaler = Scaler()
     scaler.set_data_range(0, 4)
@@ -69,6 +69,68 @@ def find_nearest(n, arr):
     return arr[idx]
 
 
+def find_nearest_sorted(values, arr):
+    """Finds the nearest value in a sorted array for many values.
+
+    Uses a binary search instead of comparing every value against the
+    whole array. Ties go to the smaller value, like `find_nearest`.
+
+    Parameters
+    ----------
+    values : array-like container of int or float
+    arr : array-like container of int or float
+        Sorted in ascending order. Must not be empty.
+
+    Returns
+    -------
+    numpy.ndarray
+        Value of `arr` nearest to each of `values`."""
+
+    values = np.asarray(values)
+    arr = np.asarray(arr)
+    right = np.minimum(np.searchsorted(arr, values), len(arr) - 1)
+    left = np.maximum(right - 1, 0)
+    use_left = np.abs(values - arr[left]) <= np.abs(arr[right] - values)
+    return np.where(use_left, arr[left], arr[right])
+
+
+def frames_near(frames, tol, n_frames):
+    """Finds every frame within `tol` frames of any of `frames`.
+
+    The windows `[t - tol, t + tol]` around the sorted frames are
+    merged where they overlap and expanded, so the cost only depends
+    on the number of frames returned.
+
+    Parameters
+    ----------
+    frames : array-like container of int
+    tol : int
+    n_frames : int
+        Number of frames in the trajectory. Windows are clipped to
+        `[0, n_frames)`.
+
+    Returns
+    -------
+    numpy.ndarray
+        Sorted indices of the frames within the windows."""
+
+    frames = np.unique(np.asarray(frames, dtype=np.int64))
+    starts = np.clip(frames - tol, 0, n_frames)
+    stops = np.clip(frames + tol + 1, 0, n_frames)
+
+    # A window starts a new block unless it overlaps the previous one.
+    # With equal widths the stops are sorted as well.
+    first = np.ones(len(frames), dtype=bool)
+    first[1:] = starts[1:] > stops[:-1]
+    last = np.ones(len(frames), dtype=bool)
+    last[:-1] = first[1:]
+    starts, stops = starts[first], stops[last]
+
+    lengths = np.maximum(stops - starts, 0)
+    offsets = np.cumsum(lengths) - lengths
+    return np.arange(lengths.sum()) - np.repeat(offsets - starts, lengths)
+
+
 class Scaler:
     def __init__(self, target_min=0, target_max=1):
         self.target_min = target_min
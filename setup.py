@@ -1,5 +1,9 @@
 import os
+import shutil
+import tempfile
 from setuptools import setup, find_packages
+from setuptools.command.build_ext import build_ext as _build_ext
+from setuptools.errors import CompileError, LinkError
 from setuptools.extension import Extension
 from Cython.Build import cythonize
 
@@ -13,17 +17,54 @@ with open(ver_file) as f:
     exec(f.read())
 
 
+def has_openmp(compiler):
+    """Check whether `compiler` can build and link OpenMP code.
+
+    Set ``MDSTATES_NO_OPENMP=1`` to skip OpenMP. Without it, the
+    decoder falls back to C++ threads.
+    """
+    if os.environ.get('MDSTATES_NO_OPENMP'):
+        return False
+
+    tmpdir = tempfile.mkdtemp()
+    source = os.path.join(tmpdir, 'check_openmp.c')
+    with open(source, 'w') as f:
+        f.write('#include <omp.h>\n'
+                'int main(void) { return omp_get_max_threads() < 1; }\n')
+    try:
+        objects = compiler.compile([source], output_dir=tmpdir,
+                                   extra_postargs=['-fopenmp'])
+        compiler.link_executable(objects, 'check_openmp',
+                                 output_dir=tmpdir,
+                                 extra_postargs=['-fopenmp'])
+    except (CompileError, LinkError):
+        return False
+    finally:
+        shutil.rmtree(tmpdir)
+    return True
+
+
+class build_ext(_build_ext):
+    """Adds the OpenMP flags when the configured compiler supports
+    them."""
+
+    def build_extensions(self):
+        if has_openmp(self.compiler):
+            for ext in self.extensions:
+                ext.extra_compile_args.append("-fopenmp")
+                ext.extra_link_args.append("-fopenmp")
+        super().build_extensions()
+
+
 ext_modules = [Extension(
                name="mdstates.hmm_cython",
                sources=["mdstates/hmm_cython.pyx",
-                        # "mdstates/hmm.cpp",
-                        "mdstates/hmm_serial.cpp",
+                        "mdstates/hmm.cpp",
                         ],
                extra_compile_args=["-std=c++11",
-                                   # "-fopenmp",
                                    "-O3",
                                    ],
-               # extra_link_args=["-fopenmp"],
+               extra_link_args=["-pthread"],
                include_dirs=[np.get_include()],
                language="c++",
                )]
@@ -44,7 +85,7 @@ opts = dict(name=NAME,
             packages=PACKAGES,
             package_data=PACKAGE_DATA,
             install_requires=REQUIRES,
-            # cmdclass={'build_ext': build_ext},
+            cmdclass={'build_ext': build_ext},
             ext_modules=cythonize(ext_modules),
             # requires=REQUIRES
             )